@@ -1,6 +1,8 @@
+import os
 from app import create_app
+from app.config import configs
 
-app = create_app()
+app = create_app(configs[os.environ.get('APP_CONFIG', 'default')])
 
 if __name__ == "__main__":
     app.run(port=5000, debug=True, host='0.0.0.0')
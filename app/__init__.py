@@ -2,10 +2,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
-from apscheduler.schedulers.background import BackgroundScheduler
 from app.config import Config
 from flask_migrate import Migrate
-from app.blacklist import blacklist
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -17,23 +15,47 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     db.init_app(app)
+    from app.database import configure_engine
+    configure_engine(app, db)
     bcrypt.init_app(app)
     jwt.init_app(app)
     migrate.init_app(app, db)
    
-    from app.utils import create_recurring_expenses  # Now safe to import
+    from app.blacklist import create_revocation_store
+    from app.rollups import rollups_cli
+    from app.exports import expenses_cli
+    from app.notifications import create_notification_dispatcher
+    from app.rules import create_rule_cache
+    from app.passwords import create_password_hasher
+    from app.ratelimit import create_login_limiter
+    from app.scheduler import create_scheduler, scheduler_cli
+    from app.cache import create_response_cache
+    from app.categories import create_category_registry
+    from app.fx import create_fx_converter, fx_cli
+    from app.search import search_cli
+    from app.categorizer import categorizer_cli
+    from app.routes import main
+    app.register_blueprint(main)
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(expenses_cli)
+    app.cli.add_command(scheduler_cli)
+    app.cli.add_command(fx_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(categorizer_cli)
 
-    def start_scheduler():
-        scheduler = BackgroundScheduler()
-        scheduler.add_job(func=create_recurring_expenses, trigger="interval", hours=24)
-        scheduler.start()
-        app.logger.info("Scheduler started.")
+    revocation_store = create_revocation_store(app)
+    create_notification_dispatcher(app)
+    create_rule_cache(app)
+    create_password_hasher(app)
+    create_login_limiter(app)
+    create_response_cache(app)
+    create_category_registry(app)
+    create_fx_converter(app)
 
-    start_scheduler()
+    create_scheduler(app)
 
     @jwt.token_in_blocklist_loader
     def check_if_token_is_revoked(jwt_header, jwt_payload):
-        jti = jwt_payload['jti']
-        return jti in blacklist
+        return revocation_store.is_revoked(jwt_payload['jti'])
 
     return app
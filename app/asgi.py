@@ -0,0 +1,314 @@
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, current_app
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.cache import cache_key, cached_entry, store_entry, mark_cached, version_query
+from app.categories import version_query as category_version_query, categories_query
+from app.database import set_sqlite_pragmas
+from app.notifications import notifications_query, serialize_notification
+from app.routes import parse_date, parse_limit, wants_ndjson, NDJSON
+from app.fx import version_query as fx_version_query, currencies_query, rates_query, reporting_currency_query
+from app.money import DEFAULT_CURRENCY
+from app.summary import summary_query, summarize, parse_group_by, conversion_query, conversion_keys
+from app.utils import expenses_query, encode_cursor, decode_cursor, serialize_expense
+
+# Sync drivers in SQLALCHEMY_DATABASE_URI -> the async driver for the same database
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    url = make_url(url)
+    if url.drivername not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {url.drivername}.")
+    if url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:'):
+        raise ValueError("The async engine needs a database file, an in-memory SQLite database is per connection.")
+    return url.set(drivername=ASYNC_DRIVERS[url.drivername])
+
+def wsgi_environ(scope, body):
+    """The WSGI environ of an ASGI http scope, so Flask and werkzeug can parse the request."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+def start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+
+
+class AsyncStream:
+    """A streamed response body produced by an async iterator of bytes."""
+
+    def __init__(self, chunks, mimetype):
+        self.chunks = chunks
+        self.mimetype = mimetype
+
+
+class AsyncReadApp:
+    """
+    ASGI app answering the read endpoints on an event loop, Flask for the rest.
+
+    GET /expenses, /expenses/summary and /notifications run the same
+    statements as their Flask views through an async engine, so a request
+    waiting on the database holds a coroutine instead of a thread. Flask
+    still parses the request, checks the JWT (error handlers and revocation
+    included), renders JSON and shares the response cache, so answers, cache
+    entries and ETags are the same on both paths. Every other request goes to
+    the Flask app on a thread pool of wsgi_workers.
+
+    The JWT revocation check still uses the sync session. The SQL store only
+    reaches the database once per TOKEN_REVOCATION_SYNC_SECONDS, with one
+    indexed query.
+    """
+
+    def __init__(self, flask_app, wsgi_workers=8):
+        self.flask_app = flask_app
+        config = flask_app.config
+        options = {
+            name: value for name, value in config.get('SQLALCHEMY_ENGINE_OPTIONS', {}).items()
+            if name in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'connect_args')
+        }
+        self.engine = create_async_engine(async_database_url(config['SQLALCHEMY_DATABASE_URI']), **options)
+        if config.get('SQLITE_PRAGMAS') and self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine.sync_engine, 'connect', set_sqlite_pragmas(config['SQLITE_PRAGMAS']))
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.executor = ThreadPoolExecutor(max_workers=wsgi_workers, thread_name_prefix='wsgi')
+        self.routes = {
+            '/expenses': self.show_expenses,
+            '/expenses/summary': self.show_expense_summary,
+            '/notifications': self.show_notifications,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            view = self.routes.get(scope['path']) if scope['method'] == 'GET' else None
+            if view is None:
+                await self.call_flask(scope, receive, send)
+            else:
+                await self.call_view(view, scope, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def close(self):
+        await self.engine.dispose()
+        self.executor.shutdown(wait=False)
+
+    async def call_view(self, view, scope, send):
+        with self.flask_app.request_context(wsgi_environ(scope, b'')):
+            async with self.sessions() as session:
+                try:
+                    verify_jwt_in_request()
+                    response = await self.cached(view, session, int(get_jwt_identity()))
+                except Exception as e:
+                    # JWT errors get the same answers as on the Flask path; anything else is a 500
+                    try:
+                        response = self.flask_app.make_response(self.flask_app.handle_user_exception(e))
+                    except Exception as e:
+                        response = self.flask_app.make_response(self.flask_app.handle_exception(e))
+                if isinstance(response, AsyncStream):
+                    await send(start_message(200, [('Content-Type', response.mimetype)]))
+                    async for chunk in response.chunks:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+            await send(start_message(response.status_code, response.headers.to_wsgi_list()))
+            await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def render(self, view, session, user_id):
+        result = await view(session, user_id)
+        return result if isinstance(result, AsyncStream) else self.flask_app.make_response(result)
+
+    async def cached(self, view, session, user_id):
+        # Same steps as cached_response, with the version read by the async session
+        cache = current_app.extensions['response_cache']
+        if cache is None:
+            return await self.render(view, session, user_id)
+        key, etag = cache_key(user_id, await session.scalar(version_query(user_id)) or 0)
+        response = cached_entry(cache, key, etag)
+        if response is None:
+            response = await self.render(view, session, user_id)
+            if isinstance(response, AsyncStream) or not store_entry(cache, key, response):
+                return response
+        return mark_cached(response, etag)
+
+    async def category_id_for(self, session):
+        """The category registry's name lookup, after the version check sync lookups do in their transaction."""
+        registry = current_app.extensions['category_registry']
+        version = await session.scalar(category_version_query()) or 0
+        if version != registry.version:
+            registry.load(version, (await session.execute(categories_query())).all())
+        return registry.by_name.get
+
+    async def fx_converter(self, session):
+        """The fx converter, after the version check sync conversions do in their transaction."""
+        converter = current_app.extensions['fx_converter']
+        version = await session.scalar(fx_version_query()) or 0
+        if version != converter.version:
+            converter.load(version, (await session.scalars(currencies_query())).all())
+        return converter
+
+    async def fx_factors(self, session, keys):
+        """FxConverter.factors with the version check and the misses read by the async session."""
+        converter = await self.fx_converter(session)
+        factors = converter.cached(keys)
+        missing = [key for key in keys if key not in factors]
+        if missing:
+            factors.update(converter.resolve(missing, (await session.execute(rates_query(missing, converter.base))).all()))
+        return factors
+
+    def error(self, e):
+        return self.flask_app.json.response({"message": str(e)}), 400
+
+    async def show_expenses(self, session, user_id):
+        args = request.args
+        sort_by = args.get('sort_by', 'date')
+        order = args.get('order', 'desc')
+        try:
+            query = expenses_query(
+                user_id,
+                category=args.get('category'),
+                start_date=parse_date(args.get('start_date')),
+                end_date=parse_date(args.get('end_date')),
+                sort_by=sort_by,
+                order=order,
+                after=decode_cursor(args.get('cursor'), sort_by, order),
+                category_id_for=await self.category_id_for(session) if args.get('category') else None,
+            )
+            limit = parse_limit(args.get('limit'))
+        except ValueError as e:
+            return self.error(e)
+
+        if wants_ndjson():
+            async def generate():
+                result = await session.stream(query.execution_options(yield_per=current_app.config['EXPENSES_PAGE_SIZE']))
+                async for expense in result:
+                    yield (json.dumps(serialize_expense(expense)) + '\n').encode('utf-8')
+            return AsyncStream(generate(), NDJSON)
+
+        expenses = (await session.execute(query.limit(limit + 1))).all()
+        response = self.flask_app.json.response([serialize_expense(expense) for expense in expenses[:limit]])
+        if len(expenses) > limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(expenses[limit - 1], sort_by, order)
+        return response
+
+    async def show_expense_summary(self, session, user_id):
+        args = request.args
+        dialect_name = self.engine.dialect.name
+        try:
+            group_by = parse_group_by(args.get('group_by'))
+            # Same steps as parse_currency and expense_summary
+            currency = args.get('currency', '').strip().upper()
+            if currency:
+                (await self.fx_converter(session)).check_currency(currency)
+            else:
+                currency = await session.scalar(reporting_currency_query(user_id)) or DEFAULT_CURRENCY
+            filters = {
+                'category': args.get('category'),
+                'start_date': parse_date(args.get('start_date')),
+                'end_date': parse_date(args.get('end_date')),
+                'category_id_for': await self.category_id_for(session) if args.get('category') else None,
+            }
+            rows = (await session.execute(conversion_query(user_id, currency, dialect_name, **filters))).all()
+            factors = await self.fx_factors(session, conversion_keys(rows, currency)) if rows else None
+            query = summary_query(user_id, group_by, dialect_name, factors=factors, **filters)
+        except ValueError as e:
+            return self.error(e)
+        rows = (await session.execute(query)).mappings().all()
+        return self.flask_app.json.response(summarize(rows, group_by, currency))
+
+    async def show_notifications(self, session, user_id):
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            after = decode_cursor(request.args.get('cursor'), 'created_at', 'desc')
+        except ValueError as e:
+            return self.error(e)
+        query = notifications_query(user_id, request.args.get('unread') == 'true', limit + 1, after)
+        notifications = (await session.execute(query)).all()
+        response = self.flask_app.json.response([serialize_notification(notification) for notification in notifications[:limit]])
+        if len(notifications) > limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(notifications[limit - 1], 'created_at', 'desc')
+        return response
+
+    async def call_flask(self, scope, receive, send):
+        environ = wsgi_environ(scope, await read_body(receive))
+        loop = asyncio.get_running_loop()
+
+        def run():
+            # One pool thread runs the whole request, streamed bodies included, and waits on each send
+            def start_response(status, headers, exc_info=None):
+                message = start_message(int(status.split(' ', 1)[0]), headers)
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+            body = self.flask_app.wsgi_app(environ, start_response)
+            try:
+                for chunk in body:
+                    if chunk:
+                        asyncio.run_coroutine_threadsafe(send({'type': 'http.response.body', 'body': chunk, 'more_body': True}), loop).result()
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            asyncio.run_coroutine_threadsafe(send({'type': 'http.response.body', 'body': b''}), loop).result()
+
+        await loop.run_in_executor(self.executor, run)
+
+
+def create_asgi_app(flask_app):
+    """Wrap an app from create_app for an ASGI server; ASGI_WSGI_WORKERS threads serve the non-async routes."""
+    asgi_app = AsyncReadApp(flask_app, wsgi_workers=flask_app.config.get('ASGI_WSGI_WORKERS', 8))
+    flask_app.extensions['asgi'] = asgi_app
+    return asgi_app
@@ -1 +1,106 @@
-blacklist = set()
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+
+# Used when a token carries no exp claim (JWT_ACCESS_TOKEN_EXPIRES = False)
+DEFAULT_REVOCATION_TTL = 365 * 24 * 3600
+
+
+class MemoryRevocationStore:
+    """Revoked jtis kept in this process only, each dropped once its token has expired."""
+
+    def __init__(self):
+        self.revoked = {}  # jti -> exp (unix timestamp)
+
+    def revoke(self, jti, exp):
+        self.revoked[jti] = exp
+
+    def is_revoked(self, jti):
+        exp = self.revoked.get(jti)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            # The token is expired anyway, JWT validation will reject it from now on
+            self.revoked.pop(jti, None)
+            return False
+        return True
+
+    def prune(self):
+        now = time.time()
+        expired = [jti for jti, exp in self.revoked.items() if exp <= now]
+        for jti in expired:
+            self.revoked.pop(jti, None)
+        return len(expired)
+
+
+class SQLRevocationStore(MemoryRevocationStore):
+    """
+    Revocations persisted in the revoked_token table and shared by every worker.
+
+    Lookups are answered from the in-memory mirror. The mirror pulls rows added
+    by other workers at most every sync_interval seconds, by id, so the
+    per-request check is a dict lookup rather than a database round trip.
+    """
+
+    def __init__(self, sync_interval=1.0):
+        super().__init__()
+        self.sync_interval = sync_interval
+        self.last_id = 0
+        self.next_sync = 0.0
+        self.lock = threading.Lock()
+
+    def revoke(self, jti, exp):
+        from app.models import RevokedToken, db  # Import inside the function to avoid circular imports
+        db.session.add(RevokedToken(jti=jti, expires_at=datetime.utcfromtimestamp(exp)))
+        db.session.commit()
+        super().revoke(jti, exp)
+
+    def is_revoked(self, jti):
+        if time.monotonic() >= self.next_sync:
+            self.sync()
+        return super().is_revoked(jti)
+
+    def sync(self):
+        from app.models import RevokedToken, db  # Import inside the function to avoid circular imports
+        from sqlalchemy import select
+
+        # Only one thread needs to refresh, the others keep using the current mirror
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            rows = db.session.execute(
+                select(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at)
+                .where(RevokedToken.id > self.last_id, RevokedToken.expires_at > datetime.utcnow())
+                .order_by(RevokedToken.id)
+            ).all()
+            for row in rows:
+                self.revoked[row.jti] = row.expires_at.replace(tzinfo=timezone.utc).timestamp()
+            if rows:
+                self.last_id = rows[-1].id
+            self.next_sync = time.monotonic() + self.sync_interval
+        finally:
+            self.lock.release()
+
+    def prune(self):
+        from app.models import RevokedToken, db  # Import inside the function to avoid circular imports
+        deleted = RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+        db.session.commit()
+        super().prune()
+        return deleted
+
+
+def create_revocation_store(app):
+    backend = app.config.get('TOKEN_REVOCATION_BACKEND', 'sql')
+    if backend == 'sql':
+        store = SQLRevocationStore(sync_interval=app.config.get('TOKEN_REVOCATION_SYNC_SECONDS', 1.0))
+    elif backend == 'memory':
+        store = MemoryRevocationStore()
+    else:
+        raise ValueError("TOKEN_REVOCATION_BACKEND must be 'sql' or 'memory'.")
+    app.extensions['revocation_store'] = store
+    return store
+
+def revoke_token(jwt_payload):
+    exp = jwt_payload.get('exp') or time.time() + DEFAULT_REVOCATION_TTL
+    current_app.extensions['revocation_store'].revoke(jwt_payload['jti'], exp)
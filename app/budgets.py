@@ -0,0 +1,215 @@
+from datetime import datetime, time, timedelta
+from dateutil.relativedelta import relativedelta
+from flask import current_app
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Budget, Expenses
+from app.money import format_minor, from_minor
+from app.fx import convert_minor
+from app.rollups import flushed_changes
+from app.notifications import queue_notifications
+
+
+def period_bounds(period, day):
+    """First day of the period containing day, and the first day of the next one."""
+    if period == 'weekly':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    if period == 'monthly':
+        start = day.replace(day=1)
+        return start, start + relativedelta(months=1)
+    start = day.replace(month=1, day=1)
+    return start, start.replace(year=start.year + 1)
+
+def today():
+    return datetime.utcnow().date()
+
+
+def converted_total(rows, currency):
+    """Expense rows (dicts or rows with date, currency and amount_minor) added up in currency, each at its day's rate."""
+    if not rows:
+        return 0
+    factors = current_app.extensions['fx_converter'].factors({(row['date'].date(), row['currency'], currency) for row in rows})
+    return sum(convert_minor(row['amount_minor'], factors[(row['date'].date(), row['currency'], currency)]) for row in rows)
+
+def period_spend(connection, budget, start, end):
+    """What the budget's user spent in its category from start to end, read from the (user_id, category_id, date) index."""
+    return converted_total(connection.execute(
+        select(Expenses.date, Expenses.currency, Expenses.amount_minor).where(
+            Expenses.user_id == budget['user_id'],
+            Expenses.category_id == budget['category_id'],
+            Expenses.date >= datetime.combine(start, time()),
+            Expenses.date < datetime.combine(end, time()),
+        )
+    ).mappings().all(), budget['currency'])
+
+def roll_over(connection, budget, day):
+    """
+    Move a budget to the period containing day and recount its spend there, returning the row as stored.
+
+    This is the only place spend is counted from the expenses, once per
+    budget and period, on the first read or write after the period starts.
+    The update only applies if no other transaction moved the budget first.
+    """
+    budgets = Budget.__table__
+    start, end = period_bounds(budget['period'], day)
+    connection.execute(
+        update(budgets)
+        .where(budgets.c.id == budget['id'], budgets.c.period_start == budget['period_start'])
+        .values(period_start=start, spent_minor=period_spend(connection, budget, start, end), alerted_percent=0)
+    )
+    return connection.execute(select(budgets).where(budgets.c.id == budget['id'])).mappings().one()
+
+def crossed_threshold(connection, budget):
+    """
+    The notification for the highest threshold the budget's spend has reached, if it was not sent yet this period.
+
+    Thresholds are alert_percent and 100. Each is notified at most once a
+    period, even when spend drops back under it and crosses it again.
+    """
+    spent, limit = budget['spent_minor'], budget['amount_minor']
+    reached = [level for level in (budget['alert_percent'], 100) if spent * 100 >= limit * level]
+    if not reached or max(reached) <= budget['alerted_percent']:
+        return None
+    level = max(reached)
+    budgets = Budget.__table__
+    # Whoever moves alerted_percent sends the notification, so concurrent writers send it once
+    claimed = connection.execute(
+        update(budgets).where(budgets.c.id == budget['id'], budgets.c.alerted_percent < level).values(alerted_percent=level)
+    ).rowcount
+    if not claimed:
+        return None
+    name = current_app.extensions['category_registry'].names_for([budget['category_id']]).get(budget['category_id'])
+    return {
+        'user_id': budget['user_id'],
+        'type': 'budget',
+        'message': f"{budget['period'].capitalize()} budget for {name} {'used up' if level >= 100 else f'at {level}%'}: "
+                   f"{format_minor(spent, budget['currency'])} of {format_minor(limit, budget['currency'])} "
+                   f"{budget['currency']} spent",
+    }
+
+
+def update_budgets(connection, added=(), removed=(), day=None):
+    """
+    Apply expense rows written in this transaction to the spend of the budgets they count against.
+
+    rows are dicts with user_id, category_id, date, currency and amount_minor,
+    already flushed. Only rows dated in a budget's current period change it,
+    converted into the budget's currency at their day's rate. A budget whose
+    period has ended is rolled over instead, which recounts it with these
+    rows included. Notifications for thresholds crossed are queued in the
+    same transaction and returned.
+    """
+    rows = [*added, *removed]
+    if not rows:
+        return []
+    day = day or today()
+    keys = {(row['user_id'], row['category_id']) for row in rows}
+    budgets = Budget.__table__
+    found = [
+        budget for budget in connection.execute(select(budgets).where(
+            budgets.c.user_id.in_({user_id for user_id, category_id in keys}),
+            budgets.c.category_id.in_({category_id for user_id, category_id in keys}),
+        )).mappings()
+        if (budget['user_id'], budget['category_id']) in keys
+    ]
+    notifications = []
+    for budget in found:
+        start, end = period_bounds(budget['period'], day)
+        if budget['period_start'] != start:
+            budget = roll_over(connection, budget, day)
+        else:
+            def in_period(row):
+                return (row['user_id'], row['category_id']) == (budget['user_id'], budget['category_id']) \
+                    and start <= row['date'].date() < end
+            delta = converted_total([row for row in added if in_period(row)], budget['currency']) \
+                - converted_total([row for row in removed if in_period(row)], budget['currency'])
+            if not delta:
+                continue
+            spent = connection.execute(
+                update(budgets).where(budgets.c.id == budget['id'])
+                .values(spent_minor=budgets.c.spent_minor + delta).returning(budgets.c.spent_minor)
+            ).scalar_one()
+            budget = {**budget, 'spent_minor': spent}
+        notification = crossed_threshold(connection, budget)
+        if notification:
+            notifications.append(notification)
+    queue_notifications(notifications)
+    return notifications
+
+@event.listens_for(Session, 'after_flush')
+def update_budgets_on_flush(session, flush_context):
+    added, removed = flushed_changes(session)
+    if added or removed:
+        update_budgets(session.connection(), added, removed)
+
+
+def current_budgets(user_id, day=None):
+    """
+    The user's budgets as stored rows, each rolled over to the period containing day first if it has ended.
+
+    A budget that is already current costs nothing beyond the one indexed
+    read of the user's budgets. The caller commits any rollover.
+    """
+    day = day or today()
+    connection = db.session.connection()
+    budgets = Budget.__table__
+    found = []
+    notifications = []
+    for budget in connection.execute(select(budgets).where(budgets.c.user_id == user_id).order_by(budgets.c.id)).mappings().all():
+        if budget['period_start'] != period_bounds(budget['period'], day)[0]:
+            budget = roll_over(connection, budget, day)
+            notification = crossed_threshold(connection, budget)
+            if notification:
+                notifications.append(notification)
+        found.append(budget)
+    queue_notifications(notifications)
+    return found
+
+def build_budget(user_id, data, currency):
+    """
+    Create the user's budget for a category and period from request data, or change the one that exists.
+
+    currency is the one to use when data has none. A changed budget is
+    counted again from the start of its period on the next read.
+    """
+    from app.categories import get_or_create_category_id  # Import inside the function to avoid circular imports
+    if not data.get('category'):
+        raise ValueError("A budget needs a category")
+    if data.get('amount') is None:
+        raise ValueError("A budget needs an amount")
+    alert_percent = int(data.get('alert_percent') or current_app.config.get('BUDGET_ALERT_PERCENT', 80))
+    if not 1 <= alert_percent <= 100:
+        raise ValueError("alert_percent must be between 1 and 100")
+    category_id = get_or_create_category_id(str(data['category']).strip())
+    period = data.get('period') or 'monthly'
+    budget = Budget.query.filter_by(user_id=user_id, category_id=category_id, period=period).first()
+    if budget is None:
+        budget = Budget(user_id=user_id, category_id=category_id, period=period)
+        db.session.add(budget)
+    budget.currency = currency  # Set before amount, which is read in this currency's minor units
+    budget.amount = data['amount']
+    budget.alert_percent = alert_percent
+    budget.period_start = None
+    budget.spent_minor = 0
+    budget.alerted_percent = 0
+    return budget
+
+def serialize_budget(budget, names):
+    """A stored budget row for JSON; names maps category ids to names."""
+    start, end = period_bounds(budget['period'], budget['period_start'])
+    currency = budget['currency']
+    return {
+        'budget_id': budget['id'],
+        'category': names.get(budget['category_id']),
+        'period': budget['period'],
+        'period_start': start.isoformat(),
+        'period_end': (end - timedelta(days=1)).isoformat(),
+        'currency': currency,
+        'amount': from_minor(budget['amount_minor'], currency),
+        'spent': from_minor(budget['spent_minor'], currency),
+        'remaining': from_minor(budget['amount_minor'] - budget['spent_minor'], currency),
+        'percent': round(budget['spent_minor'] * 100 / budget['amount_minor'], 1),
+        'alert_percent': budget['alert_percent'],
+    }
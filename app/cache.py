@@ -0,0 +1,222 @@
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, Response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event, inspect, select, literal, true
+from sqlalchemy.orm import Session
+from app import db
+from app.models import CacheVersion, Expenses, Notification, User
+
+# Response headers worth replaying from the cache
+CACHED_HEADERS = ['X-Next-Cursor']
+
+
+class MemoryResponseCache:
+    """LRU of responses in this process, each entry also expiring after ttl seconds."""
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires at, value)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SQLiteResponseCache:
+    """
+    LRU+TTL cache in a local SQLite file, shared by every worker on the host.
+
+    Each thread keeps its own connection. Eviction runs every prune_every
+    writes instead of on each one, so the file can briefly hold a few more
+    than max_entries rows.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=300, prune_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.writes = 0
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF')  # It is a cache, losing it on a crash is fine
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_used_at ON response_cache (used_at)')
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        now = time.time()
+        row = self.connection().execute(
+            'SELECT value FROM response_cache WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        self.connection().execute('UPDATE response_cache SET used_at = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        self.connection().execute(
+            'INSERT OR REPLACE INTO response_cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)',
+            (key, pickle.dumps(value), now + self.ttl, now),
+        )
+        self.writes += 1
+        if self.writes % self.prune_every == 0:
+            self.prune(now)
+
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        connection = self.connection()
+        connection.execute('DELETE FROM response_cache WHERE expires_at <= ?', (now,))
+        connection.execute(
+            'DELETE FROM response_cache WHERE key IN '
+            '(SELECT key FROM response_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,)
+        )
+
+
+def create_response_cache(app):
+    backend = app.config.get('RESPONSE_CACHE_BACKEND', 'memory')
+    max_entries = app.config.get('RESPONSE_CACHE_SIZE', 10000)
+    ttl = app.config.get('RESPONSE_CACHE_SECONDS', 300)
+    if backend == 'memory':
+        cache = MemoryResponseCache(max_entries=max_entries, ttl=ttl)
+    elif backend == 'sqlite':
+        cache = SQLiteResponseCache(app.config['RESPONSE_CACHE_PATH'], max_entries=max_entries, ttl=ttl)
+    elif not backend:
+        cache = None
+    else:
+        raise ValueError("RESPONSE_CACHE_BACKEND must be 'memory', 'sqlite' or None.")
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def version_upsert(dialect_name, every_user=False):
+    """Upsert bumping cache versions; with every_user, one statement for every row of user, no parameters needed."""
+    versions = CacheVersion.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(versions)
+    if every_user:
+        # SQLite needs a WHERE to tell the upsert's ON CONFLICT apart from a join in the SELECT
+        statement = statement.from_select(['user_id', 'version'], select(User.id, literal(1)).where(true()))
+    return statement.on_conflict_do_update(
+        index_elements=[versions.c.user_id],
+        set_={'version': versions.c.version + 1},
+    )
+
+def bump_versions(connection, user_ids):
+    """Move the given users to a new cache version, in the caller's transaction."""
+    user_ids = sorted(set(user_ids))
+    if user_ids:
+        connection.execute(version_upsert(connection.dialect.name), [{'user_id': user_id, 'version': 1} for user_id in user_ids])
+
+def bump_all_versions(connection):
+    """Move every user to a new cache version, including users that never had a version row."""
+    connection.execute(version_upsert(connection.dialect.name, every_user=True))
+
+def version_query(user_id):
+    return select(CacheVersion.version).where(CacheVersion.user_id == user_id)
+
+def current_version(user_id):
+    return db.session.execute(version_query(user_id)).scalar() or 0
+
+@event.listens_for(Session, 'after_flush')
+def bump_changed_users(session, flush_context):
+    user_ids = set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, (Expenses, Notification)):
+            history = inspect(instance).attrs.user_id.history
+            user_ids.update(user_id for user_id in (*history.unchanged, *history.added, *history.deleted) if user_id)
+            if not history.unchanged and not history.added:
+                user_ids.add(instance.__dict__.get('user_id'))
+    user_ids.discard(None)
+    bump_versions(session.connection(), user_ids)
+
+
+def cache_key(user_id, version):
+    """Key of the current request's response for a user at a cache version, and the ETag derived from it."""
+    query = '&'.join(f'{name}={value}' for name, value in sorted(request.args.items(multi=True)))
+    key = f'{user_id}:{version}:{request.path}?{query}|{request.accept_mimetypes}'
+    return key, hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def cached_entry(cache, key, etag):
+    """304 if the client already has this version, the stored response, or None on a miss."""
+    if etag in request.if_none_match:
+        return Response(status=304)
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    body, mimetype, headers = cached
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def store_entry(cache, key, response):
+    """Store a freshly rendered response; returns False for the ones that are not cached."""
+    if response.status_code != 200 or response.is_streamed:
+        return False
+    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+    cache.set(key, (response.get_data(), response.mimetype, headers))
+    return True
+
+def mark_cached(response, etag):
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def cached_response(view):
+    """
+    Serve a JWT-protected GET view from the response cache.
+
+    Keys are (user, cache version, path, sorted query string). Every write to
+    a user's expenses or notifications bumps their version in the same
+    transaction, so old entries are never read again and simply age out;
+    nothing is scanned on writes. The ETag is derived from the key too, so an
+    unchanged poll is answered with 304 after one primary key read.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions['response_cache']
+        if cache is None:
+            return view(*args, **kwargs)
+        user_id = int(get_jwt_identity())
+        key, etag = cache_key(user_id, current_version(user_id))
+        response = cached_entry(cache, key, etag)
+        if response is None:
+            response = current_app.make_response(view(*args, **kwargs))
+            if not store_entry(cache, key, response):
+                return response
+        return mark_cached(response, etag)
+    return wrapper
@@ -0,0 +1,117 @@
+import threading
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Category, RegistryVersion
+
+REGISTRY_NAME = 'category'
+
+
+class CategoryRegistry:
+    """
+    Every category's name <-> id, held in memory by each worker.
+
+    The category table is tiny and rarely changes, so lookups are dict reads.
+    Any flush that creates, renames or deletes a category bumps the 'category'
+    row of registry_version in the same transaction. Each transaction reads
+    that counter once, before its first lookup, and reloads the maps if some
+    worker has moved it, so a committed change is seen by every worker's next
+    transaction. A session holding uncommitted category changes of its own
+    reads the table directly until it commits or rolls back.
+
+    Category rows written with Core inserts skip the flush hook and must bump
+    the version themselves.
+    """
+
+    def __init__(self):
+        self.by_name = {}
+        self.by_id = {}
+        self.version = None  # Nothing loaded yet, the first lookup loads
+        self.loads = 0
+        self.lock = threading.Lock()
+
+    def sync(self, session):
+        if session.info.get('category_registry_synced'):
+            return
+        # Version first: the rows read after it are at least that new, at worst we reload once more
+        version = session.execute(version_query()).scalar() or 0
+        if version != self.version:
+            self.load(version, session.execute(categories_query()).all())
+        session.info['category_registry_synced'] = True
+
+    def load(self, version, rows):
+        with self.lock:
+            self.by_name = {name: category_id for category_id, name in rows}
+            self.by_id = {category_id: name for category_id, name in rows}
+            self.version = version
+            self.loads += 1
+
+    def id_for(self, name):
+        session = db.session()
+        if session.info.get('categories_changed'):
+            return session.execute(select(Category.id).where(Category.name == name)).scalar()
+        self.sync(session)
+        return self.by_name.get(name)
+
+    def names_for(self, category_ids):
+        session = db.session()
+        if session.info.get('categories_changed'):
+            return dict(session.execute(select(Category.id, Category.name).where(Category.id.in_(category_ids))).all())
+        self.sync(session)
+        return {category_id: self.by_id[category_id] for category_id in category_ids if category_id in self.by_id}
+
+
+def version_query():
+    return select(RegistryVersion.version).where(RegistryVersion.name == REGISTRY_NAME)
+
+def categories_query():
+    return select(Category.id, Category.name)
+
+def create_category_registry(app):
+    registry = CategoryRegistry()
+    app.extensions['category_registry'] = registry
+    return registry
+
+def get_or_create_category_id(name):
+    """The id of the category called name, adding it (unflushed work is flushed) if it doesn't exist."""
+    category_id = current_app.extensions['category_registry'].id_for(name)
+    if category_id is None:
+        category = Category(name=name)
+        db.session.add(category)
+        db.session.flush()
+        category_id = category.id
+    return category_id
+
+
+def version_upsert(dialect_name, name=REGISTRY_NAME):
+    versions = RegistryVersion.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(versions).values(name=name, version=1)
+    return statement.on_conflict_do_update(
+        index_elements=[versions.c.name],
+        set_={'version': versions.c.version + 1},
+    )
+
+def bump_category_version(connection):
+    connection.execute(version_upsert(connection.dialect.name))
+
+@event.listens_for(Session, 'after_flush')
+def bump_on_category_change(session, flush_context):
+    # Dirty alone also catches categories that only gained an expense in a collection
+    changed = [*session.new, *session.deleted, *(
+        instance for instance in session.dirty if session.is_modified(instance, include_collections=False)
+    )]
+    if any(isinstance(instance, Category) for instance in changed):
+        bump_category_version(session.connection())
+        session.info['categories_changed'] = True
+
+@event.listens_for(Session, 'after_transaction_end')
+def forget_category_sync(session, transaction):
+    # Committed or rolled back, the next transaction checks the version again
+    if transaction.parent is None:
+        session.info.pop('category_registry_synced', None)
+        session.info.pop('categories_changed', None)
@@ -0,0 +1,269 @@
+import csv
+import io
+import re
+import time
+import zlib
+from collections import Counter, defaultdict
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, select, delete, update, and_, bindparam
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Expenses, CategoryToken
+from app.categories import get_or_create_category_id
+from app.rollups import flushed_changes, keep_previous_value
+
+INDEX_FIELDS = ('user_id', 'category_id', 'description')
+# Words of two or more letters; amounts, dates and reference numbers say nothing about the category
+WORD = re.compile(r'[^\W\d_]{2,}')
+MERCHANT_WEIGHT = 2.0  # A merchant seen before outweighs the words it shares with other merchants
+LOOKUP_CHUNK = 1000  # Features per query when loading a user's index
+
+
+def features(description):
+    """
+    feature -> weight for a description: every distinct word, and its first two words as the merchant.
+
+    Features are the CRC-32 of the lower-cased text, so the index stores a
+    fixed-size integer per row rather than the words themselves. The
+    merchant is hashed with a '>' in front, which no word contains.
+    """
+    words = WORD.findall(description.casefold())
+    found = {zlib.crc32(word.encode()): 1.0 for word in words}
+    if words:
+        found[zlib.crc32(('>' + ' '.join(words[:2])).encode())] = MERCHANT_WEIGHT
+    return found
+
+
+class CategoryIndex:
+    """
+    Per feature, how many expenses in each category had it; predicts the category of a description.
+
+    Each feature of a description votes for the categories it was seen with,
+    in proportion to how often, times its weight. The category with the most
+    votes wins; a description with no feature seen before gets None. The same
+    class is filled from category_token for one user's batch and from a
+    labeled file by evaluate, so offline numbers are those of the live path.
+    Categories are whatever the caller uses, ids or names; ignore is never
+    learned or predicted.
+    """
+
+    def __init__(self, ignore=None):
+        self.counts = defaultdict(dict)  # feature -> {category: count}
+        self.totals = defaultdict(int)  # feature -> count over every category
+        self.ignore = ignore
+
+    def load(self, rows):
+        """Add (feature, category, count) rows, as stored in category_token."""
+        for feature, category, count in rows:
+            if category != self.ignore:
+                self.counts[feature][category] = self.counts[feature].get(category, 0) + count
+                self.totals[feature] += count
+
+    def add(self, description, category):
+        self.load((feature, category, 1) for feature in features(description))
+
+    def predict(self, description):
+        scores = {}
+        for feature, weight in features(description).items():
+            categories = self.counts.get(feature)
+            if not categories:
+                continue
+            share = weight / self.totals[feature]
+            for category, count in categories.items():
+                scores[category] = scores.get(category, 0.0) + share * count
+        if not scores:
+            return None
+        return max(scores, key=scores.get)
+
+
+def group_by_feature(rows):
+    """Fold expense rows (dicts with INDEX_FIELDS) into one count per (user_id, feature, category_id)."""
+    counts = Counter()
+    for row in rows:
+        for feature in features(row['description']):
+            counts[row['user_id'], feature, row['category_id']] += 1
+    return [
+        {'user_id': user_id, 'feature': feature, 'category_id': category_id, 'count': count}
+        for (user_id, feature, category_id), count in counts.items()
+    ]
+
+def upsert_statement(dialect_name):
+    tokens = CategoryToken.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(tokens)
+    return statement.on_conflict_do_update(
+        index_elements=[tokens.c.user_id, tokens.c.feature, tokens.c.category_id],
+        set_={'count': tokens.c.count + statement.excluded.count},
+    )
+
+def add_to_category_index(connection, rows):
+    counts = group_by_feature(rows)
+    if counts:
+        connection.execute(upsert_statement(connection.dialect.name), counts)
+
+def remove_from_category_index(connection, rows):
+    counts = group_by_feature(rows)
+    if not counts:
+        return
+    tokens = CategoryToken.__table__
+    params = [{'b_' + name: value for name, value in count.items()} for count in counts]
+    in_row = and_(
+        tokens.c.user_id == bindparam('b_user_id'),
+        tokens.c.feature == bindparam('b_feature'),
+        tokens.c.category_id == bindparam('b_category_id'),
+    )
+    connection.execute(update(tokens).where(in_row).values(count=tokens.c.count - bindparam('b_count')), params)
+    connection.execute(delete(tokens).where(in_row, tokens.c.count <= 0), params)
+
+# Like the rollup fields, the old description must be loaded when it is replaced so its features can be removed
+event.listen(Expenses.description, 'set', keep_previous_value, active_history=True)
+
+@event.listens_for(Session, 'after_flush')
+def update_category_index(session, flush_context):
+    added, removed = flushed_changes(session, INDEX_FIELDS)
+    if added or removed:
+        connection = session.connection()
+        add_to_category_index(connection, added)
+        remove_from_category_index(connection, removed)
+
+
+def default_category_name():
+    return current_app.config.get('DEFAULT_CATEGORY', 'Uncategorized')
+
+def load_category_index(user_id, descriptions, ignore=None):
+    """A CategoryIndex of user_id's counts for the features of descriptions, and no others."""
+    index = CategoryIndex(ignore)
+    wanted = sorted({feature for description in descriptions for feature in features(description)})
+    for offset in range(0, len(wanted), LOOKUP_CHUNK):
+        index.load(db.session.execute(
+            select(CategoryToken.feature, CategoryToken.category_id, CategoryToken.count)
+            .where(CategoryToken.user_id == user_id, CategoryToken.feature.in_(wanted[offset:offset + LOOKUP_CHUNK]))
+        ))
+    return index
+
+def assign_categories(user_id, rows):
+    """
+    Fill in the category_id of the rows (dicts with a description) that have None, and return how many were predicted.
+
+    Predictions come from user_id's past expenses, read with one query for
+    the whole batch. Rows that already have a category are learned from in
+    order, so an import that labels some rows places the later unlabeled
+    ones like them. Rows nothing is known about get DEFAULT_CATEGORY, which
+    is never predicted itself.
+    """
+    if all(row['category_id'] is not None for row in rows):
+        return 0
+    default_id = current_app.extensions['category_registry'].id_for(default_category_name())
+    index = load_category_index(user_id, [row['description'] for row in rows], ignore=default_id)
+    predicted, unknown = 0, []
+    for row in rows:
+        if row['category_id'] is not None:
+            index.add(row['description'], row['category_id'])
+            continue
+        row['category_id'] = index.predict(row['description'])
+        if row['category_id'] is None:
+            unknown.append(row)
+        else:
+            predicted += 1
+    if unknown:
+        default_id = default_id or get_or_create_category_id(default_category_name())
+        for row in unknown:
+            row['category_id'] = default_id
+    return predicted
+
+
+def index_rows():
+    return select(Expenses.user_id, Expenses.category_id, Expenses.description).execution_options(yield_per=10000)
+
+def rebuild_category_index():
+    """Recompute every count from the expenses table in one transaction."""
+    connection = db.session.connection()
+    connection.execute(delete(CategoryToken.__table__))
+    for partition in db.session.execute(index_rows()).mappings().partitions():
+        add_to_category_index(connection, partition)
+    db.session.commit()
+
+def verify_category_index():
+    """Return the (user_id, feature, category_id) keys whose count disagrees with the expenses table."""
+    expected = Counter()
+    for partition in db.session.execute(index_rows()).mappings().partitions():
+        for count in group_by_feature(partition):
+            expected[count['user_id'], count['feature'], count['category_id']] += count['count']
+    stored = {
+        (row.user_id, row.feature, row.category_id): row.count for row in db.session.execute(select(CategoryToken.__table__))
+    }
+    return sorted(key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
+
+
+def read_labeled(stream):
+    """Yield (description, category) from a CSV file with description and category columns."""
+    for record in csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')):
+        yield record['description'].strip(), record['category'].strip()
+
+def evaluate(labeled):
+    """
+    Replay (description, category) pairs in order, predicting each before learning it.
+
+    This is how the index meets a user's expenses: every prediction is made
+    from the rows before it only. Accuracy counts every row, precision only
+    the rows that got a prediction, and coverage is the share that did.
+    """
+    index = CategoryIndex()
+    rows = predicted = correct = 0
+    elapsed = 0.0
+    for description, category in labeled:
+        started = time.perf_counter()
+        guess = index.predict(description)
+        elapsed += time.perf_counter() - started
+        index.add(description, category)
+        rows += 1
+        if guess is not None:
+            predicted += 1
+            correct += guess == category
+    return {
+        'rows': rows,
+        'predicted': predicted,
+        'correct': correct,
+        'accuracy': correct / rows if rows else 0.0,
+        'precision': correct / predicted if predicted else 0.0,
+        'coverage': predicted / rows if rows else 0.0,
+        'microseconds_per_row': elapsed / rows * 1e6 if rows else 0.0,
+    }
+
+
+categorizer_cli = AppGroup('categorizer', help='Maintain and evaluate the expense categorizer.')
+
+@categorizer_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the category index from expenses and verify it."""
+    rebuild_category_index()
+    mismatches = verify_category_index()
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} index counts differ from expenses after rebuild")
+    click.echo("Category index rebuilt and verified.")
+
+@categorizer_cli.command('verify')
+def verify_command():
+    """Compare the category index against expenses without changing anything."""
+    mismatches = verify_category_index()
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} index counts differ from expenses")
+    click.echo("Category index matches expenses.")
+
+@categorizer_cli.command('evaluate')
+@click.argument('file', type=click.File('rb'))
+def evaluate_command(file):
+    """Replay a labeled CSV (description,category) through the categorizer and report its accuracy."""
+    try:
+        result = evaluate(read_labeled(file))
+    except KeyError as e:
+        raise click.ClickException(f"Missing column {e}")
+    click.echo(
+        f"{result['rows']} rows: accuracy {result['accuracy']:.1%}, precision {result['precision']:.1%}, "
+        f"coverage {result['coverage']:.1%}, {result['microseconds_per_row']:.1f} us/row"
+    )
@@ -7,11 +7,73 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    RECURRING_BATCH_SIZE = 1000  # Schedules processed per transaction by the recurring job
+    EXPENSES_PAGE_SIZE = 50  # Default page size for GET /expenses
+    EXPENSES_MAX_PAGE_SIZE = 500  # Largest limit a client may ask for
+    IMPORT_BATCH_SIZE = 1000  # Rows per executemany/commit in POST /expenses/import
+    IMPORT_MAX_ERRORS = 1000  # Row errors reported back before the list is truncated
+    EXPORT_CHUNK_SIZE = 2000  # Rows fetched per round trip by exports
+    LARGE_EXPENSE_THRESHOLD = 1000  # Used for users who have no threshold rule of their own
+    RULE_CACHE_SECONDS = 60  # How long compiled rules are reused before being reloaded
+    NOTIFICATION_WORKERS = 1  # Threads delivering the notification outbox, 0 to deliver only on drain()
+    NOTIFICATION_BATCH_SIZE = 500
+    NOTIFICATION_SWEEP_SECONDS = 30  # Outbox is re-checked this often even without a wake-up
+    NOTIFICATION_RETENTION_DAYS = 90  # Read notifications older than this are deleted by the daily job
+    NOTIFICATION_PRUNE_BATCH_SIZE = 1000  # Rows deleted per transaction by that job
+    TOKEN_REVOCATION_BACKEND = 'sql'  # 'sql' is shared by all workers, 'memory' is per process
+    TOKEN_REVOCATION_SYNC_SECONDS = 1.0  # How stale a worker's view of other workers' logouts may be
+    BCRYPT_LOG_ROUNDS = 12  # bcrypt cost; existing hashes are upgraded on the next successful login
+    PASSWORD_HASH_WORKERS = 2  # Processes that hash and check passwords, 0 to do it on the request thread
+    LOGIN_LIMIT_BACKEND = 'sql'  # 'sql' is shared by all workers, 'memory' is per process
+    LOGIN_FAILURE_WINDOW_SECONDS = 900  # Failed logins are counted over this sliding window
+    LOGIN_MAX_FAILURES = 5  # Failures per email before the account is locked (423)
+    LOGIN_IP_MAX_FAILURES = 50  # Failures per client IP before it gets 429
+    SCHEDULER_THREAD = False  # Run the scheduler loop in this process; otherwise jobs run from `flask scheduler run`
+    SCHEDULER_LEASE_SECONDS = 120  # A leader that stops renewing is replaced after this long
+    SCHEDULER_POLL_SECONDS = 30  # How often runners check for due jobs and renew the lease
+    RESPONSE_CACHE_BACKEND = 'memory'  # 'memory' per process, 'sqlite' shared by the workers on one host, None to disable
+    RESPONSE_CACHE_PATH = os.path.join(basedir, 'response_cache.db')  # Used by the 'sqlite' backend
+    RESPONSE_CACHE_SIZE = 10000  # Entries kept before the least recently used are evicted
+    RESPONSE_CACHE_SECONDS = 300  # Entries expire after this long even if nothing changed
+    ASGI_WSGI_WORKERS = 8  # Threads running the Flask routes behind asgi.py; the read endpoints don't use them
+    FX_BASE_CURRENCY = 'EUR'  # Currency the loaded exchange rates are quoted against
+    FX_CACHE_SIZE = 100000  # (day, currency pair) conversion factors kept per process
+    DEFAULT_CATEGORY = 'Uncategorized'  # Given to expenses without a category that the categorizer can't place
+    BUDGET_ALERT_PERCENT = 80  # Share of a budget spent that notifies, for budgets that don't set their own
+
+class DevelopmentConfig(Config):
+    SCHEDULER_THREAD = True  # A single dev server runs the jobs itself
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # Use an in-memory database for testing
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     WTF_CSRF_ENABLED = False  # Disable CSRF protection in the testing environment if applicable
+    NOTIFICATION_WORKERS = 0  # Tests deliver notifications explicitly
+    BCRYPT_LOG_ROUNDS = 4  # Cheapest cost bcrypt allows, keeps the suite fast
+    PASSWORD_HASH_WORKERS = 0
+
+class ProductionConfig(Config):
+    RESPONSE_CACHE_BACKEND = 'sqlite'
+    # Several request workers plus the scheduler thread write to one SQLite file
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'connect_args': {'timeout': 30},  # Seconds sqlite3 waits for a lock before "database is locked"
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',  # Readers no longer block the writer or each other
+        'synchronous': 'NORMAL',  # Safe with WAL; fsync at checkpoints instead of every commit
+        'busy_timeout': 30000,  # Milliseconds, matches connect_args timeout
+        'mmap_size': 268435456,  # 256MB of the file read through memory mapping
+        'cache_size': -65536,  # 64MB page cache per connection (negative means KiB)
+        'temp_store': 'MEMORY',
+    }
 
-# Add other environment-specific configs (e.g., DevelopmentConfig, ProductionConfig) as needed
+configs = {
+    'default': Config,
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
@@ -0,0 +1,19 @@
+from sqlalchemy import event
+
+
+def set_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    return on_connect
+
+def configure_engine(app, db):
+    """Run SQLITE_PRAGMAS on every new SQLite connection; pragmas are per connection, not per database."""
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    if not pragmas:
+        return
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', set_sqlite_pragmas(pragmas))
@@ -0,0 +1,195 @@
+import csv
+import io
+import json
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select
+from app import db
+from app.models import Expenses, Category, User
+from app.money import from_minor, format_minor
+from app.fx import convert_minor, check_currency
+
+EXPORT_COLUMNS = ['expense_id', 'user_name', 'category', 'description', 'date', 'amount', 'currency',
+                  'reporting_amount', 'reporting_currency']
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'columnar': ('application/octet-stream', 'expcol'),
+}
+
+# Columnar layout: MAGIC, then row groups of
+#   <I row count>, expense_id int64[n], user_name dict, category dict, description strings,
+#   date int64[n] (microseconds since 1970-01-01), amount_minor int64[n], currency dict,
+#   reporting_amount_minor int64[n], reporting_currency dict
+# and a row count of 0 to finish. A dict column is <I size> + strings + uint32 codes[n];
+# a strings column is uint32 offsets[n + 1] + the utf-8 bytes, as in Arrow.
+COLUMNAR_MAGIC = b'EXPCOL3\n'
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def export_partitions(user_id=None, chunk_size=1000, currency=None):
+    """
+    Yield lists of export rows, chunk_size at a time, off a server-side cursor.
+
+    Each row's amount is also given in currency, or in its user's reporting
+    currency when that is None. The conversion factors of a whole partition
+    are looked up in one converter batch.
+    """
+    statement = select(
+        Expenses.id, User.user_name, Category.name, Expenses.description, Expenses.date, Expenses.amount_minor,
+        Expenses.currency, User.reporting_currency,
+    ).join(User, User.id == Expenses.user_id).join(Category, Category.id == Expenses.category_id).order_by(Expenses.id)
+    if user_id is not None:
+        statement = statement.where(Expenses.user_id == user_id)
+    converter = current_app.extensions['fx_converter']
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        keys = [(row.date.date(), row.currency, currency or row.reporting_currency) for row in partition]
+        factors = converter.factors(set(keys))
+        yield [
+            (*row[:7], convert_minor(row.amount_minor, factors[key]) if key[1] != key[2] else row.amount_minor, key[2])
+            for row, key in zip(partition, keys)
+        ]
+
+
+def export_values(row, format_amount=from_minor):
+    expense_id, user_name, category, description, date, amount_minor, currency, reporting_minor, reporting_currency = row
+    return [expense_id, user_name, category, description, date.strftime('%Y-%m-%d'), format_amount(amount_minor, currency), currency,
+            format_amount(reporting_minor, reporting_currency), reporting_currency]
+
+def write_csv(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in partitions:
+        # Fixed-point text with the currency's digits, 12.50 rather than 12.5
+        writer.writerows(export_values(row, format_minor) for row in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def write_ndjson(partitions):
+    for rows in partitions:
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, export_values(row)))) + '\n' for row in rows).encode('utf-8')
+
+def pack_strings(values):
+    blobs = [value.encode('utf-8') for value in values]
+    offsets = array('I', [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return offsets.tobytes() + b''.join(blobs)
+
+def pack_dictionary(values):
+    codes = array('I')
+    lookup = {}
+    for value in values:
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(lookup)
+        codes.append(code)
+    return struct.pack('<I', len(lookup)) + pack_strings(list(lookup)) + codes.tobytes()
+
+def write_columnar(partitions):
+    if sys.byteorder != 'little':
+        raise RuntimeError("The columnar export is written in little-endian order")
+    yield COLUMNAR_MAGIC
+    for rows in partitions:
+        if not rows:
+            continue
+        ids, user_names, categories, descriptions, dates, amounts, currencies, reporting_amounts, reporting_currencies = zip(*rows)
+        yield b''.join([
+            struct.pack('<I', len(rows)),
+            array('q', ids).tobytes(),
+            pack_dictionary(user_names),
+            pack_dictionary(categories),
+            pack_strings(descriptions),
+            array('q', [(date - EPOCH) // MICROSECOND for date in dates]).tobytes(),
+            array('q', amounts).tobytes(),
+            pack_dictionary(currencies),
+            array('q', reporting_amounts).tobytes(),
+            pack_dictionary(reporting_currencies),
+        ])
+    yield struct.pack('<I', 0)
+
+EXPORT_WRITERS = {
+    'csv': write_csv,
+    'ndjson': write_ndjson,
+    'columnar': write_columnar,
+}
+
+
+def read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated columnar export")
+    return data
+
+def read_array(stream, typecode, count):
+    values = array(typecode)
+    values.frombytes(read_exact(stream, values.itemsize * count))
+    return values
+
+def read_strings(stream, count):
+    offsets = read_array(stream, 'I', count + 1)
+    blob = read_exact(stream, offsets[-1])
+    return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)]
+
+def read_dictionary(stream, count):
+    size, = struct.unpack('<I', read_exact(stream, 4))
+    values = read_strings(stream, size)
+    return [values[code] for code in read_array(stream, 'I', count)]
+
+def read_columnar(stream):
+    """Yield one dict of column name -> list of values per row group of a columnar export."""
+    if read_exact(stream, len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar expenses export")
+    while True:
+        count, = struct.unpack('<I', read_exact(stream, 4))
+        if count == 0:
+            return
+        yield {
+            'expense_id': list(read_array(stream, 'q', count)),
+            'user_name': read_dictionary(stream, count),
+            'category': read_dictionary(stream, count),
+            'description': read_strings(stream, count),
+            'date': [EPOCH + micros * MICROSECOND for micros in read_array(stream, 'q', count)],
+            'amount_minor': list(read_array(stream, 'q', count)),
+            'currency': read_dictionary(stream, count),
+            'reporting_amount_minor': list(read_array(stream, 'q', count)),
+            'reporting_currency': read_dictionary(stream, count),
+        }
+
+
+expenses_cli = AppGroup('expenses', help='Expense maintenance commands.')
+
+@expenses_cli.command('export')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_WRITERS)), default='csv')
+@click.option('--user', 'user_name', help='Only export this user\'s expenses (default: every user).')
+@click.option('--output', type=click.File('wb'), default='-', help='File to write (default: stdout).')
+@click.option('--chunk-size', type=int, default=None, help='Rows fetched per round trip.')
+@click.option('--currency', help='Convert amounts into this currency (default: each user\'s reporting currency).')
+def export_command(export_format, user_name, output, chunk_size, currency):
+    """Stream expenses to a CSV, NDJSON or columnar file."""
+    if currency:
+        currency = currency.upper()
+        try:
+            check_currency(currency)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    user_id = None
+    if user_name:
+        user = User.query.filter_by(user_name=user_name).first()
+        if user is None:
+            raise click.ClickException(f"No user named {user_name}")
+        user_id = user.id
+    chunk_size = chunk_size or current_app.config['EXPORT_CHUNK_SIZE']
+    for chunk in EXPORT_WRITERS[export_format](export_partitions(user_id, chunk_size, currency)):
+        output.write(chunk)
@@ -14,7 +14,8 @@ Type_of_expense =["Personal", "House", "Transport", "Pets", "Miscellaneous"]
 
 class AddExpense(FlaskForm):
     Expense_id = HiddenField("id")
-    Type= SelectField('Type of expense', choices=[(typ, typ) for typ in Type_of_expense])
+    # Left blank, the expense is categorized from the user's past expenses
+    Type= SelectField('Type of expense', choices=[('', 'Detect automatically')] + [(typ, typ) for typ in Type_of_expense])
     Description = StringField('Description of the expense.', validators=[DataRequired()])
     Date= DateField('Purchase Date', format='%Y-%m-%d', validators=[DataRequired()])
     Amount = FloatField('Amount (£)', validators=[DataRequired(message="Invalid amount. Please, introduce a positive number")])
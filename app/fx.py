@@ -0,0 +1,286 @@
+import csv
+import io
+import itertools
+import math
+import threading
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import date
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, select, func, cast, or_, values, column, String, Float, BigInteger
+from sqlalchemy.orm import Session, aliased
+from app import db
+from app.models import FxRate, User, RegistryVersion, validate_currency
+from app.money import DEFAULT_CURRENCY, scale
+from app.categories import version_upsert
+from app.cache import bump_all_versions
+
+REGISTRY_NAME = 'fx_rate'
+LOAD_BATCH_SIZE = 1000
+
+
+class FxConverter:
+    """
+    Factors turning minor units of one currency into minor units of another, per day.
+
+    Rates are stored against one base currency, so a factor is the ratio of
+    the two currencies' rates on that day, scaled between their minor units.
+    A day takes the latest rate on or before it, as none are published on
+    weekends and holidays; days before a currency's first rate take that one.
+
+    Factors are kept per (day, source, target) in an LRU of max_entries.
+    The misses of a batch are resolved together by one query over the
+    currencies and days involved, so converting a year of expenses costs one
+    query however many rows there are, and none once those days are cached.
+
+    currencies is what expenses and reports may use: DEFAULT_CURRENCY, plus
+    the base and every currency with rates once DEFAULT_CURRENCY can be
+    converted too.
+
+    Loading rates bumps the 'fx_rate' row of registry_version. As with the
+    category registry, each transaction reads that counter once; when some
+    worker has moved it, the LRU is dropped and currencies reloaded.
+    """
+
+    def __init__(self, base, max_entries=100000):
+        self.base = base
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (day, source, target) -> factor
+        self.currencies = {DEFAULT_CURRENCY}
+        self.version = None  # Nothing loaded yet, the first conversion loads
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def sync(self, session):
+        if session.info.get('fx_converter_synced'):
+            return
+        version = session.execute(version_query()).scalar() or 0
+        if version != self.version:
+            self.load(version, session.execute(currencies_query()).scalars().all())
+        session.info['fx_converter_synced'] = True
+
+    def load(self, version, currencies):
+        convertible = {self.base, *currencies}
+        with self.lock:
+            self.entries.clear()
+            self.currencies = convertible if DEFAULT_CURRENCY in convertible else {DEFAULT_CURRENCY}
+            self.version = version
+
+    def check_currency(self, currency):
+        validate_currency(currency)
+        if currency not in self.currencies:
+            raise ValueError(f"No exchange rates loaded for {currency}")
+
+    def cached(self, keys):
+        """The factors of the keys already in the LRU."""
+        found = {}
+        with self.lock:
+            for key in keys:
+                factor = self.entries.get(key)
+                if factor is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = factor
+                    self.hits += 1
+        return found
+
+    def resolve(self, keys, rows):
+        """Compute the factors of keys from the (currency, day, rate) rows of rates_query and keep them in the LRU."""
+        days = defaultdict(list)
+        rates = defaultdict(list)
+        for currency, day, rate in rows:
+            days[currency].append(day)
+            rates[currency].append(rate)
+
+        def rate_on(currency, day):
+            if currency == self.base:
+                return 1.0
+            if not days[currency]:
+                raise ValueError(f"No exchange rates loaded for {currency}")
+            return rates[currency][max(bisect_right(days[currency], day) - 1, 0)]
+
+        factors = {
+            (day, source, target): rate_on(target, day) / rate_on(source, day) * scale(target) / scale(source)
+            for day, source, target in keys
+        }
+        with self.lock:
+            self.entries.update(factors)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.misses += len(factors)
+        return factors
+
+    def factors(self, keys):
+        """The factor of every (day, source, target) in keys, missing ones read in the current session."""
+        # A currency converts into itself without any rate, or even the version check
+        found = {key: 1.0 for key in keys if key[1] == key[2]}
+        others = [key for key in keys if key[1] != key[2]]
+        if others:
+            session = db.session()
+            self.sync(session)
+            found.update(self.cached(others))
+            missing = [key for key in others if key not in found]
+            if missing:
+                found.update(self.resolve(missing, session.execute(rates_query(missing, self.base)).all()))
+        return found
+
+
+def create_fx_converter(app):
+    converter = FxConverter(app.config.get('FX_BASE_CURRENCY', 'EUR'), max_entries=app.config.get('FX_CACHE_SIZE', 100000))
+    app.extensions['fx_converter'] = converter
+    return converter
+
+@event.listens_for(Session, 'after_transaction_end')
+def forget_fx_sync(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('fx_converter_synced', None)
+
+
+def version_query():
+    return select(RegistryVersion.version).where(RegistryVersion.name == REGISTRY_NAME)
+
+def currencies_query():
+    return select(FxRate.currency).distinct()
+
+def rates_query(keys, base):
+    """
+    Every rate the factors of keys need: each currency's rates from the last
+    one on or before the first day through the last day, and its first rate.
+    """
+    currencies = sorted({currency for day, source, target in keys for currency in (source, target)} - {base})
+    first_day = min(day for day, source, target in keys)
+    last_day = max(day for day, source, target in keys)
+    other = aliased(FxRate)
+    start = select(func.max(other.day)).where(other.currency == FxRate.currency, other.day <= first_day).scalar_subquery()
+    earliest = select(func.min(other.day)).where(other.currency == FxRate.currency).scalar_subquery()
+    return select(FxRate.currency, FxRate.day, FxRate.rate).where(
+        FxRate.currency.in_(currencies),
+        or_(FxRate.day.between(func.coalesce(start, first_day), last_day), FxRate.day == earliest),
+    ).order_by(FxRate.currency, FxRate.day)
+
+def convert_minor(amount_minor, factor):
+    """An amount in minor units times a factor, rounded half up to whole minor units."""
+    return int(amount_minor * factor + 0.5)
+
+def converted_minor(amount_minor, factor, dialect_name):
+    """SQL for convert_minor, rounding the same way so SQL and Python agree to the minor unit."""
+    if dialect_name == 'postgresql':
+        return cast(func.floor(amount_minor * factor + 0.5), BigInteger)
+    # CAST truncates like int(), the amounts are positive
+    return cast(amount_minor * factor + 0.5, BigInteger)
+
+def factors_table(factors):
+    """factors as a (day, currency, factor) CTE to join expenses on, every key having the same target."""
+    return values(
+        column('day', String), column('currency', String), column('factor', Float), name='fx_factor', literal_binds=True,
+    ).data([(day.isoformat(), source, factor) for (day, source, target), factor in factors.items()]).cte('fx_factor')
+
+
+def reporting_currency_query(user_id):
+    return select(User.reporting_currency).where(User.id == user_id)
+
+def reporting_currency(user_id):
+    return db.session.execute(reporting_currency_query(user_id)).scalar() or DEFAULT_CURRENCY
+
+def check_currency(currency):
+    """Raise ValueError unless currency is a code expenses and reports can use, see FxConverter.currencies."""
+    converter = current_app.extensions['fx_converter']
+    converter.sync(db.session())
+    converter.check_currency(currency)
+
+
+def parse_rate(day, currency, rate):
+    try:
+        day = date.fromisoformat(day.strip())
+    except ValueError:
+        raise ValueError("Date must be in YYYY-MM-DD format")
+    currency = currency.strip().upper()
+    validate_currency(currency)
+    try:
+        rate = float(rate)
+    except ValueError:
+        raise ValueError("Rate must be a number")
+    if not math.isfinite(rate) or rate <= 0:
+        raise ValueError("Rate must be a positive number")
+    return day, currency, rate
+
+def parse_rates(stream):
+    """
+    Yield (day, currency, rate) from a CSV file of rates against the base currency.
+
+    The file is either long, with date, currency and rate columns, or wide
+    like the ECB's eurofxref-hist.csv: a Date column, then one column per
+    currency with N/A or a blank where there is no rate.
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = [name.strip() for name in next(reader, [])]
+    names = [name.lower() for name in header]
+    long_format = {'date', 'currency', 'rate'} <= set(names)
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            if long_format:
+                record = dict(zip(names, row))
+                parsed = [parse_rate(record['date'], record['currency'], record['rate'])]
+            else:
+                parsed = [
+                    parse_rate(row[0], currency, value) for currency, value in zip(header[1:], row[1:])
+                    if currency and value.strip() not in ('', 'N/A')
+                ]
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"Line {reader.line_num}: {e}")
+        yield from parsed
+
+def rate_upsert(dialect_name):
+    rates = FxRate.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(rates)
+    return statement.on_conflict_do_update(
+        index_elements=[rates.c.currency, rates.c.day],
+        set_={'rate': statement.excluded.rate},
+    )
+
+def load_rates(rates, base):
+    """
+    Store (day, currency, rate) triples in one transaction, replacing rates already stored for the same day.
+
+    Rates of base itself are 1 by definition and skipped. Every worker's
+    converter drops its factors and every cached response is invalidated,
+    summaries having been converted with the old rates. Returns the number
+    of rates stored.
+    """
+    statement = rate_upsert(db.session.get_bind().dialect.name)
+    count = 0
+    rows = ({'day': day, 'currency': currency, 'rate': rate} for day, currency, rate in rates if currency != base)
+    while True:
+        batch = list(itertools.islice(rows, LOAD_BATCH_SIZE))
+        if not batch:
+            break
+        db.session.execute(statement, batch)
+        count += len(batch)
+    connection = db.session.connection()
+    connection.execute(version_upsert(connection.dialect.name, REGISTRY_NAME))
+    bump_all_versions(connection)
+    db.session.commit()
+    return count
+
+
+fx_cli = AppGroup('fx', help='Exchange rate commands.')
+
+@fx_cli.command('load')
+@click.argument('files', nargs=-1, required=True, type=click.File('rb'))
+def load_command(files):
+    """Load exchange rates against FX_BASE_CURRENCY from CSV files."""
+    base = current_app.config.get('FX_BASE_CURRENCY', 'EUR')
+    try:
+        count = load_rates(itertools.chain.from_iterable(parse_rates(file) for file in files), base)
+    except ValueError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    click.echo(f"Loaded {count} rates against {base}.")
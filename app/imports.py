@@ -0,0 +1,138 @@
+import csv
+import io
+import json
+from datetime import datetime
+from app import db
+from app.models import validate_amount, validate_date
+from app.money import to_minor
+from app.rollups import add_to_rollups
+from app.cache import bump_versions
+from app.categories import get_or_create_category_id
+from app.rules import evaluate_new_expenses
+from app.fx import reporting_currency, check_currency
+from app.search import insert_expenses
+from app.categorizer import assign_categories, add_to_category_index
+from app.budgets import update_budgets
+
+IMPORT_FIELDS = ['description', 'date', 'amount']  # category and currency are optional
+
+
+def parse_csv(stream):
+    """Yield (line number, record) for each row of a CSV body with a header line."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    for record in reader:
+        yield reader.line_num, record
+
+def parse_ndjson(stream):
+    """Yield (line number, record) for each non-blank line of an NDJSON body."""
+    for line_number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record
+
+def validate_import_row(record, currency):
+    """Turn a raw record into column values, with the same rules as the Expenses model; currency is the default one."""
+    if not isinstance(record, dict):
+        raise ValueError("Row is not a JSON object")
+    missing = [field for field in IMPORT_FIELDS if record.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+
+    if record.get('currency') not in (None, ''):
+        currency = str(record['currency']).strip().upper()
+        check_currency(currency)
+    amount_minor = to_minor(record['amount'], currency)
+    validate_amount(amount_minor)
+
+    try:
+        date = datetime.fromisoformat(str(record['date']).strip())
+    except ValueError:
+        raise ValueError("Date must be in YYYY-MM-DD format")
+    validate_date(date)
+
+    description = str(record['description']).strip()
+    if len(description) > 255:
+        raise ValueError("Description is too long")
+    category = str(record.get('category') or '').strip()
+    if len(category) > 50:
+        raise ValueError("Category name is too long")
+    return {'amount_minor': amount_minor, 'currency': currency, 'description': description, 'date': date, 'category': category or None}
+
+
+def resolve_categories(names, cache):
+    """Fill cache with name -> id for every name, creating the categories that don't exist yet."""
+    for name in set(names) - cache.keys():
+        cache[name] = get_or_create_category_id(name)
+
+def import_expenses(user_id, records, batch_size=1000, max_errors=1000):
+    """
+    Validate and insert (line number, record) pairs for one user.
+
+    Rows are buffered up to batch_size, inserted with multi-row INSERTs and
+    committed, so memory use is bounded by the batch and not the upload.
+    Invalid rows are skipped and reported by line number. Rows without a
+    currency are in the user's reporting currency, rows without a category
+    are placed by the categorizer.
+
+    A body that cannot be decoded or parsed stops the import there: the rows
+    read before it are still imported, the first line not read is reported
+    as an error and complete is False, so the client knows where to resume.
+    """
+    currency = reporting_currency(user_id)
+    categories = {}
+    report = {'imported': 0, 'categorized': 0, 'failed': 0, 'errors': [], 'complete': True}
+    batch = []
+
+    def flush_batch():
+        resolve_categories({row['category'] for row in batch if row['category']}, categories)
+        rows = [
+            {'amount_minor': row['amount_minor'], 'currency': row['currency'], 'description': row['description'],
+             'date': row['date'], 'user_id': user_id, 'category_id': categories.get(row['category'])}
+            for row in batch
+        ]
+        report['categorized'] += assign_categories(user_id, rows)
+        insert_expenses(rows)
+        # Core inserts skip the ORM flush hooks, so rollups, the category index, budgets and the cache version are
+        # updated here in the same transaction
+        add_to_rollups(db.session.connection(), rows)
+        add_to_category_index(db.session.connection(), rows)
+        update_budgets(db.session.connection(), rows)
+        bump_versions(db.session.connection(), [user_id])
+        evaluate_new_expenses(rows)
+        db.session.commit()
+        report['imported'] += len(rows)
+        batch.clear()
+
+    def add_error(line_number, message):
+        report['failed'] += 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'line': line_number, 'message': message})
+
+    records = iter(records)
+    line_number = 0
+    while True:
+        try:
+            line_number, record = next(records)
+        except StopIteration:
+            break
+        except (UnicodeDecodeError, csv.Error) as e:
+            # Earlier batches are committed already; report them rather than fail the whole upload
+            add_error(line_number + 1, f"Could not read the file: {e}")
+            report['complete'] = False
+            break
+        try:
+            batch.append(validate_import_row(record, currency))
+        except ValueError as e:
+            add_error(line_number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush_batch()
+    if batch:
+        flush_batch()
+
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report
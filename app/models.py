@@ -1,6 +1,8 @@
-from app import db, bcrypt
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import relationship, validates
+from app import db
+from app.passwords import hash_password
+from app.money import DEFAULT_CURRENCY, MAX_MINOR, to_minor, from_minor
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Date, DateTime, ForeignKey, Boolean, Index
+from sqlalchemy.orm import relationship, validates, column_property
 from datetime import datetime
 import re
 
@@ -18,19 +20,51 @@ def validate_password(password):
     if len(password) < 8:
         raise ValueError("Password must be at least 8 characters long")
 
-def validate_amount(amount):
-    if amount <= 0:
+def validate_amount(amount_minor):
+    if amount_minor <= 0:
         raise ValueError("Amount must be greater than zero")
+    if amount_minor > MAX_MINOR:
+        raise ValueError("Amount is too large")
+
+def validate_currency(currency):
+    if not isinstance(currency, str) or not re.match(r'^[A-Z]{3}$', currency):
+        raise ValueError("Currency must be a three-letter ISO 4217 code")
 
 def validate_date(date):
     if not isinstance(date, datetime):
         raise ValueError("Date must be a datetime object")
 
+def validate_rule_kind(kind):
+    allowed_kinds = ['threshold', 'category_budget', 'rolling_limit', 'anomaly']
+    if kind not in allowed_kinds:
+        raise ValueError(f"Rule kind must be one of {allowed_kinds}.")
+
+def validate_budget_period(period):
+    allowed_periods = ['weekly', 'monthly', 'yearly']
+    if period not in allowed_periods:
+        raise ValueError(f"Period must be one of {allowed_periods}.")
+
 def validate_recurrence(recurrence):
     allowed_recurrences = ['daily', 'weekly', 'monthly', 'yearly']
     if recurrence not in allowed_recurrences:
         raise ValueError(f"Recurrence must be one of {allowed_recurrences}.")
 
+class MinorUnitsAmount:
+    """
+    amount in major units, read from and written to the integer amount_minor column.
+
+    Setting it converts exactly (see app/money.py), in the currency already
+    set on the instance or the default one. SQL works on amount_minor.
+    """
+
+    @property
+    def amount(self):
+        return from_minor(self.amount_minor, self.currency or DEFAULT_CURRENCY)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_minor = to_minor(value, self.currency or DEFAULT_CURRENCY)
+
 # User model
 class User(db.Model):
     id = Column(Integer, primary_key=True)
@@ -38,6 +72,8 @@ class User(db.Model):
     user_name = Column(String(50), unique=True, nullable=False)
     password_hash = Column(String(128))
     created_at = Column(DateTime, default=datetime.utcnow)
+    is_admin = Column(Boolean, default=False, nullable=False)
+    reporting_currency = Column(String(3), nullable=False, default=DEFAULT_CURRENCY)  # Summaries and exports convert into it
 
     # Relationships
     expenses = relationship('Expenses', back_populates='user')
@@ -45,7 +81,7 @@ class User(db.Model):
 
     def set_password(self, password):
         validate_password(password)
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = hash_password(password)
 
     def set_email(self, email):
         validate_email(email)
@@ -55,12 +91,18 @@ class User(db.Model):
         validate_username(username)
         self.user_name = username
 
+    @validates('reporting_currency')
+    def validate_reporting_currency(self, key, currency):
+        validate_currency(currency)
+        return currency
+
 # Expenses model
-class Expenses(db.Model):
+class Expenses(MinorUnitsAmount, db.Model):
     __tablename__ = 'expenses'
     
     id = Column(Integer, primary_key=True)
-    amount = Column(Float, nullable=False)
+    amount_minor = Column(BigInteger, nullable=False)  # Pence, cents, ... of currency
+    currency = Column(String(3), nullable=False, default=DEFAULT_CURRENCY)  # ISO 4217 code
     description = Column(String(255), nullable=False)
     date = Column(DateTime, nullable=False)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
@@ -70,10 +112,22 @@ class Expenses(db.Model):
     user = relationship('User', back_populates='expenses')
     category = relationship('Category', back_populates='expenses_list')
 
-    @validates('amount')
-    def validate_amount(self, key, amount):
-        validate_amount(amount)
-        return amount
+    # Every /expenses filter and sort is scoped to one user, so user_id leads each index
+    __table_args__ = (
+        Index('ix_expenses_user_id_date', 'user_id', 'date'),
+        Index('ix_expenses_user_id_category_id_date', 'user_id', 'category_id', 'date'),
+        Index('ix_expenses_user_id_amount_minor', 'user_id', 'amount_minor'),
+    )
+
+    @validates('amount_minor')
+    def validate_amount(self, key, amount_minor):
+        validate_amount(amount_minor)
+        return amount_minor
+
+    @validates('currency')
+    def validate_currency(self, key, currency):
+        validate_currency(currency)
+        return currency
 
     @validates('date')
     def validate_date(self, key, date):
@@ -97,11 +151,12 @@ class Category(db.Model):
         return name
 
 # RecurringExpense model
-class RecurringExpense(db.Model):
+class RecurringExpense(MinorUnitsAmount, db.Model):
     __tablename__ = 'recurring_expense'
     
     id = Column(Integer, primary_key=True)
-    amount = Column(Float, nullable=False)
+    amount_minor = Column(BigInteger, nullable=False)
+    currency = Column(String(3), nullable=False, default=DEFAULT_CURRENCY)
     type_expense = Column(String(255), nullable=False)
     description_expense = Column(String(255), nullable=False)
     recurrence = Column(String(255), nullable=False)
@@ -109,11 +164,25 @@ class RecurringExpense(db.Model):
     end_date = Column(DateTime, nullable=False)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     category_id = Column(Integer, ForeignKey('category.id'), nullable=False)
+    # High-water mark: date of the last occurrence already written to expenses
+    last_generated = Column(DateTime, nullable=True)
+    # Next occurrence to write, NULL once it would be past end_date; the recurring job reads only schedules due
+    next_due = Column(DateTime, nullable=True, index=True, default=lambda context: context.get_current_parameters()['start_date'])
     
     # Relationships
     user = relationship('User', back_populates='recurring_expenses')
     category = relationship('Category', back_populates='recurring_expenses_list')
 
+    @validates('amount_minor')
+    def validate_amount(self, key, amount_minor):
+        validate_amount(amount_minor)
+        return amount_minor
+
+    @validates('currency')
+    def validate_currency(self, key, currency):
+        validate_currency(currency)
+        return currency
+
     @validates('recurrence')
     def validate_recurrence(self, key, recurrence):
         validate_recurrence(recurrence)
@@ -126,6 +195,76 @@ class RecurringExpense(db.Model):
             raise ValueError("End date cannot be before start date")
         return date
 
+# Per user, category, month and currency spending in minor units, kept in step with expenses by app/rollups.py
+class ExpenseRollup(db.Model):
+    __tablename__ = 'expense_rollup'
+
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    category_id = Column(Integer, ForeignKey('category.id'), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    currency = Column(String(3), primary_key=True)  # Totals in different currencies are never added up
+    total_minor = Column(BigInteger, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+    min_minor = Column(BigInteger, nullable=False)
+    max_minor = Column(BigInteger, nullable=False)
+
+# How many of a user's expenses with a description feature are in each category, kept in step by app/categorizer.py
+class CategoryToken(db.Model):
+    __tablename__ = 'category_token'
+
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    feature = Column(BigInteger, primary_key=True)  # CRC-32 of a word or merchant, see categorizer.features
+    category_id = Column(Integer, ForeignKey('category.id'), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    # Rows are only ever found by primary key, so SQLite stores them in it instead of beside a rowid
+    __table_args__ = {'sqlite_with_rowid': False}
+
+# A spending limit per user, category and period, with the spend of its current period kept by app/budgets.py
+class Budget(MinorUnitsAmount, db.Model):
+    __tablename__ = 'budget'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    category_id = Column(Integer, ForeignKey('category.id'), nullable=False)
+    period = Column(String(10), nullable=False)  # 'weekly' (from Monday), 'monthly' or 'yearly'
+    amount_minor = Column(BigInteger, nullable=False)  # The limit, in currency
+    currency = Column(String(3), nullable=False, default=DEFAULT_CURRENCY)  # Expenses are converted into it
+    alert_percent = Column(Integer, nullable=False, default=80)  # Notify at this share of the limit, and again at 100
+    period_start = Column(Date, nullable=True)  # First day of the period spent_minor covers, None until first counted
+    spent_minor = Column(BigInteger, nullable=False, default=0)
+    alerted_percent = Column(Integer, nullable=False, default=0)  # Highest threshold already notified this period
+
+    category = relationship('Category')
+
+    # Found by user on /budgets and by (user, category) on every expense write
+    __table_args__ = (
+        Index('ix_budget_user_id_category_id_period', 'user_id', 'category_id', 'period', unique=True),
+    )
+
+    @validates('period')
+    def validate_period(self, key, period):
+        validate_budget_period(period)
+        return period
+
+    @validates('amount_minor')
+    def validate_amount(self, key, amount_minor):
+        validate_amount(amount_minor)
+        return amount_minor
+
+    @validates('currency')
+    def validate_currency(self, key, currency):
+        validate_currency(currency)
+        return currency
+
+# Exchange rates loaded from files by `flask fx load`, read through app/fx.py
+class FxRate(db.Model):
+    __tablename__ = 'fx_rate'
+    currency = Column(String(3), primary_key=True)
+    day = Column(Date, primary_key=True)
+    rate = Column(Float, nullable=False)  # Units of currency per one FX_BASE_CURRENCY
+
 # Notification model
 class Notification(db.Model):
     id = Column(Integer, primary_key=True)
@@ -133,7 +272,130 @@ class Notification(db.Model):
     message = Column(String(255), nullable=False)
     type = Column(String(50), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    is_read = Column(Boolean, default=False)
+    # Old value kept on change, app/notifications.py needs it to keep the unread counter right
+    is_read = column_property(Column(Boolean, default=False), active_history=True)
+
+    # The feed pages by (created_at, id) within a user, all of them or only the unread ones
+    __table_args__ = (
+        Index('ix_notification_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_notification_user_id_is_read_created_at', 'user_id', 'is_read', 'created_at'),
+    )
 
     def __repr__(self):
         return f'<Notification {self.message}>'
+
+# Unread notifications per user, kept in step with every write to notification
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counter'
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    unread = Column(Integer, nullable=False, default=0)
+
+# Per-user notification rules, compiled and evaluated by app/rules.py
+class NotificationRule(db.Model):
+    __tablename__ = 'notification_rule'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False, index=True)
+    kind = Column(String(30), nullable=False)
+    amount_minor = Column(BigInteger, nullable=True)  # threshold, budget or limit, in DEFAULT_CURRENCY minor units
+    category_id = Column(Integer, ForeignKey('category.id'), nullable=True)  # category_budget only
+    window_days = Column(Integer, nullable=True)  # rolling_limit only
+    factor = Column(Float, nullable=True)  # anomaly only: standard deviations above the user's mean
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    category = relationship('Category')
+
+    @validates('kind')
+    def validate_kind(self, key, kind):
+        validate_rule_kind(kind)
+        return kind
+
+    @property
+    def amount(self):
+        return None if self.amount_minor is None else from_minor(self.amount_minor)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_minor = None if value is None else to_minor(value)
+
+    @validates('amount_minor')
+    def validate_amount(self, key, amount_minor):
+        if amount_minor is not None:
+            validate_amount(amount_minor)
+        return amount_minor
+
+# Notifications waiting to be delivered, written in the same transaction as whatever caused them
+class NotificationOutbox(db.Model):
+    __tablename__ = 'notification_outbox'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    message = Column(String(255), nullable=False)
+    type = Column(String(50), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Failed logins per email and per client IP over a sliding window, see app/ratelimit.py
+class LoginAttempt(db.Model):
+    __tablename__ = 'login_attempt'
+    key = Column(String(255), primary_key=True)  # 'email:<address>' or 'ip:<address>'
+    window_start = Column(Integer, nullable=False)  # Unix time the current fixed window began
+    current = Column(Integer, nullable=False, default=0)  # Failures in the current window
+    previous = Column(Integer, nullable=False, default=0)  # Failures in the window before it
+
+
+# Bumped on every write to a user's expenses or notifications, see app/cache.py
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_version'
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+# Bumped whenever an in-memory registry's table changes, see app/categories.py and app/fx.py
+class RegistryVersion(db.Model):
+    __tablename__ = 'registry_version'
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+# Held by the one process allowed to run scheduled jobs, renewed until it stops, see app/scheduler.py
+class SchedulerLease(db.Model):
+    __tablename__ = 'scheduler_lease'
+    name = Column(String(50), primary_key=True)
+    owner = Column(String(120), nullable=False)  # host:pid:random of the runner holding it
+    expires_at = Column(DateTime, nullable=False)
+
+
+# When each scheduled job runs next, so restarts neither repeat nor skip a run
+class ScheduledJob(db.Model):
+    __tablename__ = 'scheduled_job'
+    name = Column(String(50), primary_key=True)
+    interval_seconds = Column(Integer, nullable=False)
+    next_run_at = Column(DateTime, nullable=False)
+    last_run_at = Column(DateTime, nullable=True)
+
+
+# One row per scheduled job run, with its duration, rows written and any error
+class JobRun(db.Model):
+    __tablename__ = 'job_run'
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String(50), nullable=False)
+    owner = Column(String(120), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    duration = Column(Float, nullable=True)  # Seconds
+    rows = Column(Integer, nullable=True)  # What the job reports it wrote or deleted
+    status = Column(String(20), nullable=False, default='running')  # running, succeeded or failed
+    error = Column(String(255), nullable=True)
+
+    __table_args__ = (
+        Index('ix_job_run_job_name_started_at', 'job_name', 'started_at'),
+    )
+
+
+# Revoked JWTs, kept until the token would have expired anyway
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_token'
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(36), unique=True, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Other workers sync by id, so ids of pruned rows must never be handed out again
+    __table_args__ = {'sqlite_autoincrement': True}
@@ -0,0 +1,65 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+DEFAULT_CURRENCY = 'GBP'
+# Digits after the decimal point of ISO 4217 currencies, every code not listed here has 2
+CURRENCY_EXPONENTS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0, 'PYG': 0,
+    'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+# Minor units per major unit, for the currencies that don't have 100
+SCALES = {currency: 10 ** digits for currency, digits in CURRENCY_EXPONENTS.items()}
+FIXED_POINT = {0: '%.0f', 2: '%.2f', 3: '%.3f'}
+# Largest amount accepted, in minor units; sums of many of them still fit a signed 64-bit integer
+MAX_MINOR = 10 ** 13
+
+
+def exponent(currency):
+    return CURRENCY_EXPONENTS.get(currency, 2)
+
+def scale(currency):
+    return SCALES.get(currency, 100)
+
+def to_minor(value, currency=DEFAULT_CURRENCY):
+    """
+    An amount in the currency's minor units (pence, cents) as an int.
+
+    value is an int, a float or a numeric string in major units. Floats go
+    through their shortest repr, so 0.1 is read as the decimal 0.1 and not
+    the binary fraction it is stored as. Anything finer than the minor unit
+    is rounded half up.
+    """
+    if isinstance(value, bool):
+        raise ValueError("Amount must be a number")
+    if isinstance(value, int):
+        return value * scale(currency)
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        raise ValueError("Amount must be a number")
+    if not amount.is_finite():
+        raise ValueError("Amount must be a number")
+    return int(amount.scaleb(exponent(currency)).to_integral_value(ROUND_HALF_UP))
+
+def from_minor(minor, currency=DEFAULT_CURRENCY):
+    """
+    The float nearest to an amount in minor units, for JSON.
+
+    The division is correctly rounded and the minor unit is at most three
+    digits, so the float's repr is the exact decimal amount: 1999 -> 19.99.
+    """
+    return minor / SCALES.get(currency, 100)
+
+def format_minor(minor, currency=DEFAULT_CURRENCY):
+    """
+    An amount in minor units as a fixed-point string with the currency's digits: 1999 -> '19.99'.
+
+    Up to MAX_MINOR the float quotient is within far less than half a minor
+    unit of the exact amount, so printing it with the currency's digits gives
+    the exact decimal without building a Decimal.
+    """
+    return FIXED_POINT[CURRENCY_EXPONENTS.get(currency, 2)] % (minor / SCALES.get(currency, 100))
+
+def average_minor(total, count):
+    """total / count in minor units, rounded half up with integers only."""
+    return (2 * total + count) // (2 * count)
@@ -0,0 +1,214 @@
+import queue
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, insert, update, delete, literal, tuple_, inspect
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Notification, NotificationOutbox, NotificationCounter
+from app.cache import bump_versions
+
+
+class NotificationDispatcher:
+    """
+    Moves notifications from the outbox table into notification.
+
+    Writers only add NotificationOutbox rows to their own transaction; once it
+    commits, a wake-up is put on the queue and one of the worker threads
+    delivers everything pending in batches. Workers also sweep the outbox
+    every sweep_interval seconds, so rows left by a crashed process or a
+    failed batch are delivered later (at least once).
+    """
+
+    def __init__(self, app, workers=1, batch_size=500, sweep_interval=30):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self.queue = queue.Queue()
+        self.threads = []
+
+    def start(self):
+        for n in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f'notification-worker-{n}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def notify(self):
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            try:
+                self.queue.get(timeout=self.sweep_interval)
+                # One drain covers every wake-up queued so far
+                while True:
+                    self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            with self.app.app_context():
+                try:
+                    self.drain()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Notification delivery failed, the outbox will be retried")
+                finally:
+                    db.session.remove()
+
+    def drain(self):
+        """Deliver every pending outbox row, batch_size per transaction. Returns how many were delivered."""
+        outbox = NotificationOutbox.__table__
+        notifications = Notification.__table__
+        delivered = 0
+        while True:
+            # Claim the rows by deleting them first: the DELETE takes the write lock, so a concurrent drainer
+            # gets no row twice and everything below counts only what this transaction moved
+            claimed = sorted(db.session.execute(
+                delete(outbox)
+                .where(outbox.c.id.in_(select(outbox.c.id).order_by(outbox.c.id).limit(self.batch_size)))
+                .returning(outbox.c.id, outbox.c.user_id, outbox.c.message, outbox.c.type, outbox.c.created_at)
+            ).all())
+            if not claimed:
+                db.session.commit()
+                return delivered
+            db.session.execute(insert(notifications), [
+                {'user_id': row.user_id, 'message': row.message, 'type': row.type, 'created_at': row.created_at, 'is_read': False}
+                for row in claimed
+            ])
+            add_unread(db.session.connection(), Counter(row.user_id for row in claimed))
+            bump_versions(db.session.connection(), [row.user_id for row in claimed])
+            db.session.commit()
+            delivered += len(claimed)
+
+
+def create_notification_dispatcher(app):
+    dispatcher = NotificationDispatcher(
+        app,
+        workers=app.config.get('NOTIFICATION_WORKERS', 1),
+        batch_size=app.config.get('NOTIFICATION_BATCH_SIZE', 500),
+        sweep_interval=app.config.get('NOTIFICATION_SWEEP_SECONDS', 30),
+    )
+    app.extensions['notification_dispatcher'] = dispatcher
+    if dispatcher.workers:
+        dispatcher.start()
+    return dispatcher
+
+def notifications_query(user_id, unread=False, limit=50, after=None):
+    """
+    A SELECT of the user's newest notifications, with the columns serialize_notification needs.
+
+    after is a decoded (created_at, id) cursor; the page starts just past it.
+    """
+    query = select(Notification.id, Notification.type, Notification.message, Notification.created_at, Notification.is_read) \
+        .where(Notification.user_id == user_id)
+    if unread:
+        query = query.where(Notification.is_read.is_(False))
+    if after is not None:
+        query = query.where(tuple_(Notification.created_at, Notification.id) < tuple_(
+            literal(after[0], Notification.created_at.type), literal(after[1], Notification.id.type)))
+    return query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit)
+
+def unread_query(user_id):
+    return select(NotificationCounter.unread).where(NotificationCounter.user_id == user_id)
+
+def unread_count(user_id):
+    # A counter can dip below zero if rows were added behind the app's back
+    return max(db.session.execute(unread_query(user_id)).scalar() or 0, 0)
+
+def unread_upsert(dialect_name):
+    counters = NotificationCounter.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(counters)
+    return statement.on_conflict_do_update(
+        index_elements=[counters.c.user_id],
+        set_={'unread': counters.c.unread + statement.excluded.unread},
+    )
+
+def add_unread(connection, deltas):
+    """Apply {user_id: change} to the unread counters, in the caller's transaction."""
+    rows = [{'user_id': user_id, 'unread': delta} for user_id, delta in sorted(deltas.items()) if delta and user_id is not None]
+    if rows:
+        connection.execute(unread_upsert(connection.dialect.name), rows)
+
+def mark_read(user_id, from_id, to_id):
+    """Mark the user's unread notifications with from_id <= id <= to_id as read. Returns how many changed."""
+    result = db.session.execute(
+        update(Notification.__table__)
+        .where(Notification.user_id == user_id, Notification.id.between(from_id, to_id), Notification.is_read.is_(False))
+        .values(is_read=True)
+    )
+    # Core statements skip the flush hooks, the counter and cache version follow here in the same transaction
+    add_unread(db.session.connection(), {user_id: -result.rowcount})
+    bump_versions(db.session.connection(), [user_id])
+    db.session.commit()
+    return result.rowcount
+
+def prune_read_notifications(retention_days=90, batch_size=1000, now=None):
+    """Delete read notifications older than retention_days, batch_size per transaction. Returns how many."""
+    before = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    notifications = Notification.__table__
+    deleted = 0
+    while True:
+        rows = db.session.execute(
+            select(notifications.c.id, notifications.c.user_id)
+            .where(notifications.c.is_read.is_(True), notifications.c.created_at < before)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return deleted
+        db.session.execute(delete(notifications).where(notifications.c.id.in_([row.id for row in rows])))
+        # Only read rows go, so the unread counters don't change
+        bump_versions(db.session.connection(), [row.user_id for row in rows])
+        db.session.commit()
+        deleted += len(rows)
+
+def serialize_notification(notification):
+    return {
+        'notification_id': notification.id,
+        'type': notification.type,
+        'message': notification.message,
+        'created_at': notification.created_at.isoformat(),
+        'is_read': notification.is_read,
+    }
+
+def queue_notification(user_id, message, notif_type):
+    """Add a notification to the current transaction; it is delivered after the commit."""
+    db.session.add(NotificationOutbox(user_id=user_id, message=message, type=notif_type))
+    db.session.info['outbox_pending'] = True
+
+def queue_notifications(rows):
+    """Batch version of queue_notification for dicts with user_id, message and type."""
+    if rows:
+        db.session.execute(insert(NotificationOutbox.__table__), rows)
+        db.session.info['outbox_pending'] = True
+
+
+@event.listens_for(Session, 'before_flush')
+def count_unread_changes(session, flush_context, instances):
+    # Before the flush, so a deleted row's is_read can still be loaded
+    deltas = Counter()
+    for instance in session.new:
+        if isinstance(instance, Notification) and not instance.is_read:
+            deltas[instance.user_id] += 1
+    for instance in session.deleted:
+        if isinstance(instance, Notification) and not instance.is_read:
+            deltas[instance.user_id] -= 1
+    for instance in session.dirty:
+        if isinstance(instance, Notification):
+            history = inspect(instance).attrs.is_read.history
+            if history.added and history.deleted and bool(history.added[0]) != bool(history.deleted[0]):
+                deltas[instance.user_id] += -1 if history.added[0] else 1
+    add_unread(session.connection(), deltas)
+
+@event.listens_for(Session, 'after_commit')
+def wake_dispatcher(session):
+    if session.info.pop('outbox_pending', False) and has_app_context():
+        current_app.extensions['notification_dispatcher'].notify()
+
+@event.listens_for(Session, 'after_rollback')
+def forget_pending(session):
+    session.info.pop('outbox_pending', None)
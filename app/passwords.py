@@ -0,0 +1,84 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from flask import current_app
+from werkzeug.security import check_password_hash
+
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
+
+# These run in the worker processes, so they stay plain module-level functions
+def hash_with_rounds(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def check_hash(password, password_hash):
+    if password_hash.startswith(BCRYPT_PREFIXES):
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+        except ValueError:
+            return False
+    # Older hashes written by werkzeug's generate_password_hash (pbkdf2 or scrypt)
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords with bcrypt at a configured cost.
+
+    With workers > 0 the work runs in a process pool of that size, so a burst
+    of logins queues for the pool instead of taking every CPU the web workers
+    have. The pool is started on first use, not when the app is created.
+    """
+
+    def __init__(self, rounds=12, workers=0):
+        self.rounds = rounds
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.dummy_hash = None
+
+    def run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        with self.lock:
+            if self.pool is None:
+                # spawn, because forking a process that already runs scheduler threads is unsafe
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool.submit(function, *args).result()
+
+    def hash(self, password):
+        return self.run(hash_with_rounds, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self.run(check_hash, password, password_hash)
+
+    def verify_unknown(self, password):
+        """Spend as long as a real check would, so unknown emails can't be told apart by timing."""
+        if self.dummy_hash is None:
+            self.dummy_hash = hash_with_rounds('unknown user', self.rounds)
+        self.verify(password, self.dummy_hash)
+        return False
+
+    def needs_rehash(self, password_hash):
+        if not password_hash.startswith(BCRYPT_PREFIXES):
+            return True
+        return int(password_hash[4:6]) != self.rounds
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+def create_password_hasher(app):
+    hasher = PasswordHasher(
+        rounds=app.config.get('BCRYPT_LOG_ROUNDS', 12),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 0),
+    )
+    app.extensions['password_hasher'] = hasher
+    return hasher
+
+def hash_password(password):
+    return current_app.extensions['password_hasher'].hash(password)
@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import Counter
+
+
+def window_start(now, window):
+    return int(now // window) * window
+
+def sliding_count(window, start, current, previous, now):
+    """
+    Estimate the events in the last `window` seconds from two fixed-window counters.
+
+    The previous window's count is weighted by how much of it still overlaps
+    the sliding window, so each key costs two integers whatever the traffic.
+    """
+    current_start = window_start(now, window)
+    if start == current_start - window:
+        current, previous = 0, current
+    elif start != current_start:
+        return 0
+    return current + previous * (1 - (now - current_start) / window)
+
+
+class MemoryAttemptStore:
+    """Failure counters kept in this process only, dropped two windows after their last hit."""
+
+    def __init__(self, window=900):
+        self.window = window
+        self.counters = {}  # key -> [window start, current count, previous count]
+        self.lock = threading.Lock()
+        self.next_prune = 0.0
+
+    def hit(self, key, now=None):
+        now = time.time() if now is None else now
+        start = window_start(now, self.window)
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None or counter[0] < start - self.window:
+                self.counters[key] = [start, 1, 0]
+            elif counter[0] < start:
+                self.counters[key] = [start, 1, counter[1]]
+            else:
+                counter[1] += 1
+        if now >= self.next_prune:
+            self.prune(now)
+
+    def count(self, key, now=None):
+        now = time.time() if now is None else now
+        counter = self.counters.get(key)
+        if counter is None:
+            return 0
+        return sliding_count(self.window, *counter, now)
+
+    def reset(self, key):
+        with self.lock:
+            self.counters.pop(key, None)
+
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        oldest = window_start(now, self.window) - self.window
+        with self.lock:
+            stale = [key for key, counter in self.counters.items() if counter[0] < oldest]
+            for key in stale:
+                del self.counters[key]
+            self.next_prune = now + self.window
+        return len(stale)
+
+
+class SQLAttemptStore:
+    """
+    Failure counters in the login_attempt table, shared by every worker.
+
+    A hit is one upsert that rolls the window forward in SQL, so concurrent
+    workers never lose each other's increments; a check is one primary key read.
+    """
+
+    def __init__(self, window=900):
+        self.window = window
+
+    def upsert_statement(self, dialect_name):
+        from app.models import LoginAttempt  # Import inside the function to avoid circular imports
+        from sqlalchemy import bindparam, case
+        if dialect_name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        attempts = LoginAttempt.__table__
+        start = bindparam('start')
+        statement = dialect_insert(attempts)
+        # Every right-hand side sees the row as it was before the update
+        return statement.on_conflict_do_update(
+            index_elements=[attempts.c.key],
+            set_={
+                'previous': case(
+                    (attempts.c.window_start == start, attempts.c.previous),
+                    (attempts.c.window_start == start - self.window, attempts.c.current),
+                    else_=0,
+                ),
+                'current': case((attempts.c.window_start == start, attempts.c.current + 1), else_=1),
+                'window_start': start,
+            },
+        )
+
+    def hit(self, key, now=None):
+        from app.models import db  # Import inside the function to avoid circular imports
+        now = time.time() if now is None else now
+        start = window_start(now, self.window)
+        statement = self.upsert_statement(db.session.get_bind().dialect.name)
+        db.session.execute(statement, {'key': key, 'window_start': start, 'current': 1, 'previous': 0, 'start': start})
+        db.session.commit()
+
+    def count(self, key, now=None):
+        from app.models import LoginAttempt, db  # Import inside the function to avoid circular imports
+        now = time.time() if now is None else now
+        counter = db.session.get(LoginAttempt, key, populate_existing=True)
+        if counter is None:
+            return 0
+        return sliding_count(self.window, counter.window_start, counter.current, counter.previous, now)
+
+    def reset(self, key):
+        from app.models import LoginAttempt, db  # Import inside the function to avoid circular imports
+        LoginAttempt.query.filter_by(key=key).delete(synchronize_session=False)
+        db.session.commit()
+
+    def prune(self, now=None):
+        from app.models import LoginAttempt, db  # Import inside the function to avoid circular imports
+        now = time.time() if now is None else now
+        oldest = window_start(now, self.window) - self.window
+        deleted = LoginAttempt.query.filter(LoginAttempt.window_start < oldest).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
+class LoginLimiter:
+    """
+    Counts failed logins per email and per client IP.
+
+    blocked() is meant to run before any password hashing, so an account under
+    attack or a flooding client costs one counter read per request.
+    """
+
+    def __init__(self, store, max_failures=5, ip_max_failures=50):
+        self.store = store
+        self.max_failures = max_failures
+        self.ip_max_failures = ip_max_failures
+        self.rejected = Counter()  # 'email' / 'ip' -> attempts turned away in this process
+        self.lock = threading.Lock()
+
+    def blocked(self, email, ip):
+        """Return 'email' or 'ip' when the attempt must be refused, None otherwise."""
+        reason = None
+        if self.store.count(f'email:{email.lower()}') >= self.max_failures:
+            reason = 'email'
+        elif ip and self.store.count(f'ip:{ip}') >= self.ip_max_failures:
+            reason = 'ip'
+        if reason:
+            with self.lock:
+                self.rejected[reason] += 1
+        return reason
+
+    def failed(self, email, ip):
+        """Record a failed login. Returns True when it locks the account."""
+        key = f'email:{email.lower()}'
+        self.store.hit(key)
+        if ip:
+            self.store.hit(f'ip:{ip}')
+        return self.store.count(key) >= self.max_failures
+
+    def succeeded(self, email):
+        self.store.reset(f'email:{email.lower()}')
+
+
+def create_login_limiter(app):
+    backend = app.config.get('LOGIN_LIMIT_BACKEND', 'sql')
+    window = app.config.get('LOGIN_FAILURE_WINDOW_SECONDS', 900)
+    if backend == 'sql':
+        store = SQLAttemptStore(window=window)
+    elif backend == 'memory':
+        store = MemoryAttemptStore(window=window)
+    else:
+        raise ValueError("LOGIN_LIMIT_BACKEND must be 'sql' or 'memory'.")
+    limiter = LoginLimiter(
+        store,
+        max_failures=app.config.get('LOGIN_MAX_FAILURES', 5),
+        ip_max_failures=app.config.get('LOGIN_IP_MAX_FAILURES', 50),
+    )
+    app.extensions['login_limiter'] = limiter
+    return limiter
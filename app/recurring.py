@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+from flask import current_app
+from sqlalchemy import select, update, bindparam
+from app import db
+from app.models import RecurringExpense
+from app.rollups import add_to_rollups
+from app.categorizer import add_to_category_index
+from app.budgets import update_budgets
+from app.cache import bump_versions
+from app.rules import evaluate_new_expenses
+from app.search import insert_expenses
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Fixed-length steps can be computed with plain arithmetic, calendar steps need relativedelta
+FIXED_STEPS = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+MONTH_STEPS = {
+    'monthly': 1,
+    'yearly': 12,
+}
+
+
+def occurrence(start_date, recurrence, n):
+    """Return the n-th occurrence of a schedule (0 is start_date itself)."""
+    # Always offset from the anchor so month ends don't drift (Jan 31 -> Feb 29 -> Mar 31)
+    if recurrence in FIXED_STEPS:
+        return start_date + FIXED_STEPS[recurrence] * n
+    return start_date + relativedelta(months=MONTH_STEPS[recurrence] * n)
+
+
+def first_index_after(start_date, recurrence, mark):
+    """Return the index of the first occurrence strictly after mark."""
+    if mark is None or mark < start_date:
+        return 0
+    if recurrence in FIXED_STEPS:
+        n = (mark - start_date) // FIXED_STEPS[recurrence]
+    else:
+        delta = relativedelta(mark, start_date)
+        n = (delta.years * 12 + delta.months) // MONTH_STEPS[recurrence]
+    # Jump straight to the estimate, then correct for month-length clipping
+    while n > 0 and occurrence(start_date, recurrence, n - 1) > mark:
+        n -= 1
+    while occurrence(start_date, recurrence, n) <= mark:
+        n += 1
+    return n
+
+
+def next_due(start_date, end_date, recurrence, mark):
+    """Return the first occurrence after mark, or None once that is past end_date."""
+    date = occurrence(start_date, recurrence, first_index_after(start_date, recurrence, mark))
+    return date if date <= end_date else None
+
+
+def due_occurrences(start_date, end_date, recurrence, last_generated, now):
+    """Yield every occurrence after last_generated up to min(now, end_date)."""
+    until = min(now, end_date)
+    n = first_index_after(start_date, recurrence, last_generated)
+    date = occurrence(start_date, recurrence, n)
+    while date <= until:
+        yield date
+        n += 1
+        date = occurrence(start_date, recurrence, n)
+
+
+def generate_recurring_expenses(now=None, batch_size=None):
+    """
+    Write every due occurrence of every RecurringExpense into expenses.
+
+    Only schedules whose next_due has come are read, in next_due order from its
+    index, so a run costs the due schedules rather than every schedule. Each
+    batch of batch_size inserts its expenses with multi-row INSERTs, moves the
+    high-water marks forward and next_due past now, and commits, so a crash or
+    a re-run never duplicates rows and no transaction stays open for the whole
+    job. Returns the number of expenses created.
+    """
+    now = now or datetime.utcnow()
+    batch_size = batch_size or current_app.config.get('RECURRING_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+    schedules = RecurringExpense.__table__
+
+    due = select(
+        schedules.c.id,
+        schedules.c.amount_minor,
+        schedules.c.currency,
+        schedules.c.description_expense,
+        schedules.c.recurrence,
+        schedules.c.start_date,
+        schedules.c.end_date,
+        schedules.c.user_id,
+        schedules.c.category_id,
+        schedules.c.last_generated,
+    ).where(
+        # Only schedules with an occurrence to write; finished ones have next_due NULL
+        schedules.c.next_due <= now,
+    ).order_by(schedules.c.next_due, schedules.c.id).limit(batch_size)
+
+    advance_mark = (
+        update(schedules)
+        .where(schedules.c.id == bindparam('schedule_id'))
+        .values(last_generated=bindparam('mark'), next_due=bindparam('next_due'))
+    )
+
+    created = 0
+    while True:
+        # Every schedule read leaves the due set when its batch commits, so the next read starts after it
+        rows = db.session.execute(due).all()
+        if not rows:
+            break
+
+        new_expenses = []
+        marks = []
+        for row in rows:
+            mark = row.last_generated
+            for date in due_occurrences(row.start_date, row.end_date, row.recurrence, row.last_generated, now):
+                new_expenses.append({
+                    'amount_minor': row.amount_minor,
+                    'currency': row.currency,
+                    'description': row.description_expense,
+                    'date': date,
+                    'user_id': row.user_id,
+                    'category_id': row.category_id,
+                })
+                mark = date
+            marks.append({'schedule_id': row.id, 'mark': mark,
+                          'next_due': next_due(row.start_date, row.end_date, row.recurrence, mark)})
+
+        # Keep individual statements bounded even when a batch has a lot of catch-up to do
+        insert_expenses(new_expenses)
+        # Core inserts skip the ORM flush hooks, so rollups, the category index, budgets and cache versions are
+        # updated here in the same transaction
+        add_to_rollups(db.session.connection(), new_expenses)
+        add_to_category_index(db.session.connection(), new_expenses)
+        update_budgets(db.session.connection(), new_expenses, day=now.date())
+        bump_versions(db.session.connection(), [expense['user_id'] for expense in new_expenses])
+        evaluate_new_expenses(new_expenses)
+        db.session.execute(advance_mark, marks)
+        db.session.commit()
+
+        created += len(new_expenses)
+
+    return created
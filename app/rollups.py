@@ -0,0 +1,241 @@
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, select, insert, update, delete, func, and_, or_, bindparam, extract
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Expenses, ExpenseRollup, Category
+from app.money import from_minor, average_minor
+
+ROLLUP_FIELDS = ('user_id', 'category_id', 'date', 'currency', 'amount_minor')
+
+
+def month_bounds(year, month):
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+def group_by_bucket(rows):
+    """Fold expense rows (dicts with ROLLUP_FIELDS) into one entry per rollup bucket."""
+    buckets = {}
+    for row in rows:
+        date = row['date']
+        key = (row['user_id'], row['category_id'], date.year, date.month, row['currency'])
+        amount = row['amount_minor']
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [amount, 1, amount, amount]
+        else:
+            bucket[0] += amount
+            bucket[1] += 1
+            bucket[2] = min(bucket[2], amount)
+            bucket[3] = max(bucket[3], amount)
+    return [
+        {'user_id': user_id, 'category_id': category_id, 'year': year, 'month': month, 'currency': currency,
+         'total_minor': total, 'count': count, 'min_minor': low, 'max_minor': high}
+        for (user_id, category_id, year, month, currency), (total, count, low, high) in buckets.items()
+    ]
+
+def upsert_statement(dialect_name):
+    rollups = ExpenseRollup.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        least, greatest = func.least, func.greatest
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        least, greatest = func.min, func.max
+    statement = dialect_insert(rollups)
+    return statement.on_conflict_do_update(
+        index_elements=[rollups.c.user_id, rollups.c.category_id, rollups.c.year, rollups.c.month, rollups.c.currency],
+        set_={
+            'total_minor': rollups.c.total_minor + statement.excluded.total_minor,
+            'count': rollups.c.count + statement.excluded.count,
+            'min_minor': least(rollups.c.min_minor, statement.excluded.min_minor),
+            'max_minor': greatest(rollups.c.max_minor, statement.excluded.max_minor),
+        },
+    )
+
+def add_to_rollups(connection, rows):
+    buckets = group_by_bucket(rows)
+    if buckets:
+        connection.execute(upsert_statement(connection.dialect.name), buckets)
+
+def remove_from_rollups(connection, rows):
+    buckets = group_by_bucket(rows)
+    if not buckets:
+        return
+    rollups = ExpenseRollup.__table__
+    expenses = Expenses.__table__
+    params = []
+    for bucket in buckets:
+        start, end = month_bounds(bucket['year'], bucket['month'])
+        params.append({'b_' + name: value for name, value in bucket.items()} | {'b_start': start, 'b_end': end})
+
+    in_bucket = and_(
+        rollups.c.user_id == bindparam('b_user_id'),
+        rollups.c.category_id == bindparam('b_category_id'),
+        rollups.c.year == bindparam('b_year'),
+        rollups.c.month == bindparam('b_month'),
+        rollups.c.currency == bindparam('b_currency'),
+    )
+    connection.execute(
+        update(rollups).where(in_bucket).values(
+            total_minor=rollups.c.total_minor - bindparam('b_total_minor'),
+            count=rollups.c.count - bindparam('b_count'),
+        ),
+        params,
+    )
+    connection.execute(delete(rollups).where(in_bucket, rollups.c.count <= 0), params)
+
+    # Min and max can't be decremented, re-read them when a removed row may have held one
+    bucket_expenses = and_(
+        expenses.c.user_id == rollups.c.user_id,
+        expenses.c.category_id == rollups.c.category_id,
+        expenses.c.date >= bindparam('b_start'),
+        expenses.c.date < bindparam('b_end'),
+        expenses.c.currency == rollups.c.currency,
+    )
+    connection.execute(
+        update(rollups).where(
+            in_bucket,
+            or_(rollups.c.min_minor >= bindparam('b_min_minor'), rollups.c.max_minor <= bindparam('b_max_minor')),
+        ).values(
+            min_minor=select(func.min(expenses.c.amount_minor)).where(bucket_expenses).scalar_subquery(),
+            max_minor=select(func.max(expenses.c.amount_minor)).where(bucket_expenses).scalar_subquery(),
+        ),
+        params,
+    )
+
+
+def current_values(expense, fields=ROLLUP_FIELDS):
+    return {name: getattr(expense, name) for name in fields}
+
+def previous_values(expense, fields=ROLLUP_FIELDS):
+    state = inspect(expense)
+    values = {}
+    for name in fields:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+        elif history.unchanged:
+            values[name] = history.unchanged[0]
+        else:
+            values[name] = getattr(expense, name)
+    return values
+
+def keep_previous_value(target, value, oldvalue, initiator):
+    pass
+
+# Load the old value even when the attribute is set on an expired instance, previous_values needs it
+for name in ROLLUP_FIELDS:
+    event.listen(getattr(Expenses, name), 'set', keep_previous_value, active_history=True)
+
+def flushed_changes(session, fields=ROLLUP_FIELDS):
+    """
+    The fields of the expenses a flush added and removed, for after_flush hooks.
+
+    An expense whose fields changed is removed with its old values and
+    added with its new ones.
+    """
+    added, removed = [], []
+    for expense in session.new:
+        if isinstance(expense, Expenses):
+            added.append(current_values(expense, fields))
+    for expense in session.deleted:
+        if isinstance(expense, Expenses):
+            removed.append(previous_values(expense, fields))
+    for expense in session.dirty:
+        if isinstance(expense, Expenses):
+            state = inspect(expense)
+            if any(state.attrs[name].history.has_changes() for name in fields):
+                removed.append(previous_values(expense, fields))
+                added.append(current_values(expense, fields))
+    return added, removed
+
+@event.listens_for(Session, 'after_flush')
+def update_rollups(session, flush_context):
+    # Runs inside the flush, so rollups commit or roll back together with the expenses
+    added, removed = flushed_changes(session)
+    if added or removed:
+        connection = session.connection()
+        # Add first so a bucket that only changes rows is never emptied and deleted on the way
+        add_to_rollups(connection, added)
+        remove_from_rollups(connection, removed)
+
+
+def rollup_aggregate():
+    expenses = Expenses.__table__
+    year = extract('year', expenses.c.date)
+    month = extract('month', expenses.c.date)
+    return select(
+        expenses.c.user_id, expenses.c.category_id, year, month, expenses.c.currency,
+        func.sum(expenses.c.amount_minor), func.count(), func.min(expenses.c.amount_minor), func.max(expenses.c.amount_minor),
+    ).group_by(expenses.c.user_id, expenses.c.category_id, year, month, expenses.c.currency)
+
+def rebuild_rollups():
+    """Recompute every rollup from the expenses table in one transaction."""
+    rollups = ExpenseRollup.__table__
+    db.session.execute(delete(rollups))
+    db.session.execute(insert(rollups).from_select(
+        ['user_id', 'category_id', 'year', 'month', 'currency', 'total_minor', 'count', 'min_minor', 'max_minor'],
+        rollup_aggregate(),
+    ))
+    db.session.commit()
+
+def verify_rollups():
+    """Return the (user_id, category_id, year, month, currency) keys whose rollup disagrees with the expenses table."""
+    expected = {tuple(row[:5]): tuple(row[5:]) for row in db.session.execute(rollup_aggregate())}
+    stored = {
+        (r.user_id, r.category_id, r.year, r.month, r.currency): (r.total_minor, r.count, r.min_minor, r.max_minor)
+        for r in db.session.execute(select(ExpenseRollup.__table__))
+    }
+    # Integer sums don't depend on the order rows were added in, so they must match exactly
+    return sorted(key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
+
+
+def rollup_summary(user_id, year=None, month=None, category=None):
+    query = db.session.query(ExpenseRollup, Category.name).join(Category, Category.id == ExpenseRollup.category_id) \
+        .filter(ExpenseRollup.user_id == user_id)
+    if year:
+        query = query.filter(ExpenseRollup.year == year)
+    if month:
+        query = query.filter(ExpenseRollup.month == month)
+    if category:
+        query = query.filter(Category.name == category)
+    query = query.order_by(ExpenseRollup.year, ExpenseRollup.month, Category.name, ExpenseRollup.currency)
+    return [
+        {
+            'category': name,
+            'year': rollup.year,
+            'month': rollup.month,
+            'currency': rollup.currency,
+            'total': from_minor(rollup.total_minor, rollup.currency),
+            'count': rollup.count,
+            'min': from_minor(rollup.min_minor, rollup.currency),
+            'max': from_minor(rollup.max_minor, rollup.currency),
+            'average': from_minor(average_minor(rollup.total_minor, rollup.count), rollup.currency),
+        }
+        for rollup, name in query
+    ]
+
+
+rollups_cli = AppGroup('rollups', help='Maintain the expense_rollup table.')
+
+@rollups_cli.command('rebuild')
+def rebuild_command():
+    """Recompute all rollups from expenses and verify them."""
+    rebuild_rollups()
+    mismatches = verify_rollups()
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} rollups differ from expenses after rebuild")
+    click.echo("Rollups rebuilt and verified.")
+
+@rollups_cli.command('verify')
+def verify_command():
+    """Compare rollups against expenses without changing anything."""
+    mismatches = verify_rollups()
+    for key in mismatches:
+        click.echo(f"Mismatch: user_id={key[0]} category_id={key[1]} {key[2]}-{key[3]:02d} {key[4]}")
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} rollups differ from expenses")
+    click.echo("Rollups match expenses.")
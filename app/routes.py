@@ -0,0 +1,500 @@
+import json
+from datetime import datetime
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, create_access_token
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app.blacklist import revoke_token
+from app.utils import expenses_query, encode_cursor, decode_cursor, serialize_expense, handle_new_expense, verify_user_credentials
+from app.rollups import rollup_summary
+from app.summary import expense_summary, parse_group_by
+from app.imports import parse_csv, parse_ndjson, import_expenses
+from app.exports import EXPORT_FORMATS, EXPORT_WRITERS, export_partitions
+from app.models import User, Expenses, NotificationRule, Budget, db, validate_email, validate_username, validate_password
+from app.rules import build_rule, serialize_rule
+from app.scheduler import job_runs, serialize_job_run
+from app.cache import cached_response, bump_versions
+from app.categories import get_or_create_category_id
+from app.categorizer import assign_categories
+from app.notifications import notifications_query, serialize_notification, unread_count, mark_read
+from app.fx import reporting_currency, check_currency
+from app.search import search_query
+from app.budgets import current_budgets, build_budget, serialize_budget
+
+main = Blueprint('main', __name__)
+
+NDJSON = 'application/x-ndjson'
+IMPORT_PARSERS = {
+    'text/csv': parse_csv,
+    NDJSON: parse_ndjson,
+}
+
+
+def parse_date(value):
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d')
+
+def parse_positive_int(value, name):
+    number = int(value)
+    if number <= 0:
+        raise ValueError(f"{name} must be a positive number")
+    return number
+
+def parse_currency(value, user_id):
+    """A currency argument, or the user's reporting currency (checked when it was set) when there is none."""
+    if not value:
+        return reporting_currency(user_id)
+    currency = str(value).strip().upper()
+    check_currency(currency)
+    return currency
+
+def parse_limit(value):
+    max_limit = current_app.config['EXPENSES_MAX_PAGE_SIZE']
+    if not value:
+        return current_app.config['EXPENSES_PAGE_SIZE']
+    return min(parse_positive_int(value, 'limit'), max_limit)
+
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == NDJSON
+
+
+@main.route('/register', methods=['POST'])
+def register():
+    data = request.get_json(silent=True) or {}
+    username = str(data.get('username') or '').strip()
+    email = str(data.get('email') or '').strip()
+    password = data.get('password')
+    if not username or not email or not password or not isinstance(password, str):
+        return jsonify({"message": "Missing required fields"}), 400
+    try:
+        validate_email(email)
+        if len(email) > 120:
+            raise ValueError("Invalid email format")
+        validate_username(username)
+        if len(username) > 50:
+            raise ValueError("Username is too long")
+        validate_password(password)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # Checked before hashing, a duplicate costs no bcrypt time
+    if User.query.filter(or_(User.email == email, User.user_name == username)).first() is not None:
+        return jsonify({"message": "User already exists"}), 409
+    user = User(user_name=username, email=email)
+    user.set_password(password)
+    db.session.add(user)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "User already exists"}), 409
+    return jsonify({"message": "User registered successfully"}), 201
+
+@main.route('/login', methods=['POST'])
+def login():
+    data = request.get_json(silent=True) or {}
+    email = str(data.get('email') or '').strip()
+    password = data.get('password')
+    if not email or not password or not isinstance(password, str):
+        return jsonify({"message": "Missing required fields"}), 400
+    try:
+        validate_email(email)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if len(email) > 120:
+        return jsonify({"message": "Invalid email format"}), 400
+
+    # Checked before any hashing, so locked accounts and flooding clients cost no bcrypt time
+    limiter = current_app.extensions['login_limiter']
+    blocked = limiter.blocked(email, request.remote_addr)
+    if blocked == 'email':
+        return jsonify({"message": "Account locked after too many failed logins, try again later"}), 423
+    if blocked == 'ip':
+        return jsonify({"message": "Too many failed logins, try again later"}), 429
+
+    user = verify_user_credentials(email, password)
+    if user is None:
+        if limiter.failed(email, request.remote_addr):
+            return jsonify({"message": "Account locked after too many failed logins, try again later"}), 423
+        return jsonify({"message": "Invalid email or password"}), 401
+    limiter.succeeded(email)
+    return jsonify({"access_token": create_access_token(identity=str(user.id))}), 200
+
+@main.route('/admin/login-limits', methods=['GET'])
+@jwt_required()
+def login_limits():
+    user = db.session.get(User, int(get_jwt_identity()))
+    if user is None or not user.is_admin:
+        return jsonify({"message": "Admin access required"}), 403
+    return jsonify({"rejected": dict(current_app.extensions['login_limiter'].rejected)})
+
+@main.route('/admin/job-runs', methods=['GET'])
+@jwt_required()
+def show_job_runs():
+    user = db.session.get(User, int(get_jwt_identity()))
+    if user is None or not user.is_admin:
+        return jsonify({"message": "Admin access required"}), 403
+    try:
+        limit = min(parse_positive_int(request.args.get('limit') or 20, 'limit'), 500)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify([serialize_job_run(run) for run in job_runs(request.args.get('job'), limit)])
+
+@main.route('/add_expense', methods=['POST'])
+@jwt_required()
+def add_expense():
+    data = request.get_json(silent=True) or {}
+    required = ['description_expense', 'date_purchase', 'amount']  # Without type_expense the categorizer picks one
+    if any(data.get(field) in (None, '') for field in required):
+        return jsonify({"message": "Validation failed: missing or incorrect fields"}), 400
+    user_id = int(get_jwt_identity())
+    try:
+        currency = parse_currency(data.get('currency'), user_id)
+        row = {'description': str(data['description_expense']).strip(), 'category_id': None}
+        if data.get('type_expense') not in (None, ''):
+            row['category_id'] = get_or_create_category_id(str(data['type_expense']).strip())
+        assign_categories(user_id, [row])
+        expense = Expenses(
+            currency=currency,  # Set before amount, which is read in this currency's minor units
+            amount=data['amount'],
+            description=row['description'],
+            date=parse_date(data['date_purchase']),
+            user_id=user_id,
+            category_id=row['category_id'],
+        )
+    except (TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({"message": f"Validation failed: {e}"}), 400
+    db.session.add(expense)
+    # Notifications are queued in this transaction and delivered after it commits
+    handle_new_expense(expense)
+    # Read while this transaction's registry sync still holds
+    category = current_app.extensions['category_registry'].names_for([expense.category_id]).get(expense.category_id)
+    db.session.commit()
+    return jsonify({"message": "Expense added successfully", "expense_id": expense.id, "category": category}), 201
+
+@main.route('/mod_expense', methods=['POST'])
+@jwt_required()
+def modify_expense():
+    data = request.get_json(silent=True) or {}
+    failed = jsonify({"message": "Expense not found or validation failed"}), 400
+    try:
+        expense = Expenses.query.filter_by(id=int(data.get('expense_id')), user_id=int(get_jwt_identity())).first()
+    except (TypeError, ValueError):
+        return failed
+    if expense is None:
+        return failed
+    if data.get('Delete'):
+        db.session.delete(expense)
+        db.session.commit()
+        return jsonify({"message": "Expense deleted successfully"}), 200
+    try:
+        if data.get('Type'):
+            expense.category_id = get_or_create_category_id(str(data['Type']).strip())
+        if data.get('Description'):
+            expense.description = str(data['Description']).strip()
+        if data.get('Date'):
+            expense.date = parse_date(data['Date'])
+        if data.get('Currency'):
+            currency = str(data['Currency']).strip().upper()
+            check_currency(currency)
+            # The same amount in the new currency, unless a new amount comes with it
+            amount = data['Amount'] if data.get('Amount') is not None else expense.amount
+            expense.currency = currency
+            expense.amount = amount
+        elif data.get('Amount') is not None:
+            expense.amount = data['Amount']
+    except (TypeError, ValueError):
+        db.session.rollback()
+        return failed
+    db.session.commit()
+    return jsonify({"message": "Expense modified successfully"}), 200
+
+
+@main.route('/expenses', methods=['GET'])
+@jwt_required()
+@cached_response
+def show_expenses():
+    user_id = int(get_jwt_identity())
+    args = request.args
+    sort_by = args.get('sort_by', 'date')
+    order = args.get('order', 'desc')
+    try:
+        query = expenses_query(
+            user_id,
+            category=args.get('category'),
+            start_date=parse_date(args.get('start_date')),
+            end_date=parse_date(args.get('end_date')),
+            sort_by=sort_by,
+            order=order,
+            after=decode_cursor(args.get('cursor'), sort_by, order),
+        )
+        limit = parse_limit(args.get('limit'))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    if wants_ndjson():
+        # Stream everything after the cursor one line at a time, rows are fetched in chunks
+        def generate():
+            for expense in db.session.execute(query.execution_options(yield_per=current_app.config['EXPENSES_PAGE_SIZE'])):
+                yield json.dumps(serialize_expense(expense)) + '\n'
+        return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+    # Fetch one extra row to know whether there is a next page
+    expenses = db.session.execute(query.limit(limit + 1)).all()
+    response = jsonify([serialize_expense(expense) for expense in expenses[:limit]])
+    if len(expenses) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(expenses[limit - 1], sort_by, order)
+    return response
+
+
+@main.route('/expenses/search', methods=['GET'])
+@jwt_required()
+@cached_response
+def search_expenses():
+    user_id = int(get_jwt_identity())
+    args = request.args
+    sort_by = args.get('sort_by', 'rank')
+    order = args.get('order', 'desc')
+    try:
+        query = search_query(
+            user_id,
+            args.get('q'),
+            db.session.get_bind().dialect.name,
+            category=args.get('category'),
+            start_date=parse_date(args.get('start_date')),
+            end_date=parse_date(args.get('end_date')),
+            sort_by=sort_by,
+            order=order,
+            after=decode_cursor(args.get('cursor'), sort_by, order),
+        )
+        limit = parse_limit(args.get('limit'))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    expenses = db.session.execute(query.limit(limit + 1)).all()
+    response = jsonify([serialize_expense(expense) for expense in expenses[:limit]])
+    if sort_by != 'rank' and len(expenses) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(expenses[limit - 1], sort_by, order)
+    return response
+
+
+@main.route('/expenses/summary', methods=['GET'])
+@jwt_required()
+@cached_response
+def show_expense_summary():
+    args = request.args
+    user_id = int(get_jwt_identity())
+    try:
+        summary = expense_summary(
+            user_id,
+            group_by=parse_group_by(args.get('group_by')),
+            currency=parse_currency(args.get('currency'), user_id),
+            category=args.get('category'),
+            start_date=parse_date(args.get('start_date')),
+            end_date=parse_date(args.get('end_date')),
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify(summary)
+
+@main.route('/expenses/rollups', methods=['GET'])
+@jwt_required()
+def show_rollups():
+    try:
+        year = request.args.get('year', type=int)
+        month = request.args.get('month', type=int)
+        if month is not None and not 1 <= month <= 12:
+            raise ValueError("month must be between 1 and 12")
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify(rollup_summary(int(get_jwt_identity()), year=year, month=month, category=request.args.get('category')))
+
+
+@main.route('/expenses/import', methods=['POST'])
+@jwt_required()
+def import_expenses_file():
+    parser = IMPORT_PARSERS.get(request.mimetype)
+    if parser is None:
+        return jsonify({"message": "Content-Type must be text/csv or application/x-ndjson"}), 415
+    try:
+        batch_size = parse_positive_int(request.args.get('batch_size', current_app.config['IMPORT_BATCH_SIZE']), 'batch_size')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # The body is parsed straight off the request stream, never read into memory as a whole
+    report = import_expenses(int(get_jwt_identity()), parser(request.stream),
+                             batch_size=batch_size, max_errors=current_app.config['IMPORT_MAX_ERRORS'])
+    # A file that stops being readable still returns the report, since the rows before that line are imported
+    return jsonify(report), 200 if report['complete'] else 400
+
+
+@main.route('/expenses/export', methods=['GET'])
+@jwt_required()
+def export_expenses():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"message": f"format must be one of {list(EXPORT_FORMATS)}"}), 400
+
+    user_id = int(get_jwt_identity())
+    currency = request.args.get('currency')
+    if currency:
+        currency = currency.strip().upper()
+        try:
+            check_currency(currency)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+    if request.args.get('all') == 'true':
+        # Every user's expenses is for admins only
+        user = db.session.get(User, user_id)
+        if user is None or not user.is_admin:
+            return jsonify({"message": "Only admins can export every user's expenses"}), 403
+        user_id = None
+
+    # Without ?currency= each row is converted into its user's reporting currency
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    chunks = EXPORT_WRITERS[export_format](export_partitions(user_id, current_app.config['EXPORT_CHUNK_SIZE'], currency))
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=expenses.{extension}'
+    return response
+
+
+@main.route('/settings', methods=['GET'])
+@jwt_required()
+def show_settings():
+    return jsonify({"reporting_currency": reporting_currency(int(get_jwt_identity()))})
+
+@main.route('/settings', methods=['POST'])
+@jwt_required()
+def update_settings():
+    data = request.get_json(silent=True) or {}
+    user = db.session.get(User, int(get_jwt_identity()))
+    if user is None:
+        return jsonify({"message": "User not found"}), 401
+    if data.get('reporting_currency'):
+        try:
+            currency = str(data['reporting_currency']).strip().upper()
+            check_currency(currency)
+            user.reporting_currency = currency
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"message": str(e)}), 400
+        # Cached summaries are in the old currency
+        bump_versions(db.session.connection(), [user.id])
+    db.session.commit()
+    return jsonify({"reporting_currency": user.reporting_currency})
+
+
+@main.route('/notifications', methods=['GET'])
+@jwt_required()
+@cached_response
+def show_notifications():
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        after = decode_cursor(request.args.get('cursor'), 'created_at', 'desc')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    # One extra row tells whether there is a next page, as on /expenses
+    query = notifications_query(int(get_jwt_identity()), request.args.get('unread') == 'true', limit + 1, after)
+    notifications = db.session.execute(query).all()
+    response = jsonify([serialize_notification(notification) for notification in notifications[:limit]])
+    if len(notifications) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(notifications[limit - 1], 'created_at', 'desc')
+    return response
+
+@main.route('/notifications/unread_count', methods=['GET'])
+@jwt_required()
+def show_unread_count():
+    return jsonify({"unread": unread_count(int(get_jwt_identity()))})
+
+@main.route('/notifications/mark_read', methods=['POST'])
+@jwt_required()
+def mark_notifications_read():
+    data = request.get_json(silent=True) or {}
+    try:
+        to_id = int(data['to_id'])
+        from_id = int(data.get('from_id') or 1)
+        if from_id > to_id:
+            raise ValueError
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"message": "to_id is required and must not be below from_id"}), 400
+    user_id = int(get_jwt_identity())
+    marked = mark_read(user_id, from_id, to_id)
+    return jsonify({"marked_read": marked, "unread": unread_count(user_id)})
+
+
+@main.route('/rules', methods=['GET'])
+@jwt_required()
+def show_rules():
+    rules = NotificationRule.query.filter_by(user_id=int(get_jwt_identity())).order_by(NotificationRule.id)
+    return jsonify([serialize_rule(rule) for rule in rules])
+
+@main.route('/rules', methods=['POST'])
+@jwt_required()
+def add_rule():
+    try:
+        rule = build_rule(int(get_jwt_identity()), request.get_json(silent=True) or {})
+    except (TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 400
+    db.session.add(rule)
+    db.session.commit()
+    return jsonify(serialize_rule(rule)), 201
+
+@main.route('/rules/<int:rule_id>', methods=['DELETE'])
+@jwt_required()
+def delete_rule(rule_id):
+    rule = NotificationRule.query.filter_by(id=rule_id, user_id=int(get_jwt_identity())).first()
+    if rule is None:
+        return jsonify({"message": "Rule not found"}), 404
+    db.session.delete(rule)
+    db.session.commit()
+    return '', 204
+
+
+@main.route('/budgets', methods=['GET'])
+@jwt_required()
+def show_budgets():
+    user_id = int(get_jwt_identity())
+    budgets = current_budgets(user_id)
+    names = current_app.extensions['category_registry'].names_for({budget['category_id'] for budget in budgets})
+    # Budgets whose period had ended were rolled over by this read
+    db.session.commit()
+    return jsonify([serialize_budget(budget, names) for budget in budgets])
+
+@main.route('/budgets', methods=['POST'])
+@jwt_required()
+def set_budget():
+    data = request.get_json(silent=True) or {}
+    user_id = int(get_jwt_identity())
+    try:
+        budget = build_budget(user_id, data, parse_currency(data.get('currency'), user_id))
+        created = budget.id is None
+        db.session.flush()
+    except (TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 400
+    stored = next(row for row in current_budgets(user_id) if row['id'] == budget.id)
+    names = current_app.extensions['category_registry'].names_for([stored['category_id']])
+    db.session.commit()
+    return jsonify(serialize_budget(stored, names)), 201 if created else 200
+
+@main.route('/budgets/<int:budget_id>', methods=['DELETE'])
+@jwt_required()
+def delete_budget(budget_id):
+    budget = Budget.query.filter_by(id=budget_id, user_id=int(get_jwt_identity())).first()
+    if budget is None:
+        return jsonify({"message": "Budget not found"}), 404
+    db.session.delete(budget)
+    db.session.commit()
+    return '', 204
+
+
+@main.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    revoke_token(get_jwt())
+    return jsonify({"message": "Successfully logged out"}), 200
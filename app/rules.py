@@ -0,0 +1,284 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import event, select, func, case, cast, tuple_, and_, or_, Float
+from sqlalchemy.orm import Session
+from app import db
+from app.models import NotificationRule, ExpenseRollup, Expenses
+from app.money import DEFAULT_CURRENCY, to_minor, format_minor
+from app.fx import convert_minor
+from app.notifications import queue_notifications
+
+# Below this many expenses a user's history says nothing about what is unusual
+ANOMALY_MIN_HISTORY = 10
+# Rule amounts are in this currency; expenses are converted into it on the day they happened and totals
+# over many days at the rate of the newest expense they are checked for
+RULE_CURRENCY = DEFAULT_CURRENCY
+
+
+class CompiledRules:
+    """One user's rules folded into the few numbers the batch evaluator needs, amounts in minor units."""
+
+    def __init__(self, rules, default_threshold):
+        thresholds = [rule.amount_minor for rule in rules if rule.kind == 'threshold']
+        self.threshold = min(thresholds) if thresholds else default_threshold
+        self.category_budgets = {rule.category_id: rule.amount_minor for rule in rules if rule.kind == 'category_budget'}
+        self.windows = sorted((rule.window_days, rule.amount_minor) for rule in rules if rule.kind == 'rolling_limit')
+        factors = [rule.factor for rule in rules if rule.kind == 'anomaly']
+        self.anomaly_factor = min(factors) if factors else None
+
+
+class RuleCache:
+    """Compiled rules per user id, dropped after ttl seconds or when the user's rules change."""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, user_ids, default_threshold):
+        now = time.monotonic()
+        compiled = {}
+        missing = []
+        for user_id in user_ids:
+            entry = self.entries.get(user_id)
+            if entry and entry[0] > now:
+                compiled[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+        if missing:
+            # One query for every user not cached yet
+            rules = defaultdict(list)
+            for rule in NotificationRule.query.filter(NotificationRule.user_id.in_(missing)):
+                rules[rule.user_id].append(rule)
+            with self.lock:
+                for user_id in missing:
+                    compiled[user_id] = CompiledRules(rules[user_id], default_threshold)
+                    self.entries[user_id] = (now + self.ttl, compiled[user_id])
+        return compiled
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+def create_rule_cache(app):
+    cache = RuleCache(ttl=app.config.get('RULE_CACHE_SECONDS', 60))
+    app.extensions['rule_cache'] = cache
+    return cache
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_changed_rules(session, flush_context):
+    changed = [rule for rule in (*session.new, *session.dirty, *session.deleted) if isinstance(rule, NotificationRule)]
+    if changed:
+        cache = current_app.extensions['rule_cache']
+        for rule in changed:
+            cache.invalidate(rule.user_id)
+
+
+def build_rule(user_id, data):
+    """Create a NotificationRule from request data, checking each kind has what it needs."""
+    from app.categories import get_or_create_category_id  # Import inside the function to avoid circular imports
+    kind = data.get('kind')
+    rule = NotificationRule(user_id=user_id, kind=kind)
+    if kind in ('threshold', 'category_budget', 'rolling_limit'):
+        if data.get('amount') is None:
+            raise ValueError(f"A {kind} rule needs an amount")
+        rule.amount = data['amount']
+    if kind == 'category_budget':
+        if not data.get('category'):
+            raise ValueError("A category_budget rule needs a category")
+        rule.category_id = get_or_create_category_id(str(data['category']).strip())
+    if kind == 'rolling_limit':
+        window_days = int(data.get('window_days') or 0)
+        if not 1 <= window_days <= 365:
+            raise ValueError("window_days must be between 1 and 365")
+        rule.window_days = window_days
+    if kind == 'anomaly':
+        factor = float(data.get('factor') or 0)
+        if factor <= 0:
+            raise ValueError("An anomaly rule needs a positive factor")
+        rule.factor = factor
+    return rule
+
+def serialize_rule(rule):
+    return {
+        'rule_id': rule.id,
+        'kind': rule.kind,
+        'amount': rule.amount,
+        'category': rule.category.name if rule.category_id else None,
+        'window_days': rule.window_days,
+        'factor': rule.factor,
+    }
+
+
+def format_date(date):
+    return date.strftime('%Y-%m-%d')
+
+def category_names(category_ids):
+    return current_app.extensions['category_registry'].names_for(category_ids)
+
+def rule_factors(days_and_currencies):
+    """Factors into RULE_CURRENCY for a set of (day, currency), in one converter batch."""
+    return current_app.extensions['fx_converter'].factors({(day, currency, RULE_CURRENCY) for day, currency in days_and_currencies})
+
+def converted_total(totals, day, factors):
+    """Per-currency totals (currency -> minor units) added up in RULE_CURRENCY at the rate of day."""
+    return sum(convert_minor(total, factors[(day, currency, RULE_CURRENCY)]) for currency, total in totals.items())
+
+def check_category_budgets(by_user, compiled, names):
+    """Notify when this batch pushes a month's spend in a category over the user's budget."""
+    added = defaultdict(int)
+    latest = {}
+    for user_id, rows in by_user.items():
+        budgets = compiled[user_id].category_budgets
+        for row in rows:
+            if row['category_id'] in budgets:
+                bucket = (user_id, row['category_id'], row['date'].year, row['date'].month)
+                added[bucket] += row['amount_minor']
+                latest[bucket] = max(latest.get(bucket, row['date']), row['date'])
+    if not added:
+        return []
+    # The batch is already flushed, so the rollups include it; they hold one row per currency
+    key = tuple_(ExpenseRollup.user_id, ExpenseRollup.category_id, ExpenseRollup.year, ExpenseRollup.month)
+    by_currency = defaultdict(dict)
+    for user_id, category_id, year, month, currency, total in db.session.execute(
+        select(ExpenseRollup.user_id, ExpenseRollup.category_id, ExpenseRollup.year, ExpenseRollup.month,
+               ExpenseRollup.currency, ExpenseRollup.total_minor)
+        .where(key.in_(list(added)))
+    ):
+        by_currency[(user_id, category_id, year, month)][currency] = total
+    factors = rule_factors({(latest[bucket].date(), currency) for bucket, totals in by_currency.items() for currency in totals})
+    notifications = []
+    for (user_id, category_id, year, month), totals in by_currency.items():
+        total = converted_total(totals, latest[(user_id, category_id, year, month)].date(), factors)
+        budget = compiled[user_id].category_budgets[category_id]
+        if total > budget >= total - added[(user_id, category_id, year, month)]:
+            notifications.append({
+                'user_id': user_id,
+                'type': 'category_budget',
+                'message': f'Monthly budget for {names.get(category_id)} exceeded: '
+                           f'{format_minor(total, RULE_CURRENCY)} of {format_minor(budget, RULE_CURRENCY)} {RULE_CURRENCY} in {year}-{month:02d}',
+            })
+    return notifications
+
+def check_rolling_limits(by_user, compiled):
+    """Notify when this batch pushes spend over a user's last-N-days limit."""
+    windows = {user_id: compiled[user_id].windows for user_id in by_user if compiled[user_id].windows}
+    if not windows:
+        return []
+    latest = {user_id: max(row['date'] for row in by_user[user_id]) for user_id in windows}
+    starts = {user_id: [latest[user_id] - timedelta(days=days) for days, limit in windows[user_id]] for user_id in windows}
+    # Every user's windows in one pass over their (user_id, date) index ranges, a row per user and currency.
+    # Window i is summed in column i, each user with its own start; users with fewer windows leave it at 0
+    columns = [
+        func.coalesce(func.sum(case(*[
+            (and_(Expenses.user_id == user_id, Expenses.date > user_starts[i]), Expenses.amount_minor)
+            for user_id, user_starts in starts.items() if i < len(user_starts)
+        ], else_=0)), 0)
+        for i in range(max(len(user_starts) for user_starts in starts.values()))
+    ]
+    by_currency = defaultdict(list)
+    for user_id, currency, *sums in db.session.execute(
+        select(Expenses.user_id, Expenses.currency, *columns)
+        .where(or_(*[
+            and_(Expenses.user_id == user_id, Expenses.date > min(user_starts), Expenses.date <= latest[user_id])
+            for user_id, user_starts in starts.items()
+        ]))
+        .group_by(Expenses.user_id, Expenses.currency)
+    ):
+        by_currency[user_id].append((currency, sums))
+    factors = rule_factors({(latest[user_id].date(), currency) for user_id, rows in by_currency.items() for currency, sums in rows})
+    notifications = []
+    for user_id, user_starts in starts.items():
+        day = latest[user_id].date()
+        for i, ((days, limit), start) in enumerate(zip(windows[user_id], user_starts)):
+            total = converted_total({currency: sums[i] for currency, sums in by_currency[user_id]}, day, factors)
+            added = sum(row['amount_minor'] for row in by_user[user_id] if start < row['date'] <= latest[user_id])
+            if total > limit >= total - added:
+                notifications.append({
+                    'user_id': user_id,
+                    'type': 'rolling_limit',
+                    'message': f'Spending limit exceeded: {format_minor(total, RULE_CURRENCY)} {RULE_CURRENCY} in the last {days} days '
+                               f'(limit {format_minor(limit, RULE_CURRENCY)} {RULE_CURRENCY})',
+                })
+    return notifications
+
+def check_anomalies(by_user, compiled):
+    """Notify about expenses far above the user's own mean, in standard deviations."""
+    user_ids = [user_id for user_id in by_user if compiled[user_id].anomaly_factor is not None]
+    if not user_ids:
+        return []
+    # Squares of minor units can overflow a 64-bit integer sum; the statistics don't need to be exact
+    amount = cast(Expenses.amount_minor, Float)
+    latest = {user_id: max(row['date'] for row in by_user[user_id]).date() for user_id in user_ids}
+    by_currency = db.session.execute(
+        select(Expenses.user_id, Expenses.currency, func.count(), func.sum(amount), func.sum(amount * amount))
+        .where(Expenses.user_id.in_(user_ids)).group_by(Expenses.user_id, Expenses.currency)
+    ).all()
+    factors = rule_factors({(latest[user_id], currency) for user_id, currency, *sums in by_currency})
+    stats = defaultdict(lambda: [0, 0.0, 0.0])
+    for user_id, currency, count, total, total_square in by_currency:
+        factor = factors[(latest[user_id], currency, RULE_CURRENCY)]
+        stats[user_id][0] += count
+        stats[user_id][1] += total * factor
+        stats[user_id][2] += total_square * factor * factor
+    notifications = []
+    for user_id, (count, total, total_square) in stats.items():
+        # The batch is already flushed; take it back out so it isn't part of its own baseline
+        amounts = [row['amount_minor'] for row in by_user[user_id]]
+        count -= len(amounts)
+        if count < ANOMALY_MIN_HISTORY:
+            continue
+        mean = (total - sum(amounts)) / count
+        mean_square = (total_square - sum(amount * amount for amount in amounts)) / count
+        std = math.sqrt(max(mean_square - mean * mean, 0))
+        limit = mean + compiled[user_id].anomaly_factor * std
+        for row in by_user[user_id]:
+            if row['amount_minor'] > limit:
+                notifications.append({
+                    'user_id': user_id,
+                    'type': 'anomaly',
+                    'message': f'Unusual expense: {format_minor(row["amount_minor"], RULE_CURRENCY)} {RULE_CURRENCY} on {format_date(row["date"])} '
+                               f'is well above your usual {format_minor(round(mean), RULE_CURRENCY)} {RULE_CURRENCY}',
+                })
+    return notifications
+
+def evaluate_new_expenses(rows):
+    """
+    Run every user's rules over a batch of just-inserted expenses and queue the notifications.
+
+    rows are dicts with user_id, category_id, date, currency and amount_minor,
+    already flushed to the database. The work per batch is a fixed handful
+    of queries, not one per expense or per user.
+    """
+    if not rows:
+        return []
+    factors = rule_factors({(row['date'].date(), row['currency']) for row in rows})
+    by_user = defaultdict(list)
+    for row in rows:
+        # From here on amount_minor is in RULE_CURRENCY, like the rules
+        factor = factors[(row['date'].date(), row['currency'], RULE_CURRENCY)]
+        by_user[row['user_id']].append({**row, 'amount_minor': convert_minor(row['amount_minor'], factor)})
+    compiled = current_app.extensions['rule_cache'].get_many(list(by_user), to_minor(current_app.config['LARGE_EXPENSE_THRESHOLD']))
+    names = category_names({row['category_id'] for row in rows})
+
+    notifications = []
+    for user_id, user_rows in by_user.items():
+        threshold = compiled[user_id].threshold
+        for row in user_rows:
+            if row['amount_minor'] >= threshold:
+                notifications.append({
+                    'user_id': user_id,
+                    'type': 'large_expense',
+                    'message': f'Large expense recorded: {format_minor(row["amount_minor"], RULE_CURRENCY)} {RULE_CURRENCY} ({names.get(row["category_id"])}) '
+                               f'on {format_date(row["date"])}',
+                })
+    notifications += check_category_budgets(by_user, compiled, names)
+    notifications += check_rolling_limits(by_user, compiled)
+    notifications += check_anomalies(by_user, compiled)
+    queue_notifications(notifications)
+    return notifications
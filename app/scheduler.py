@@ -0,0 +1,269 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import update, insert, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import SchedulerLease, ScheduledJob, JobRun
+
+LEASE_NAME = 'scheduler'
+
+
+def recurring_expenses_job():
+    from app.recurring import generate_recurring_expenses  # Import inside the function to avoid circular imports
+    return generate_recurring_expenses()
+
+def prune_revoked_tokens_job():
+    return current_app.extensions['revocation_store'].prune()
+
+def prune_login_attempts_job():
+    return current_app.extensions['login_limiter'].store.prune()
+
+def prune_read_notifications_job():
+    from app.notifications import prune_read_notifications  # Import inside the function to avoid circular imports
+    return prune_read_notifications(
+        retention_days=current_app.config.get('NOTIFICATION_RETENTION_DAYS', 90),
+        batch_size=current_app.config.get('NOTIFICATION_PRUNE_BATCH_SIZE', 1000),
+    )
+
+# name -> (function run inside an app context that returns a row count, interval in seconds)
+JOBS = {
+    'recurring_expenses': (recurring_expenses_job, 24 * 3600),
+    'prune_revoked_tokens': (prune_revoked_tokens_job, 3600),
+    'prune_login_attempts': (prune_login_attempts_job, 3600),
+    'prune_read_notifications': (prune_read_notifications_job, 24 * 3600),
+}
+
+
+class SchedulerRunner:
+    """
+    Runs JOBS in one process of the whole deployment at a time.
+
+    Every runner tries to take or renew the lease row in scheduler_lease and
+    only the holder runs due jobs. Next run times are kept in scheduled_job, so
+    a restart or a new leader carries on from where the last one stopped, and
+    each run is recorded in job_run. A leader that dies stops renewing and
+    another runner takes over once its lease has expired.
+    """
+
+    def __init__(self, app, lease_seconds=120, poll_seconds=30, jobs=None):
+        self.app = app
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.jobs = jobs or JOBS
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def acquire(self, now=None):
+        """Take the lease if it is free or expired, or extend it if we hold it. Returns True while we hold it."""
+        now = now or datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        leases = SchedulerLease.__table__
+        result = db.session.execute(
+            update(leases)
+            .where(leases.c.name == LEASE_NAME, or_(leases.c.owner == self.owner, leases.c.expires_at < now))
+            .values(owner=self.owner, expires_at=expires_at)
+        )
+        if result.rowcount == 0:
+            # Either nobody has ever held it or someone else holds it now
+            try:
+                db.session.execute(insert(leases).values(name=LEASE_NAME, owner=self.owner, expires_at=expires_at))
+            except IntegrityError:
+                db.session.rollback()
+                return False
+        db.session.commit()
+        return True
+
+    def release(self):
+        leases = SchedulerLease.__table__
+        db.session.execute(
+            update(leases).where(leases.c.name == LEASE_NAME, leases.c.owner == self.owner)
+            .values(expires_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    def ensure_jobs(self, now):
+        stored = {job.name: job for job in ScheduledJob.query.filter(ScheduledJob.name.in_(self.jobs))}
+        for name, (function, interval) in self.jobs.items():
+            if name not in stored:
+                db.session.add(ScheduledJob(name=name, interval_seconds=interval, next_run_at=now))
+            elif stored[name].interval_seconds != interval:
+                stored[name].interval_seconds = interval
+        db.session.commit()
+
+    def heartbeat(self, done, lost):
+        """
+        Keep the lease while a long job runs, from its own app context and session.
+
+        A failed renewal, such as "database is locked", is logged and retried on
+        the next beat. Once another runner holds the lease, or a whole lease
+        period passes without a renewal, lost is set and the heartbeat stops.
+        """
+        renewed = time.monotonic()
+        while not done.wait(self.lease_seconds / 3):
+            attempted = time.monotonic()
+            # Past this point the lease may have expired and been taken, even if renewing works again
+            if attempted - renewed >= self.lease_seconds:
+                lost.set()
+            else:
+                with self.app.app_context():
+                    try:
+                        if self.acquire():
+                            renewed = attempted
+                        else:
+                            lost.set()
+                    except Exception:
+                        db.session.rollback()
+                        self.app.logger.exception("Renewing the scheduler lease failed, retrying")
+                    finally:
+                        db.session.remove()
+            if lost.is_set():
+                self.app.logger.error("Scheduler %s lost its lease while a job was running", self.owner)
+                return
+
+    def run_job(self, job):
+        """
+        Run one job and record it in job_run.
+
+        A job that finishes after the heartbeat lost the lease is recorded as
+        failed and not rescheduled, since another runner may be running it
+        already; whoever holds the lease now decides when it runs next.
+        """
+        name = job.name
+        started_at = datetime.utcnow()
+        run = JobRun(job_name=name, owner=self.owner, started_at=started_at, status='running')
+        db.session.add(run)
+        db.session.commit()
+        run_id = run.id
+
+        done, lost = threading.Event(), threading.Event()
+        threading.Thread(target=self.heartbeat, args=(done, lost), name='scheduler-heartbeat', daemon=True).start()
+        clock = time.perf_counter()
+        try:
+            rows, status, error = self.jobs[name][0](), 'succeeded', None
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.exception("Scheduled job %s failed", name)
+            rows, status, error = None, 'failed', str(e)[:255]
+        finally:
+            done.set()
+        duration = time.perf_counter() - clock
+        if lost.is_set() and status == 'succeeded':
+            status, error = 'failed', "Lost the scheduler lease while running"
+
+        run = db.session.get(JobRun, run_id)
+        run.duration, run.rows, run.status, run.error = duration, rows, status, error
+        if not lost.is_set():
+            job = db.session.get(ScheduledJob, name)
+            job.last_run_at = started_at
+            job.next_run_at = started_at + timedelta(seconds=job.interval_seconds)
+        db.session.commit()
+        self.app.logger.info("Scheduled job %s %s: %s rows in %.2fs", name, status, rows, duration)
+        return run
+
+    def run_pending(self):
+        """Run every due job if this runner is the leader. Returns the JobRun rows written."""
+        if not self.acquire():
+            return []
+        now = datetime.utcnow()
+        self.ensure_jobs(now)
+        due = ScheduledJob.query.filter(ScheduledJob.name.in_(self.jobs), ScheduledJob.next_run_at <= now) \
+            .order_by(ScheduledJob.next_run_at).all()
+        runs = []
+        for job in due:
+            # Earlier jobs may have taken long enough for the lease to need renewing
+            if not self.acquire():
+                break
+            runs.append(self.run_job(job))
+        return runs
+
+    def run_forever(self):
+        while not self.stopping.wait(self.poll_seconds):
+            with self.app.app_context():
+                try:
+                    self.run_pending()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Scheduler pass failed")
+                finally:
+                    db.session.remove()
+        with self.app.app_context():
+            self.release()
+            db.session.remove()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run_forever, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+
+
+def create_scheduler(app):
+    runner = SchedulerRunner(
+        app,
+        lease_seconds=app.config.get('SCHEDULER_LEASE_SECONDS', 120),
+        poll_seconds=app.config.get('SCHEDULER_POLL_SECONDS', 30),
+    )
+    app.extensions['scheduler'] = runner
+    if app.config.get('SCHEDULER_THREAD', False):
+        runner.start()
+    return runner
+
+def serialize_job_run(run):
+    return {
+        'id': run.id,
+        'job': run.job_name,
+        'owner': run.owner,
+        'started_at': run.started_at.isoformat(),
+        'duration': run.duration,
+        'rows': run.rows,
+        'status': run.status,
+        'error': run.error,
+    }
+
+def job_runs(job_name=None, limit=20):
+    query = JobRun.query
+    if job_name:
+        query = query.filter_by(job_name=job_name)
+    return query.order_by(JobRun.started_at.desc(), JobRun.id.desc()).limit(limit).all()
+
+
+scheduler_cli = AppGroup('scheduler', help='Scheduled job commands.')
+
+@scheduler_cli.command('run')
+def run_command():
+    """Run the scheduler in the foreground until interrupted."""
+    runner = current_app.extensions['scheduler']
+    if runner.thread:
+        raise click.ClickException("This app already runs the scheduler in a thread, set SCHEDULER_THREAD = False")
+    click.echo(f"Scheduler {runner.owner} polling every {runner.poll_seconds}s")
+    try:
+        runner.run_forever()
+    except KeyboardInterrupt:
+        runner.release()
+
+@scheduler_cli.command('run-once')
+def run_once_command():
+    """Run the due jobs once, if no other runner holds the lease (for cron)."""
+    runs = current_app.extensions['scheduler'].run_pending()
+    for run in runs:
+        click.echo(f"{run.job_name}: {run.status}, {run.rows} rows in {run.duration:.2f}s")
+
+@scheduler_cli.command('history')
+@click.option('--job', 'job_name', type=click.Choice(list(JOBS)), default=None)
+@click.option('--limit', type=int, default=20)
+def history_command(job_name, limit):
+    """Show recent job runs, newest first."""
+    for run in job_runs(job_name, limit):
+        duration = f"{run.duration:.2f}s" if run.duration is not None else '-'
+        click.echo(f"{run.started_at:%Y-%m-%d %H:%M:%S}  {run.job_name:<22} {run.status:<10} {duration:>9} {run.rows if run.rows is not None else '-':>8}  {run.owner}")
@@ -0,0 +1,142 @@
+import re
+import click
+from flask.cli import AppGroup
+from sqlalchemy import DDL, event, select, func, table, column, literal_column, text, Integer
+from app import db
+from app.models import Expenses
+from app.utils import expenses_query, SORT_FIELDS
+
+SEARCH_TABLE = 'expense_search'
+SEARCH_SORT_FIELDS = ['rank'] + SORT_FIELDS
+# A quoted phrase, or a word with an optional trailing * for a prefix
+TERM = re.compile(r'"([^"]*)"?|(\S+)')
+# Words are split the way the unicode61 tokenizer does, on anything that is not a letter or digit
+TOKEN = re.compile(r'[^\W_]+')
+
+# External content table: the index holds only the tokens, descriptions are read from expenses by rowid.
+# user_id is indexed too, so one MATCH finds a user's matches without touching anyone else's rows.
+# The triggers keep it in step with every write, ORM or Core, in the writer's own transaction.
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    f"description, user_id, content='expenses', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON expenses BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, description, user_id) VALUES (new.id, new.description, new.user_id); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON expenses BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, description, user_id) "
+    f"VALUES ('delete', old.id, old.description, old.user_id); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF description, user_id ON expenses BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, description, user_id) "
+    f"VALUES ('delete', old.id, old.description, old.user_id); "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, description, user_id) VALUES (new.id, new.description, new.user_id); END",
+]
+# PostgreSQL searches a GIN index on the same expression tsquery_match uses
+POSTGRESQL_VECTOR = "to_tsvector('simple'::regconfig, description)"
+POSTGRESQL_DDL = [f"CREATE INDEX IF NOT EXISTS ix_expenses_description_search ON expenses USING gin ({POSTGRESQL_VECTOR})"]
+
+for statement in SQLITE_DDL:
+    event.listen(Expenses.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Expenses.__table__, 'before_drop', DDL(f'DROP TABLE IF EXISTS {SEARCH_TABLE}').execute_if(dialect='sqlite'))
+for statement in POSTGRESQL_DDL:
+    event.listen(Expenses.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+search_table = table(SEARCH_TABLE, column('rowid', Integer), column(SEARCH_TABLE))
+
+
+def parse_search(q):
+    """
+    The terms of a search string as (tokens, prefix) pairs, all of which must match.
+
+    uber matches the word uber, ub* any word starting with ub, and
+    "coffee shop" the two words next to each other. Case, accents and
+    punctuation are ignored like the index ignores them, so no input can
+    make an invalid full-text query.
+    """
+    terms = []
+    for phrase, word in TERM.findall(q or ''):
+        tokens = TOKEN.findall(phrase or word)
+        if tokens:
+            terms.append((tokens, bool(word) and word.endswith('*')))
+    if not terms:
+        raise ValueError("q must contain a word to search for")
+    return terms
+
+def fts5_query(terms, user_id=None):
+    """terms as an FTS5 query on descriptions, of user_id's expenses only when given."""
+    words = ' '.join('"' + ' '.join(tokens) + '"' + ('*' if prefix else '') for tokens, prefix in terms)
+    query = f'description : ({words})'
+    if user_id is None:
+        return query
+    return f'user_id : "{int(user_id)}" AND {query}'
+
+def tsquery(terms):
+    return ' & '.join(
+        ' <-> '.join(token.lower() for token in tokens) + (':*' if prefix else '') for tokens, prefix in terms
+    )
+
+def fts5_match(terms, user_id=None):
+    return search_table.c[SEARCH_TABLE].op('MATCH')(fts5_query(terms, user_id))
+
+def tsquery_match(terms):
+    """The PostgreSQL condition matching terms and the expression to order by, best match first."""
+    query = func.to_tsquery(literal_column("'simple'::regconfig"), tsquery(terms))
+    vector = literal_column(POSTGRESQL_VECTOR.replace('description', 'expenses.description'))
+    return vector.op('@@')(query), -func.ts_rank(vector, query)
+
+def search_query(user_id, q, dialect_name, category=None, start_date=None, end_date=None, sort_by='rank', order='desc',
+                 after=None, category_id_for=None):
+    """
+    expenses_query restricted to the expenses whose description matches q, see parse_search.
+
+    With sort_by='rank' the best matches come first and there is no cursor;
+    sorting by date or amount pages through every match like /expenses.
+    Either way the index is asked for the user's matches once; the filters
+    and the sort apply to those rows only, so nothing else is read.
+    """
+    if sort_by not in SEARCH_SORT_FIELDS:
+        raise ValueError(f"sort_by must be one of {SEARCH_SORT_FIELDS}.")
+    terms = parse_search(q)
+    if sort_by != 'rank':
+        query = expenses_query(user_id, category, start_date, end_date, sort_by, order, after, category_id_for)
+        if dialect_name == 'postgresql':
+            return query.where(tsquery_match(terms)[0])
+        # The matches are listed once, then the sort column's index is walked against them up to the page size.
+        # As a join, SQLite would run the MATCH again for every row of that index instead.
+        return query.where(Expenses.id.in_(select(search_table.c.rowid).where(fts5_match(terms, user_id))))
+    if after is not None:
+        raise ValueError("Results sorted by rank have no next page, sort by date or amount to page through them")
+    query = expenses_query(user_id, category, start_date, end_date, category_id_for=category_id_for).order_by(None)
+    if dialect_name == 'postgresql':
+        condition, rank = tsquery_match(terms)
+        return query.where(condition).order_by(rank, Expenses.id.desc())
+    # bm25() with no weight on the user_id column, lower is better
+    rank = func.bm25(literal_column(SEARCH_TABLE), 1.0, 0.0)
+    query = query.join(search_table, search_table.c.rowid == Expenses.id).where(fts5_match(terms, user_id))
+    return query.order_by(rank, Expenses.id.desc())
+
+def insert_expenses(rows):
+    """
+    Insert expense dicts with multi-row INSERT statements rather than an executemany.
+
+    FTS5 writes what a statement added to the index when the statement ends,
+    so an executemany through the insert trigger writes one small segment per
+    row. With RETURNING, SQLAlchemy sends the rows as INSERTs of up to 1000
+    rows each (its insertmanyvalues mode) from one compiled statement.
+    """
+    if rows:
+        expenses = Expenses.__table__
+        db.session.execute(expenses.insert().returning(expenses.c.id), rows)
+
+def rebuild_search_index():
+    """Re-read every description into the index, for databases written to without the triggers."""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        db.session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+        db.session.commit()
+
+
+search_cli = AppGroup('search', help='Maintain the expense search index.')
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Rebuild the full-text index of expense descriptions."""
+    rebuild_search_index()
+    click.echo("Search index rebuilt.")
@@ -0,0 +1,126 @@
+from datetime import date
+from flask import current_app
+from sqlalchemy import select, func, case, and_
+from app import db
+from app.models import Expenses, Category
+from app.money import DEFAULT_CURRENCY, from_minor, average_minor
+from app.fx import factors_table, converted_minor
+from app.utils import expense_filters
+
+PERIODS = ['day', 'week', 'month', 'year']
+GROUPS = ['category'] + PERIODS
+PERCENTILES = {'p50': 0.5, 'p90': 0.9}
+
+
+def period_label(period, dialect_name):
+    """SQL expression naming the bucket an expense's date falls in; weeks are named by their Monday."""
+    date = Expenses.date
+    if dialect_name == 'postgresql':
+        formats = {'day': 'YYYY-MM-DD', 'month': 'YYYY-MM', 'year': 'YYYY'}
+        if period == 'week':
+            return func.to_char(func.date_trunc('week', date), 'YYYY-MM-DD')
+        return func.to_char(date, formats[period])
+    formats = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+    if period == 'week':
+        # 'weekday 0' moves to the next Sunday (or stays on one), six days back is that week's Monday
+        return func.date(date, 'weekday 0', '-6 days')
+    return func.strftime(formats[period], date)
+
+def parse_group_by(value):
+    """'category', a period, or 'category,<period>'."""
+    keys = [key.strip() for key in (value or 'category').split(',') if key.strip()]
+    unknown = [key for key in keys if key not in GROUPS]
+    if unknown or not keys:
+        raise ValueError(f"group_by must be made of {GROUPS}.")
+    periods = [key for key in keys if key in PERIODS]
+    if len(periods) > 1 or len(set(keys)) != len(keys):
+        raise ValueError("group_by takes at most one period and each key once.")
+    return keys
+
+def conversion_query(user_id, currency, dialect_name, category=None, start_date=None, end_date=None, category_id_for=None):
+    """The distinct (day, currency) of the filtered expenses that are not in currency, to look their factors up with."""
+    return select(period_label('day', dialect_name), Expenses.currency).where(
+        *expense_filters(user_id, category, start_date, end_date, category_id_for),
+        Expenses.currency != currency,
+    ).distinct()
+
+def conversion_keys(rows, currency):
+    """FxConverter keys of the rows of conversion_query."""
+    return {(date.fromisoformat(day), source, currency) for day, source in rows}
+
+def summary_query(user_id, group_by, dialect_name, category=None, start_date=None, end_date=None, category_id_for=None,
+                  factors=None):
+    """
+    The one statement behind expense_summary: totals, counts, averages and percentiles per group.
+
+    Percentiles are nearest-rank: each row is numbered within its group by
+    amount, and pN is the smallest amount whose rank reaches N% of the group.
+    Every amount is in integer minor units, so the totals are exact.
+
+    factors are FxConverter factors into one currency for the (day, currency)
+    of every expense not in it already. They are joined in as a VALUES table
+    and each row converted to whole minor units before ranking and summing,
+    as convert_minor would.
+    """
+    keys = []
+    if 'category' in group_by:
+        keys.append(Category.name.label('category'))
+    period = next((key for key in group_by if key in PERIODS), None)
+    if period:
+        keys.append(period_label(period, dialect_name).label('period'))
+
+    amount = Expenses.amount_minor
+    if factors:
+        table = factors_table(factors)
+        # Rows already in the currency have no factor and are taken as they are
+        amount = case((table.c.factor.is_(None), amount), else_=converted_minor(amount, table.c.factor, dialect_name))
+
+    ranked = select(
+        *keys,
+        amount.label('amount_minor'),
+        func.row_number().over(partition_by=keys, order_by=amount).label('rank'),
+        func.count().over(partition_by=keys).label('size'),
+    ).select_from(Expenses).join(Category, Category.id == Expenses.category_id)
+    if factors:
+        ranked = ranked.outerjoin(table, and_(table.c.day == period_label('day', dialect_name), table.c.currency == Expenses.currency))
+    ranked = ranked.where(*expense_filters(user_id, category, start_date, end_date, category_id_for)).subquery()
+    group_columns = [ranked.c[key.name] for key in keys]
+    return select(
+        *group_columns,
+        func.sum(ranked.c.amount_minor).label('total'),
+        func.count().label('count'),
+        *[func.min(case((ranked.c.rank >= fraction * ranked.c.size, ranked.c.amount_minor))).label(name)
+          for name, fraction in PERCENTILES.items()],
+    ).group_by(*group_columns).order_by(*group_columns)
+
+def summarize(rows, group_by, currency=DEFAULT_CURRENCY):
+    """Shape the mapping rows of summary_query into the /expenses/summary response, converting minor units once per group."""
+    names = (['category'] if 'category' in group_by else []) + (['period'] if any(key in PERIODS for key in group_by) else [])
+    groups = [{
+        **{name: row[name] for name in names},
+        'total': from_minor(row['total'], currency),
+        'count': row['count'],
+        'average': from_minor(average_minor(row['total'], row['count']), currency),
+        **{name: from_minor(row[name], currency) for name in PERCENTILES},
+    } for row in rows]
+    return {
+        'group_by': group_by,
+        'currency': currency,
+        'total': from_minor(sum(row['total'] for row in rows), currency),
+        'count': sum(row['count'] for row in rows),
+        'groups': groups,
+    }
+
+def expense_summary(user_id, group_by, currency, category=None, start_date=None, end_date=None):
+    """
+    Totals, counts, averages and percentiles of a user's expenses in currency, grouped in SQL in one statement.
+
+    One query finds the days and currencies that need converting and the
+    converter resolves all their factors at once before the summary runs.
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    filters = (category, start_date, end_date)
+    rows = db.session.execute(conversion_query(user_id, currency, dialect_name, *filters)).all()
+    factors = current_app.extensions['fx_converter'].factors(conversion_keys(rows, currency)) if rows else None
+    query = summary_query(user_id, group_by, dialect_name, *filters, factors=factors)
+    return summarize(db.session.execute(query).mappings().all(), group_by, currency)
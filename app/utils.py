@@ -1,52 +1,135 @@
-from werkzeug.security import check_password_hash
-from flask import current_app as app  # Ensure you're in the app context
+import base64
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from app.money import from_minor
+
+SORT_FIELDS = ['date', 'amount']
+# sort_by -> the column behind it, amounts are ordered by their exact minor units
+SORT_COLUMNS = {'date': 'date', 'amount': 'amount_minor'}
+SORT_ORDERS = ['asc', 'desc']
 
 def verify_user_credentials(email, password):
-    from app.models import User  # Import inside the function to avoid circular imports
+    from app.models import User, db  # Import inside the function to avoid circular imports
+    hasher = current_app.extensions['password_hasher']
     user = User.query.filter_by(email=email).first()
-    if user and check_password_hash(user.password_hash, password):
-        return user
-    return None
+    if user is None or not user.password_hash:
+        return hasher.verify_unknown(password) or None
+    if not hasher.verify(password, user.password_hash):
+        return None
+    if hasher.needs_rehash(user.password_hash):
+        # The password is known to be right here, so this is the one chance to move it to the current cost
+        user.password_hash = hasher.hash(password)
+        db.session.commit()
+    return user
 
 def create_notification(user_id, message, notif_type):
-    from app.models import Notification, db  # Import inside the function to avoid circular imports
-    notification = Notification(user_id=user_id, message=message, type=notif_type)
-    db.session.add(notification)
-    db.session.commit()
+    from app.notifications import queue_notification  # Import inside the function to avoid circular imports
+    # No commit here: the notification goes out with the caller's transaction
+    queue_notification(user_id, message, notif_type)
+
+def handle_new_expense(expense):
+    handle_new_expenses([expense])
 
-def check_for_large_expense(expense):
+def handle_new_expenses(expenses):
     from app.models import db  # Import inside the function to avoid circular imports
-    threshold = 1000
-    if expense.amount >= threshold:
-        message = f'Large expense recorded: ${expense.amount} on {expense.date_purchase.strftime("%Y-%m-%d")}'
-        create_notification(expense.user_id, message, 'large_expense')
+    from app.rules import evaluate_new_expenses
+    # Rules read rollups and history, which must already include these expenses
+    db.session.flush()
+    evaluate_new_expenses([
+        {'user_id': e.user_id, 'category_id': e.category_id, 'date': e.date, 'currency': e.currency, 'amount_minor': e.amount_minor}
+        for e in expenses
+    ])
 
-def handle_new_expense(expense):
-    check_for_large_expense(expense)
-
-def create_recurring_expenses():
-    with app.app_context():
-        from app.models import Expenses, db  # Import inside the function to avoid circular imports
-        from datetime import timedelta
-        from dateutil.relativedelta import relativedelta
-
-        expenses = Expenses.query.filter(Expenses.recurrence.isnot(None)).all()
-        for expense in expenses:
-            if expense.recurrence == 'daily':
-                next_date = expense.date_purchase + timedelta(days=1)
-            elif expense.recurrence == 'weekly':
-                next_date = expense.date_purchase + timedelta(weeks=1)
-            elif expense.recurrence == 'monthly':
-                next_date = expense.date_purchase + relativedelta(months=1)
-
-            new_expense = Expenses(
-                type_expense=expense.type_expense,
-                description_expense=expense.description_expense,
-                date_purchase=next_date,
-                amount=expense.amount,
-                user_id=expense.user_id,
-                category_id=expense.category_id,
-                recurrence=expense.recurrence
-            )
-            db.session.add(new_expense)
-        db.session.commit()
+def expense_filters(user_id, category=None, start_date=None, end_date=None, category_id_for=None):
+    """
+    WHERE conditions shared by everything that reads a user's expenses with the /expenses filters.
+
+    category_id_for maps a category name to its id and defaults to the
+    category registry's lookup in the current session.
+    """
+    from app.models import Expenses  # Import inside the function to avoid circular imports
+    from sqlalchemy import false
+
+    conditions = [Expenses.user_id == user_id]
+    if category:
+        # The id comes from the category registry, so the (user_id, category_id, date) index is used with a constant
+        category_id = (category_id_for or current_app.extensions['category_registry'].id_for)(category)
+        conditions.append(Expenses.category_id == category_id if category_id is not None else false())
+    if start_date:
+        conditions.append(Expenses.date >= start_date)
+    if end_date:
+        # end_date is a day, include everything recorded on it
+        conditions.append(Expenses.date < end_date + timedelta(days=1))
+    return conditions
+
+def expenses_query(user_id, category=None, start_date=None, end_date=None, sort_by='date', order='desc', after=None,
+                   category_id_for=None):
+    """
+    A SELECT of the user's expenses with exactly the columns serialize_expense needs.
+
+    Category and user names come from joins in the same statement, so a page
+    of any size is one SELECT and no ORM objects or lazy loads are involved.
+    It is a plain statement, run by either the sync session or the async one.
+    """
+    from app.models import Expenses, Category, User  # Import inside the function to avoid circular imports
+    from sqlalchemy import select, tuple_, literal
+
+    if sort_by not in SORT_FIELDS:
+        raise ValueError(f"sort_by must be one of {SORT_FIELDS}.")
+    if order not in SORT_ORDERS:
+        raise ValueError(f"order must be one of {SORT_ORDERS}.")
+
+    query = select(
+        Expenses.id, Category.name.label('category'), Expenses.description, Expenses.date, Expenses.amount_minor,
+        Expenses.currency, User.user_name,
+    ).join(Category, Category.id == Expenses.category_id).join(User, User.id == Expenses.user_id) \
+        .where(*expense_filters(user_id, category, start_date, end_date, category_id_for))
+
+    # id breaks ties so the order is total (the indexes carry the rowid already)
+    column = getattr(Expenses, SORT_COLUMNS[sort_by])
+    if after is not None:
+        # Keyset pagination: seek past the last row seen instead of using OFFSET
+        key = tuple_(column, Expenses.id)
+        last_seen = tuple_(literal(after[0], column.type), literal(after[1], Expenses.id.type))
+        query = query.where(key > last_seen if order == 'asc' else key < last_seen)
+    if order == 'asc':
+        return query.order_by(column.asc(), Expenses.id.asc())
+    return query.order_by(column.desc(), Expenses.id.desc())
+
+def encode_cursor(row, sort_by, order):
+    value = getattr(row, SORT_COLUMNS.get(sort_by, sort_by))
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort_by, order, value, row.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_by, order):
+    if not cursor:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort_by, cursor_order, value, expense_id = json.loads(payload)
+        if sort_by in ('date', 'created_at'):
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, int):
+            raise ValueError
+        if not isinstance(expense_id, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if (cursor_sort_by, cursor_order) != (sort_by, order):
+        raise ValueError("Cursor does not match sort_by and order")
+    return value, expense_id
+
+def serialize_expense(row):
+    """Serialize a row from expenses_query."""
+    return {
+        'expense_id': row.id,
+        'category': row.category,
+        'description': row.description,
+        'date': row.date.strftime('%Y-%m-%d'),
+        'amount': from_minor(row.amount_minor, row.currency),
+        'currency': row.currency,
+        'user_name': row.user_name,
+    }
@@ -0,0 +1,7 @@
+import os
+from app import create_app
+from app.asgi import create_asgi_app
+from app.config import configs
+
+# Serve with any ASGI server, e.g. `uvicorn asgi:app --workers 4`
+app = create_asgi_app(create_app(configs[os.environ.get('APP_CONFIG', 'default')]))
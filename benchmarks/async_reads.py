@@ -0,0 +1,160 @@
+"""
+Sync vs async read path under many concurrent clients.
+
+Seeds a production-profile database file, then has --clients clients send
+back-to-back GETs to /expenses, /expenses/summary and /notifications for
+--seconds, once through the Flask app on a pool of --threads worker threads
+(as a threaded WSGI server would) and once through the ASGI app from
+app/asgi.py on one event loop. Both run in this process without sockets, so
+the difference is the serving model, not HTTP parsing. Reports requests per
+second and p50/p95/p99 latency, queueing for a free thread included.
+
+The response cache is off unless --cache is given, so every request reads
+the database.
+
+    python benchmarks/async_reads.py --clients 200 --threads 32 --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+from app import create_app, db
+from app.asgi import create_asgi_app
+from app.config import ProductionConfig
+from app.models import User, Category, Expenses, Notification
+
+PATHS = [
+    '/expenses?limit=50',
+    '/expenses?category=Category%203&sort_by=amount',
+    '/expenses/summary?group_by=category,month',
+    '/notifications?limit=20',
+]
+
+
+def seed(users, expenses):
+    db.session.execute(insert(User.__table__), [
+        {'email': f'user{n}@example.com', 'user_name': f'user{n}', 'is_admin': False} for n in range(users)
+    ])
+    db.session.execute(insert(Category.__table__), [{'name': f'Category {n}'} for n in range(10)])
+    start = datetime(2024, 1, 1)
+    for user_id in range(1, users + 1):
+        db.session.execute(insert(Expenses.__table__), [
+            {'amount_minor': 100 + (n * 700) % 50000, 'description': f'Expense {n}', 'date': start + timedelta(hours=13 * n),
+             'user_id': user_id, 'category_id': 1 + n % 10}
+            for n in range(expenses)
+        ])
+        db.session.execute(insert(Notification.__table__), [
+            {'user_id': user_id, 'message': f'Notification {n}', 'type': 'info', 'created_at': start + timedelta(days=n), 'is_read': n % 3 == 0}
+            for n in range(20)
+        ])
+    db.session.commit()
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+async def drive(request, clients, seconds, tokens):
+    """Run the clients until the deadline; returns the sorted latencies and the error count."""
+    latencies, errors = [], [0]
+    deadline = time.perf_counter() + seconds
+
+    async def client(n):
+        i = n
+        while time.perf_counter() < deadline:
+            i += 1
+            started = time.perf_counter()
+            status = await request(PATHS[i % len(PATHS)], tokens[n % len(tokens)])
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors[0] += 1
+
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return sorted(latencies), errors[0]
+
+def sync_mode(app, threads):
+    client = app.test_client()
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    def get(path, token):
+        response = client.get(path, headers={'Authorization': f'Bearer {token}'})
+        response.get_data()
+        return response.status_code
+
+    async def request(path, token):
+        return await asyncio.get_running_loop().run_in_executor(pool, get, path, token)
+    return request, pool.shutdown
+
+def async_mode(asgi_app):
+    async def request(path, token):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'http_version': '1.1',
+            'headers': [(b'authorization', f'Bearer {token}'.encode())],
+        }
+        status = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+        await asgi_app(scope, receive, send)
+        return status[0]
+    return request, lambda: None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32, help='Worker threads of the sync path.')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--expenses', type=int, default=500, help='Expenses per user.')
+    parser.add_argument('--cache', action='store_true', help='Keep the response cache on.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        class BenchmarkConfig(ProductionConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'app.db')
+            RESPONSE_CACHE_BACKEND = 'memory' if args.cache else None
+            NOTIFICATION_WORKERS = 0
+            SCHEDULER_THREAD = False
+            JWT_ACCESS_TOKEN_EXPIRES = False
+
+        app = create_app(BenchmarkConfig)
+        asgi_app = create_asgi_app(app)
+        with app.app_context():
+            db.create_all()
+            seed(args.users, args.expenses)
+            tokens = [create_access_token(identity=str(user_id)) for user_id in range(1, args.users + 1)]
+            db.session.remove()
+
+        print(f"{'path':<6} {'clients':>7} {'threads':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        for mode, (request, close), threads in (('sync', sync_mode(app, args.threads), args.threads),
+                                                ('async', async_mode(asgi_app), 1)):
+            async def run():
+                await drive(request, args.clients, min(args.seconds, 1), tokens)  # Warm up pools and caches
+                result = await drive(request, args.clients, args.seconds, tokens)
+                if mode == 'async':
+                    await asgi_app.close()
+                return result
+            latencies, errors = asyncio.run(run())
+            close()
+            print(f"{mode:<6} {args.clients:>7} {threads:>7} {len(latencies) / args.seconds:>9,.0f} "
+                  f"{percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} {percentile(latencies, 0.99):>8.1f} {errors:>6}")
+        with app.app_context():
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
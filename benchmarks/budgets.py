@@ -0,0 +1,139 @@
+"""
+Budgets: reading maintained period-to-date counters against counting the period.
+
+Seeds --rows expenses over the last --days days for --users users, and
+gives user 1 a monthly and a yearly budget in each of --categories
+categories. Then reads user 1's budgets two ways:
+
+    counters    current_budgets, the budget rows as /budgets reads them
+    recount     period_spend for every budget, what each page view would
+                cost without the counters (the same query a rollover runs)
+
+Each runs --repeat times and the fastest run is reported. Then --writes
+expenses for user 1 are added with the ORM, one commit each like
+POST /add_expense, with and without the budgets, to show what keeping the
+counters costs a write.
+
+    python benchmarks/budgets.py --rows 1000000
+    python benchmarks/budgets.py --rows 100000 --days 60 --writes 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, delete
+from app import create_app, db
+from app.config import ProductionConfig
+from app.models import User, Category, Expenses, Budget
+from app.budgets import current_budgets, period_spend, period_bounds, today
+
+
+def seed(rows, users, categories, days, batch=50000):
+    db.session.execute(insert(User.__table__), [
+        {'email': f'user{n}@example.com', 'user_name': f'user{n}', 'is_admin': False} for n in range(users)
+    ])
+    db.session.execute(insert(Category.__table__), [{'name': f'Category {n}'} for n in range(categories)])
+    # Spread evenly over the last days, newest first
+    now = datetime.combine(today(), datetime.min.time())
+    step = timedelta(days=days) / rows
+    for offset in range(0, rows, batch):
+        db.session.execute(insert(Expenses.__table__), [
+            {'amount_minor': 1 + n * 7919 % 99999, 'description': 'Expense', 'date': now - step * n,
+             'user_id': 1 + n % users, 'category_id': 1 + n // users % categories}
+            for n in range(offset, min(offset + batch, rows))
+        ])
+    db.session.commit()
+
+def add_budgets(categories):
+    db.session.add_all([
+        Budget(user_id=1, category_id=category_id, period=period, amount=10 ** 6)
+        for category_id in range(1, categories + 1) for period in ('monthly', 'yearly')
+    ])
+    db.session.commit()
+    # First access counts them
+    current_budgets(1)
+    db.session.commit()
+
+
+def recount():
+    spent = []
+    for budget in db.session.execute(db.select(Budget.__table__).where(Budget.user_id == 1)).mappings().all():
+        spent.append(period_spend(db.session.connection(), budget, *period_bounds(budget['period'], today())))
+    return spent
+
+def counters():
+    return [budget['spent_minor'] for budget in current_budgets(1)]
+
+def best_time(run, repeat):
+    elapsed = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        elapsed = min(elapsed or float('inf'), time.perf_counter() - started)
+        db.session.rollback()
+    return elapsed, result
+
+def time_writes(count, categories):
+    now = datetime.combine(today(), datetime.min.time())
+    started = time.perf_counter()
+    for n in range(count):
+        db.session.add(Expenses(amount_minor=100, description='Expense', date=now, user_id=1, category_id=1 + n % categories))
+        db.session.commit()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--writes', type=int, default=5000, help='Expenses added one commit at a time.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        class BenchmarkConfig(ProductionConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'budgets.db')
+            NOTIFICATION_WORKERS = 0
+            SCHEDULER_THREAD = False
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            seed(args.rows, args.users, args.categories, args.days)
+            print(f"Seeded {args.rows:,} expenses in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+            print(f"{'inserts':<16} {'seconds':>8} {'writes/s':>10}")
+            for name in ('without budgets', 'with budgets'):
+                if name == 'with budgets':
+                    add_budgets(args.categories)
+                elapsed = time_writes(args.writes, args.categories)
+                print(f"{name:<16} {elapsed:>8.2f} {args.writes / elapsed:>10,.0f}")
+                db.session.execute(delete(Expenses).where(Expenses.id > args.rows))
+                db.session.commit()
+            # Recounted without the writes that were just taken out again
+            db.session.execute(db.update(Budget).values(period_start=None))
+            db.session.commit()
+            current_budgets(1)
+            db.session.commit()
+
+            print()
+            print(f"{'read':<9} {'budgets':>8} {'ms':>9} {'vs recount':>11}")
+            results = [(name, *best_time(run, args.repeat)) for name, run in [('recount', recount), ('counters', counters)]]
+            if results[0][2] != results[1][2]:
+                raise SystemExit("Counters differ from a recount")
+            for name, elapsed, spent in results:
+                print(f"{name:<9} {len(spent):>8} {elapsed * 1000:>9.2f} {results[0][1] / elapsed:>10.1f}x")
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
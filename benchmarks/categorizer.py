@@ -0,0 +1,175 @@
+"""
+Automatic categorization: prediction cost per row, index size and accuracy.
+
+Seeds --rows labeled expenses spread over --users users, with merchant-style
+descriptions whose category depends on the merchant, and builds the
+category_token index from them. Then, for one user:
+
+    predict     CategoryIndex.predict on an index already in memory
+    assign      assign_categories on --batch unlabeled rows, including the
+                query that loads the user's counts for the batch
+    single      assign_categories on one row, what POST /add_expense pays
+
+Each runs --repeat times and the fastest run is reported per row. The index
+is also timed on the write path, inserting --writes rows in batches of 1000
+with and without add_to_category_index, and its size is compared with the
+expenses table. Last, --fixture (the labeled set the tests use by default)
+is replayed through evaluate.
+
+    python benchmarks/categorizer.py --rows 1000000
+    python benchmarks/categorizer.py --rows 100000 --batch 10000 --fixture statement.csv
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, text
+from app import create_app, db
+from app.config import ProductionConfig
+from app.models import User, Category, Expenses
+from app.categorizer import add_to_category_index, assign_categories, load_category_index, evaluate, read_labeled
+from app.search import insert_expenses
+
+# Merchant -> category id, the first word of some merchants is shared across categories
+MERCHANTS = [
+    ('Uber trip', 1), ('Uber Eats order', 2), ('Tesco Express', 3), ('Tesco petrol', 1), ('Sainsbury\'s', 3),
+    ('Pret A Manger', 2), ('Costa coffee shop', 2), ('Starbucks', 2), ('Amazon marketplace', 4), ('Amazon Prime', 5),
+    ('TfL travel', 1), ('Shell petrol', 1), ('Boots pharmacy', 6), ('Netflix subscription', 5), ('Spotify', 5),
+    ('Deliveroo', 2), ('Trainline tickets', 1), ('Waitrose', 3), ('Lidl', 3), ('Aldi', 3), ('John Lewis', 4),
+    ('Argos', 4), ('Greggs', 2), ('Council tax', 7), ('British Gas', 7), ('Thames Water', 7), ('Vodafone', 7),
+    ('EasyJet flight', 8), ('Airbnb stay', 8), ('Pets at Home', 9),
+]
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test', 'fixtures', 'labeled_expenses.csv')
+
+
+def merchant(n):
+    # Multiplicative hashing, so every user gets every merchant
+    return MERCHANTS[(n * 2654435761 % 2 ** 32 >> 16) % len(MERCHANTS)]
+
+def expense_rows(start, stop, users):
+    first = datetime(2015, 1, 1)
+    rows = []
+    for n in range(start, stop):
+        name, category_id = merchant(n)
+        rows.append({'amount_minor': 1 + n * 7919 % 99999, 'description': f'{name} ref {n % 99991}',
+                     'date': first + timedelta(minutes=5 * n), 'user_id': 1 + n % users, 'category_id': category_id})
+    return rows
+
+def seed(rows, users, categories=10, batch=50000):
+    db.session.execute(insert(User.__table__), [
+        {'email': f'user{n}@example.com', 'user_name': f'user{n}', 'is_admin': False} for n in range(users)
+    ])
+    db.session.execute(insert(Category.__table__), [{'name': f'Category {n}'} for n in range(categories)])
+    for offset in range(0, rows, batch):
+        batch_rows = expense_rows(offset, min(offset + batch, rows), users)
+        db.session.execute(insert(Expenses.__table__), batch_rows)
+        add_to_category_index(db.session.connection(), batch_rows)
+    db.session.commit()
+
+def table_pages(name):
+    return db.session.execute(text('SELECT SUM(pgsize) FROM dbstat WHERE name = :name'), {'name': name}).scalar() or 0
+
+
+def unlabeled(start, count, users):
+    # Every users-th row belongs to user 1
+    return [{'description': row['description'], 'category_id': None, 'expected': row['category_id']}
+            for row in expense_rows(start, start + count * users, users) if row['user_id'] == 1]
+
+def best_time(run, repeat):
+    elapsed = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        elapsed = min(elapsed or float('inf'), time.perf_counter() - started)
+        db.session.rollback()
+    return elapsed, result
+
+def time_reads(rows, users, batch, repeat):
+    sample = unlabeled(rows, batch, users)
+    index = load_category_index(1, [row['description'] for row in sample])
+
+    def assign(count):
+        def run():
+            fresh = [dict(row, category_id=None) for row in sample[:count]]
+            assign_categories(1, fresh)
+            return sum(row['category_id'] == row['expected'] for row in fresh) / count
+        return run
+
+    def predict():
+        return sum(index.predict(row['description']) == row['expected'] for row in sample) / len(sample)
+
+    return [
+        ('predict', len(sample), *best_time(predict, repeat)),
+        ('assign', len(sample), *best_time(assign(len(sample)), repeat)),
+        ('single', 1, *best_time(assign(1), repeat)),
+    ]
+
+def time_writes(rows, count, users, batch=1000):
+    results = []
+    for name, maintain in [('without index', False), ('with index', True)]:
+        started = time.perf_counter()
+        for offset in range(rows, rows + count, batch):
+            batch_rows = expense_rows(offset, min(offset + batch, rows + count), users)
+            insert_expenses(batch_rows)
+            if maintain:
+                add_to_category_index(db.session.connection(), batch_rows)
+            db.session.commit()
+        results.append((name, time.perf_counter() - started))
+        db.session.rollback()
+        db.session.execute(Expenses.__table__.delete().where(Expenses.id > rows))
+        db.session.commit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--batch', type=int, default=1000, help='Unlabeled rows categorized together.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--writes', type=int, default=50000, help='Rows inserted to time index maintenance.')
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE, help='Labeled CSV (description,category) to evaluate.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        class BenchmarkConfig(ProductionConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'categorizer.db')
+            NOTIFICATION_WORKERS = 0
+            SCHEDULER_THREAD = False
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            seed(args.rows, args.users)
+            print(f"Seeded and indexed {args.rows:,} expenses in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+            tokens = db.session.execute(text('SELECT COUNT(*) FROM category_token')).scalar()
+            print(f"category_token: {tokens:,} rows, {table_pages('category_token') / 2 ** 20:.1f} MB; "
+                  f"expenses: {table_pages('expenses') / 2 ** 20:.1f} MB")
+            print()
+            print(f"{'method':<9} {'rows':>7} {'ms':>9} {'us/row':>8} {'accuracy':>9}")
+            for name, count, elapsed, accuracy in time_reads(args.rows, args.users, args.batch, args.repeat):
+                print(f"{name:<9} {count:>7} {elapsed * 1000:>9.2f} {elapsed / count * 1e6:>8.1f} {accuracy:>9.1%}")
+
+            print()
+            print(f"{'inserts':<14} {'seconds':>8} {'rows/s':>10}")
+            for name, elapsed in time_writes(args.rows, args.writes, args.users):
+                print(f"{name:<14} {elapsed:>8.2f} {args.writes / elapsed:>10,.0f}")
+            db.session.remove()
+            db.engine.dispose()
+
+    with open(args.fixture, 'rb') as stream:
+        result = evaluate(read_labeled(stream))
+    print()
+    print(f"{os.path.basename(args.fixture)}: {result['rows']} rows, accuracy {result['accuracy']:.1%}, "
+          f"precision {result['precision']:.1%}, coverage {result['coverage']:.1%}, {result['microseconds_per_row']:.1f} us/row")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+HTTP load test of the API endpoints against a local server.
+
+Seeds a throwaway SQLite database (users, categories, --expenses expenses,
+recurring schedules, notifications and budgets), starts the app on a threaded
+werkzeug server on a free local port, and then drives each scenario from
+--concurrency client threads, each with its own keep-alive connection,
+for --seconds. Reports requests per second and p50/p95/p99 latency per
+scenario and concurrency.
+
+    python benchmarks/endpoints.py --expenses 1000000 --concurrency 1,16 --seconds 5
+    python benchmarks/endpoints.py --scenario expenses --output results.json
+    python benchmarks/endpoints.py --baseline results.json --tolerance 0.15
+
+--output writes the results as JSON. --baseline reads such a file and marks
+each scenario whose req/s fell or whose p95 rose by more than --tolerance.
+The exit status is 1 if any did.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+from werkzeug.serving import make_server, WSGIRequestHandler
+from app import create_app, db
+from app.config import Config, ProductionConfig
+from app.models import User, Category, Expenses, RecurringExpense, Notification, Budget
+from app.passwords import hash_with_rounds
+
+PROFILES = {'default': Config, 'production': ProductionConfig}
+PASSWORD = 'benchmark-password'
+CATEGORIES = 20
+
+
+def seed(users, expenses, recurring, rounds, batch=10000):
+    # One hash for everyone, hashing a million users' passwords is not what is being measured
+    password_hash = hash_with_rounds(PASSWORD, rounds)
+    db.session.execute(insert(User.__table__), [
+        {'email': f'user{n}@example.com', 'user_name': f'user{n}', 'password_hash': password_hash, 'is_admin': False}
+        for n in range(users)
+    ])
+    db.session.execute(insert(Category.__table__), [{'name': f'Category {n}'} for n in range(CATEGORIES)])
+    start = datetime(2022, 1, 1)
+    for offset in range(0, expenses, batch):
+        db.session.execute(insert(Expenses.__table__), [
+            {'amount_minor': 199 + (n * 3700) % 50000, 'description': f'Expense number {n}', 'date': start + timedelta(minutes=3 * n),
+             'user_id': 1 + n % users, 'category_id': 1 + n % CATEGORIES}
+            for n in range(offset, min(offset + batch, expenses))
+        ])
+    db.session.execute(insert(RecurringExpense.__table__), [
+        {'amount_minor': 999, 'type_expense': 'Subscription', 'description_expense': f'Subscription {n}', 'recurrence': 'monthly',
+         'start_date': start, 'end_date': start + timedelta(days=730), 'user_id': 1 + n % users, 'category_id': 1 + n % CATEGORIES}
+        for n in range(recurring)
+    ])
+    for offset in range(0, users, batch // 20):
+        db.session.execute(insert(Notification.__table__), [
+            {'user_id': user_id, 'message': f'Notification {n}', 'type': 'info', 'created_at': start + timedelta(days=n), 'is_read': n % 2 == 0}
+            for user_id in range(1 + offset, 1 + min(offset + batch // 20, users)) for n in range(20)
+        ])
+        # Counted on each user's first /budgets read or expense write
+        db.session.execute(insert(Budget.__table__), [
+            {'user_id': user_id, 'category_id': 1 + n, 'period': 'monthly', 'amount_minor': 50000, 'currency': 'GBP',
+             'alert_percent': 80, 'spent_minor': 0, 'alerted_percent': 0}
+            for user_id in range(1 + offset, 1 + min(offset + batch // 20, users)) for n in range(3)
+        ])
+    db.session.commit()
+
+
+def expense_paths():
+    """Every /expenses filter and sort combination, plus a deep page and NDJSON."""
+    filters = {
+        'all': '',
+        'category': '&category=Category%207',
+        'from': '&start_date=2023-01-01',
+        'range': '&start_date=2023-01-01&end_date=2023-06-30',
+        'category+range': '&category=Category%207&start_date=2023-01-01&end_date=2023-06-30',
+    }
+    paths = {}
+    for (name, query), sort_by, order in itertools.product(filters.items(), ['date', 'amount'], ['desc', 'asc']):
+        paths[f'expenses:{name}:{sort_by}:{order}'] = f'/expenses?limit=50&sort_by={sort_by}&order={order}{query}'
+    paths['expenses:ndjson'] = '/expenses?format=ndjson&start_date=2023-06-01&end_date=2023-06-30'
+    return paths
+
+def scenarios(users):
+    """name -> function(n) returning (method, path, body, user id to authenticate as or None)."""
+    counter = itertools.count()
+    result = {
+        'register': lambda n: ('POST', '/register', {
+            'username': f'new_{n}_{next(counter)}', 'email': f'new{n}.{next(counter)}@example.com', 'password': PASSWORD,
+        }, None),
+        'login': lambda n: ('POST', '/login', {'email': f'user{random.randrange(users)}@example.com', 'password': PASSWORD}, None),
+        'add_expense': lambda n: ('POST', '/add_expense', {
+            'type_expense': f'Category {random.randrange(CATEGORIES)}', 'description_expense': 'Benchmark',
+            'date_purchase': f'2024-{1 + random.randrange(12):02d}-{1 + random.randrange(28):02d}', 'amount': random.randrange(1, 500),
+        }, random.randrange(1, users + 1)),
+    }
+    for name, path in expense_paths().items():
+        result[name] = lambda n, path=path: ('GET', path, None, random.randrange(1, users + 1))
+    result['summary'] = lambda n: ('GET', '/expenses/summary?group_by=category,month', None, random.randrange(1, users + 1))
+    result['notifications'] = lambda n: ('GET', '/notifications?limit=20', None, random.randrange(1, users + 1))
+    result['notifications:unread'] = lambda n: ('GET', '/notifications?unread=true', None, random.randrange(1, users + 1))
+    result['notifications:unread_count'] = lambda n: ('GET', '/notifications/unread_count', None, random.randrange(1, users + 1))
+    result['budgets'] = lambda n: ('GET', '/budgets', None, random.randrange(1, users + 1))
+    return result
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+def start_server(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+    return server
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return None
+    return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 2)
+
+def drive(port, request_for, tokens, concurrency, seconds):
+    """Run one scenario from concurrency threads; returns its statistics."""
+    latencies, errors, lock = [], [0], threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(n):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        mine, failed = [], 0
+        while time.perf_counter() < deadline:
+            method, path, body, user_id = request_for(n)
+            headers = {'Content-Type': 'application/json'}
+            if user_id is not None:
+                headers['Authorization'] = f'Bearer {tokens[user_id]}'
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                ok = False
+            mine.append(time.perf_counter() - started)
+            failed += not ok
+        connection.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+
+def compare(results, baseline, tolerance):
+    """Names of the results that regressed against the baseline, by req/s or p95."""
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if not before or not before['rps']:
+            continue
+        slower = result['rps'] < before['rps'] * (1 - tolerance)
+        later = result['p95_ms'] is not None and before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + tolerance)
+        if slower or later:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=list(PROFILES), default='production')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--expenses', type=int, default=1000000)
+    parser.add_argument('--recurring', type=int, default=10000)
+    parser.add_argument('--concurrency', default='16', help='Comma separated client thread counts, each scenario runs at each.')
+    parser.add_argument('--seconds', type=float, default=5, help='Duration of each scenario at each concurrency.')
+    parser.add_argument('--scenario', action='append', help='Run only scenarios whose name starts with this (repeatable).')
+    parser.add_argument('--rounds', type=int, default=None, help='bcrypt cost for /register and /login (default: the profile\'s).')
+    parser.add_argument('--no-cache', action='store_true', help='Turn the response cache off.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare with the results in this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed drop in req/s or rise in p95, as a fraction.')
+    args = parser.parse_args()
+    concurrencies = [int(value) for value in args.concurrency.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        profile = PROFILES[args.profile]
+
+        class BenchmarkConfig(profile):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'app.db')
+            RESPONSE_CACHE_PATH = os.path.join(tmpdir, 'response_cache.db')
+            BCRYPT_LOG_ROUNDS = args.rounds or profile.BCRYPT_LOG_ROUNDS
+            JWT_ACCESS_TOKEN_EXPIRES = False
+            NOTIFICATION_WORKERS = 1
+            SCHEDULER_THREAD = False
+            # The load comes from one address, it must not trip the per-IP login limit
+            LOGIN_IP_MAX_FAILURES = 10 ** 9
+            if args.no_cache:
+                RESPONSE_CACHE_BACKEND = None
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            clock = time.perf_counter()
+            seed(args.users, args.expenses, args.recurring, BenchmarkConfig.BCRYPT_LOG_ROUNDS)
+            print(f"Seeded {args.users:,} users and {args.expenses:,} expenses in {time.perf_counter() - clock:.1f}s", file=sys.stderr)
+            tokens = {user_id: create_access_token(identity=str(user_id)) for user_id in range(1, args.users + 1)}
+            db.session.remove()
+        server = start_server(app)
+
+        chosen = {name: request_for for name, request_for in scenarios(args.users).items()
+                  if not args.scenario or any(name.startswith(prefix) for prefix in args.scenario)}
+        results = {}
+        print(f"{'scenario':<38} {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        for name, request_for in chosen.items():
+            for concurrency in concurrencies:
+                result = drive(server.port, request_for, tokens, concurrency, args.seconds)
+                results[f'{name}@{concurrency}'] = result
+                print(f"{name:<38} {concurrency:>7} {result['rps']:>9,.1f} {result['p50_ms'] or 0:>8.1f} "
+                      f"{result['p95_ms'] or 0:>8.1f} {result['p99_ms'] or 0:>8.1f} {result['errors']:>6}")
+        server.shutdown()
+        app.extensions['password_hasher'].shutdown()
+        with app.app_context():
+            db.engine.dispose()
+
+    report = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpus': os.cpu_count(),
+            **{name: value for name, value in vars(args).items() if name not in ('output', 'baseline')},
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for key in regressions:
+            before, after = baseline['results'][key], results[key]
+            print(f"REGRESSION {key}: {before['rps']:,.1f} -> {after['rps']:,.1f} req/s, "
+                  f"p95 {before['p95_ms']} -> {after['p95_ms']} ms")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Export throughput benchmark.
+
+Seeds a throwaway SQLite database and streams every expense through each
+export writer, reporting rows per second and peak Python memory. Peak memory
+should stay roughly the same whatever --rows is.
+
+    python benchmarks/export.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from app import create_app, db
+from app.config import Config
+from app.models import User, Category, Expenses
+from app.exports import EXPORT_WRITERS, export_partitions
+
+
+def seed(rows, users=100, categories=20, batch=10000):
+    db.session.execute(insert(User.__table__), [
+        {'email': f'user{n}@example.com', 'user_name': f'user{n}', 'is_admin': False} for n in range(users)
+    ])
+    db.session.execute(insert(Category.__table__), [{'name': f'Category {n}'} for n in range(categories)])
+    start = datetime(2020, 1, 1)
+    for offset in range(0, rows, batch):
+        db.session.execute(insert(Expenses.__table__), [
+            {'amount_minor': 199 + n % 500 * 100, 'description': f'Expense number {n}', 'date': start + timedelta(minutes=n),
+             'user_id': 1 + n % users, 'category_id': 1 + n % categories}
+            for n in range(offset, min(offset + batch, rows))
+        ])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=Config.EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        class BenchmarkConfig(Config):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+            SCHEDULER_THREAD = False
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            seed(args.rows)
+
+            print(f"{'format':<10} {'rows/s':>12} {'MB/s':>8} {'peak MB':>8}")
+            for name, writer in EXPORT_WRITERS.items():
+                started = time.perf_counter()
+                size = sum(len(chunk) for chunk in writer(export_partitions(chunk_size=args.chunk_size)))
+                elapsed = time.perf_counter() - started
+
+                # tracemalloc slows allocation down a lot, so memory is measured on a second pass
+                tracemalloc.start()
+                for chunk in writer(export_partitions(chunk_size=args.chunk_size)):
+                    pass
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"{name:<10} {args.rows / elapsed:>12,.0f} {size / elapsed / 1e6:>8.1f} {peak / 1e6:>8.1f}")
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Login throughput benchmark.
+
+Sends POST /login requests from several client threads against a throwaway
+SQLite database, once with bcrypt on the request threads and once with the
+process pool, and reports logins per second overall and per core used.
+
+    python benchmarks/login.py --rounds 12 --logins 200 --threads 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.config import Config
+from app.models import User
+
+
+def run(app, logins, threads):
+    def login(n):
+        response = app.test_client().post('/login', json={'email': f'user{n % 10}@example.com', 'password': 'benchmark-password'})
+        assert response.status_code == 200, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(login, range(logins)))
+    return logins / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=Config.BCRYPT_LOG_ROUNDS)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Process pool size for the pooled run.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"{'mode':<14} {'cores':>6} {'logins/s':>10} {'per core':>10}")
+        for mode, workers in (('request thread', 0), ('process pool', args.workers)):
+            class BenchmarkConfig(Config):
+                SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, f'{mode}.db')
+                BCRYPT_LOG_ROUNDS = args.rounds
+                PASSWORD_HASH_WORKERS = workers
+                NOTIFICATION_WORKERS = 0
+                SCHEDULER_THREAD = False
+
+            app = create_app(BenchmarkConfig)
+            with app.app_context():
+                db.create_all()
+                for n in range(10):
+                    user = User(user_name=f'user{n}', email=f'user{n}@example.com')
+                    user.set_password('benchmark-password')
+                    db.session.add(user)
+                db.session.commit()
+                db.session.remove()
+
+            # Warm up, which also starts the pool processes
+            run(app, args.workers or 1, args.threads)
+            rate = run(app, args.logins, args.threads)
+            cores = min(workers or args.threads, os.cpu_count())
+            print(f"{mode:<14} {cores:>6} {rate:>10,.1f} {rate / cores:>10,.1f}")
+            app.extensions['password_hasher'].shutdown()
+            with app.app_context():
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
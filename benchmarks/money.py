@@ -0,0 +1,146 @@
+"""
+Aggregate speed and exactness of integer minor units against float amounts.
+
+Seeds --rows expenses with amounts in integer minor units, then copies them
+into a float_expenses table laid out like expenses was before amounts moved
+to integers. The same totals, for each --group-by, are computed three ways:
+
+    integer        SUM(amount_minor) in SQL, what the app does now
+    float          SUM(amount) over the float copy in SQL
+    float+Decimal  float rows fetched and re-added in Python with Decimal,
+                   the way to get exact totals out of a float column
+
+and each result is compared with the exact totals. A group is wrong when its
+total, rounded to cents, is not the exact one; drift is the largest
+difference before rounding. Both SQL methods scan the table rather than
+walk a user_id index, as a whole-table report should. Each method runs
+--repeat times and the fastest run is reported. Then --format amounts are
+serialized with Decimal and with the app's integer formatting.
+
+    python benchmarks/money.py --rows 10000000
+    python benchmarks/money.py --rows 1000000 --group-by all --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, text
+from app import create_app, db
+from app.config import ProductionConfig
+from app.models import User, Category, Expenses
+from app.money import from_minor, format_minor
+
+GROUPINGS = {
+    'user,month': "user_id, strftime('%Y-%m', date)",
+    'user': 'user_id',
+    'all': "'all'",
+}
+
+
+def seed(rows, users=100, categories=20, batch=50000):
+    db.session.execute(insert(User.__table__), [
+        {'email': f'user{n}@example.com', 'user_name': f'user{n}', 'is_admin': False} for n in range(users)
+    ])
+    db.session.execute(insert(Category.__table__), [{'name': f'Category {n}'} for n in range(categories)])
+    start = datetime(2015, 1, 1)
+    for offset in range(0, rows, batch):
+        # 0.01 to 999.99 with every cent pattern, most of them not exact binary fractions
+        db.session.execute(insert(Expenses.__table__), [
+            {'amount_minor': 1 + n * 7919 % 99999, 'description': 'Expense', 'date': start + timedelta(seconds=30 * n),
+             'user_id': 1 + n % users, 'category_id': 1 + n % categories}
+            for n in range(offset, min(offset + batch, rows))
+        ])
+    db.session.execute(text(
+        'CREATE TABLE float_expenses AS SELECT id, CAST(amount_minor AS REAL) / 100 AS amount, description, date, user_id, category_id '
+        'FROM expenses'
+    ))
+    db.session.commit()
+
+
+def integer_totals(groups):
+    rows = db.session.execute(text(f'SELECT {groups}, SUM(amount_minor) FROM expenses NOT INDEXED GROUP BY {groups}'))
+    return {tuple(row[:-1]): row[-1] for row in rows}
+
+def float_totals(groups):
+    rows = db.session.execute(text(f'SELECT {groups}, SUM(amount) FROM float_expenses NOT INDEXED GROUP BY {groups}'))
+    return {tuple(row[:-1]): row[-1] * 100 for row in rows}
+
+def decimal_totals(groups):
+    totals = defaultdict(Decimal)
+    rows = db.session.execute(text(f'SELECT {groups}, amount FROM float_expenses').execution_options(yield_per=50000))
+    for row in rows:
+        totals[tuple(row[:-1])] += Decimal(repr(row[-1]))
+    return {key: total * 100 for key, total in totals.items()}
+
+def check(totals, exact):
+    wrong = sum(1 for key, total in totals.items() if round(total) != exact[key])
+    drift = max(abs(float(total) - exact[key]) for key, total in totals.items())
+    return wrong, drift
+
+
+def time_serialization(count):
+    amounts = [1 + n * 7919 % 99999 for n in range(count)]
+    results = []
+    for name, serialize in [
+        ('Decimal str', lambda minor: str(Decimal(minor).scaleb(-2))),
+        ('format_minor', format_minor),
+        ('from_minor', from_minor),
+    ]:
+        started = time.perf_counter()
+        for minor in amounts:
+            serialize(minor)
+        results.append((name, time.perf_counter() - started))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--group-by', choices=list(GROUPINGS), action='append', help='Repeatable (default: each of them).')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--format', type=int, default=1000000, help='Amounts to serialize.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        class BenchmarkConfig(ProductionConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'money.db')
+            NOTIFICATION_WORKERS = 0
+            SCHEDULER_THREAD = False
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            seed(args.rows)
+            print(f"Seeded {args.rows:,} expenses in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+            print(f"{'group by':<11} {'method':<14} {'seconds':>8} {'rows/s':>12} {'groups':>7} {'wrong':>6} {'drift (cents)':>14}")
+            for grouping in args.group_by or list(GROUPINGS):
+                exact = None
+                for name, aggregate in [('integer', integer_totals), ('float', float_totals), ('float+Decimal', decimal_totals)]:
+                    elapsed = None
+                    for _ in range(args.repeat):
+                        started = time.perf_counter()
+                        totals = aggregate(GROUPINGS[grouping])
+                        elapsed = min(elapsed or float('inf'), time.perf_counter() - started)
+                    exact = exact or totals
+                    wrong, drift = check(totals, exact)
+                    print(f"{grouping:<11} {name:<14} {elapsed:>8.2f} {args.rows / elapsed:>12,.0f} {len(totals):>7} {wrong:>6} {drift:>14.6f}")
+            db.session.remove()
+            db.engine.dispose()
+
+    print()
+    print(f"{'serializer':<14} {'seconds':>8} {'amounts/s':>12}")
+    for name, elapsed in time_serialization(args.format):
+        print(f"{name:<14} {elapsed:>8.2f} {args.format / elapsed:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
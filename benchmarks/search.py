@@ -0,0 +1,178 @@
+"""
+Description search: the FTS5 index against LIKE '%...%'.
+
+Seeds --rows expenses with merchant-style descriptions spread over --users
+users, then runs each search term through:
+
+    like        expenses_query filtered with description LIKE '%term%',
+                newest first, the only way to search before the index
+    fts rank    search_query with the best matches first
+    fts date    search_query newest first, paging like /expenses
+
+for one user's first page of --limit rows, and as a count over every
+user's expenses. Each query runs --repeat times and the fastest run is
+reported. Then --writes rows are inserted in batches of 1000 with and
+without the triggers that keep the index in sync, once with an executemany
+and once through insert_expenses, to show what they cost the write path.
+
+    python benchmarks/search.py --rows 1000000
+    python benchmarks/search.py --rows 200000 --term uber --term '"coffee shop"'
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select, func, text
+from app import create_app, db
+from app.config import ProductionConfig
+from app.models import User, Category, Expenses
+from app.search import (
+    SEARCH_TABLE, SQLITE_DDL, search_table, search_query, fts5_match, parse_search, insert_expenses, rebuild_search_index,
+)
+from app.utils import expenses_query
+
+MERCHANTS = [
+    'Uber trip', 'Uber Eats order', 'Tesco Express', 'Sainsbury\'s', 'Pret A Manger', 'Costa coffee shop', 'Starbucks',
+    'Amazon marketplace', 'TfL travel', 'Shell petrol', 'Boots', 'Netflix subscription', 'Spotify', 'Deliveroo',
+    'Trainline tickets', 'Waitrose', 'Lidl', 'Aldi', 'John Lewis', 'Argos', 'Greggs', 'Nando\'s', 'Wagamama',
+    'Council tax', 'British Gas', 'Thames Water', 'Vodafone', 'EasyJet flight', 'Airbnb stay', 'Itsu',
+]
+# Appear once every so many rows, the kind of search that LIKE is worst at
+RARE = {997: 'Monthly rent', 4999: 'Pharmacy prescription'}
+TERMS = ['uber', 'rent', 'pharm*', '"coffee shop"', 'uber eats']
+
+
+def description(n):
+    for every, text_ in RARE.items():
+        if n % every == 0:
+            return f'{text_} ref {n % 99991}'
+    # Multiplicative hashing, so every user gets every merchant
+    return f'{MERCHANTS[(n * 2654435761 % 2 ** 32 >> 16) % len(MERCHANTS)]} ref {n % 99991}'
+
+def expense_rows(start, stop, users, categories):
+    first = datetime(2015, 1, 1)
+    return [
+        {'amount_minor': 1 + n * 7919 % 99999, 'description': description(n), 'date': first + timedelta(minutes=5 * n),
+         'user_id': 1 + n % users, 'category_id': 1 + n % categories}
+        for n in range(start, stop)
+    ]
+
+def drop_triggers():
+    for name in ('insert', 'delete', 'update'):
+        db.session.execute(text(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{name}'))
+
+def create_triggers():
+    for statement in SQLITE_DDL[1:]:
+        db.session.execute(text(statement))
+
+def seed(rows, users, categories=20, batch=50000):
+    db.session.execute(insert(User.__table__), [
+        {'email': f'user{n}@example.com', 'user_name': f'user{n}', 'is_admin': False} for n in range(users)
+    ])
+    db.session.execute(insert(Category.__table__), [{'name': f'Category {n}'} for n in range(categories)])
+    # Loaded without the triggers and indexed in one pass, like `flask search rebuild`
+    drop_triggers()
+    for offset in range(0, rows, batch):
+        db.session.execute(insert(Expenses.__table__), expense_rows(offset, min(offset + batch, rows), users, categories))
+    db.session.commit()
+    started = time.perf_counter()
+    rebuild_search_index()
+    create_triggers()
+    db.session.commit()
+    return time.perf_counter() - started
+
+
+def like_pattern(term):
+    return '%' + term.strip('"*') + '%'
+
+def user_queries(term, limit):
+    like = expenses_query(1).where(Expenses.description.like(like_pattern(term)))
+    return [
+        ('like', like.limit(limit)),
+        ('fts rank', search_query(1, term, 'sqlite').limit(limit)),
+        ('fts date', search_query(1, term, 'sqlite', sort_by='date').limit(limit)),
+    ]
+
+def count_queries(term):
+    return [
+        ('like', select(func.count()).select_from(Expenses).where(Expenses.description.like(like_pattern(term)))),
+        ('fts', select(func.count()).select_from(search_table).where(fts5_match(parse_search(term)))),
+    ]
+
+def best_time(statement, repeat):
+    elapsed = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = db.session.execute(statement).all()
+        elapsed = min(elapsed or float('inf'), time.perf_counter() - started)
+    return elapsed, result
+
+def executemany(rows):
+    db.session.execute(insert(Expenses.__table__), rows)
+
+def time_writes(rows, count, users, categories=20, batch=1000):
+    results = []
+    for triggers, prepare in [('with', lambda: None), ('without', drop_triggers)]:
+        prepare()
+        for name, insert_rows in [('executemany', executemany), ('insert_expenses', insert_expenses)]:
+            started = time.perf_counter()
+            for offset in range(rows, rows + count, batch):
+                insert_rows(expense_rows(offset, min(offset + batch, rows + count), users, categories))
+                db.session.commit()
+            results.append((name, triggers, time.perf_counter() - started))
+            db.session.execute(Expenses.__table__.delete().where(Expenses.id > rows))
+            db.session.commit()
+    create_triggers()
+    db.session.commit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--term', action='append', help='Repeatable (default: %s).' % ', '.join(TERMS))
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--writes', type=int, default=50000, help='Rows inserted to time the triggers.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        class BenchmarkConfig(ProductionConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'search.db')
+            NOTIFICATION_WORKERS = 0
+            SCHEDULER_THREAD = False
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            indexed = seed(args.rows, args.users)
+            print(f"Seeded {args.rows:,} expenses in {time.perf_counter() - started:.1f}s, indexed in {indexed:.1f}s",
+                  file=sys.stderr)
+
+            print(f"{'term':<16} {'scope':<10} {'method':<9} {'ms':>9} {'rows':>8} {'vs like':>8}")
+            for term in args.term or TERMS:
+                for scope, queries in [(f'user, {args.limit}', user_queries(term, args.limit)), ('all, count', count_queries(term))]:
+                    baseline = None
+                    for name, statement in queries:
+                        elapsed, result = best_time(statement, args.repeat)
+                        baseline = baseline or elapsed
+                        found = result[0][0] if scope == 'all, count' else len(result)
+                        print(f"{term:<16} {scope:<10} {name:<9} {elapsed * 1000:>9.2f} {found:>8} {baseline / elapsed:>7.1f}x")
+
+            print()
+            print(f"{'inserts':<16} {'triggers':<9} {'seconds':>8} {'rows/s':>10}")
+            for name, triggers, elapsed in time_writes(args.rows, args.writes, args.users):
+                print(f"{name:<16} {triggers:<9} {elapsed:>8.2f} {args.writes / elapsed:>10,.0f}")
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
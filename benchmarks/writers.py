@@ -0,0 +1,119 @@
+"""
+Concurrent writer benchmark for the SQLite database profiles.
+
+Runs --writers threads that each add one expense per transaction (like
+POST /add_expense), one thread inserting 500-row batches (like the recurring
+job) and --readers threads paging through /expenses, all against a fresh
+database file, for --seconds per profile. Reports committed writes and reads
+per second and how many transactions failed with "database is locked".
+
+    python benchmarks/writers.py --writers 8 --seconds 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.config import Config, ProductionConfig
+from app.models import User, Category, Expenses
+from app.utils import expenses_query
+
+PROFILES = {'default': Config, 'production': ProductionConfig}
+
+
+def seed(users=50):
+    db.session.execute(insert(User.__table__), [
+        {'email': f'user{n}@example.com', 'user_name': f'user{n}', 'is_admin': False} for n in range(users)
+    ])
+    db.session.execute(insert(Category.__table__), [{'name': f'Category {n}'} for n in range(10)])
+    db.session.commit()
+
+
+def worker(app, stop, stats, kind, n):
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            try:
+                if kind == 'write':
+                    db.session.add(Expenses(amount=10.0 + i % 90, description=f'Writer {n} #{i}', date=start + timedelta(minutes=i),
+                                            user_id=1 + (n + i) % 50, category_id=1 + i % 10))
+                    db.session.commit()
+                    done = 1
+                elif kind == 'batch':
+                    db.session.execute(insert(Expenses.__table__), [
+                        {'amount_minor': 2500, 'description': 'Recurring', 'date': start + timedelta(days=j % 365),
+                         'user_id': 1 + j % 50, 'category_id': 1 + j % 10}
+                        for j in range(500)
+                    ])
+                    db.session.commit()
+                    done = 500
+                else:
+                    db.session.execute(expenses_query(1 + (n + i) % 50).limit(50)).all()
+                    db.session.rollback()
+                    done = 1
+            except OperationalError:
+                db.session.rollback()
+                stats[kind + '_errors'] += 1
+                continue
+            finally:
+                db.session.remove()
+            stats[kind] += done
+
+
+def run(profile, config_class, args, tmpdir):
+    class BenchmarkConfig(config_class):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, f'{profile}.db')
+        NOTIFICATION_WORKERS = 0
+        SCHEDULER_THREAD = False
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        seed()
+        db.session.remove()
+
+    stats = {key: 0 for key in ('write', 'write_errors', 'batch', 'batch_errors', 'read', 'read_errors')}
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker, args=(app, stop, stats, 'write', n)) for n in range(args.writers)]
+    threads += [threading.Thread(target=worker, args=(app, stop, stats, 'read', n)) for n in range(args.readers)]
+    threads.append(threading.Thread(target=worker, args=(app, stop, stats, 'batch', 0)))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        db.engine.dispose()
+
+    errors = stats['write_errors'] + stats['batch_errors'] + stats['read_errors']
+    print(f"{profile:<11} {stats['write'] / args.seconds:>10,.0f} {stats['batch'] / args.seconds:>12,.0f} "
+          f"{stats['read'] / args.seconds:>9,.0f} {errors:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profile', choices=list(PROFILES), action='append', help='Profiles to run (default: all).')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"{'profile':<11} {'writes/s':>10} {'batch rows/s':>12} {'reads/s':>9} {'locked':>8}")
+        for profile in args.profile or PROFILES:
+            run(profile, PROFILES[profile], args, tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""add category token index
+
+Revision ID: a3e9c27d5b18
+Revises: f2c8a6d40e19
+Create Date: 2026-10-18 23:58:41.117302
+
+"""
+import re
+import zlib
+from collections import Counter
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e9c27d5b18'
+down_revision = 'f2c8a6d40e19'
+branch_labels = None
+depends_on = None
+
+# Same features as app/categorizer.py at the time of this migration
+WORD = re.compile(r'[^\W\d_]{2,}')
+
+
+def features(description):
+    words = WORD.findall(description.casefold())
+    found = {zlib.crc32(word.encode()) for word in words}
+    if words:
+        found.add(zlib.crc32(('>' + ' '.join(words[:2])).encode()))
+    return found
+
+
+def upgrade():
+    category_token = op.create_table('category_token',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('feature', sa.BigInteger(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'feature', 'category_id'),
+    sqlite_with_rowid=False,
+    )
+
+    # Learn from every existing expense, the way `flask categorizer rebuild` does
+    counts = Counter()
+    for user_id, category_id, description in op.get_bind().execute(
+        sa.text('SELECT user_id, category_id, description FROM expenses')
+    ):
+        for feature in features(description):
+            counts[user_id, feature, category_id] += 1
+    op.bulk_insert(category_token, [
+        {'user_id': user_id, 'feature': feature, 'category_id': category_id, 'count': count}
+        for (user_id, feature, category_id), count in counts.items()
+    ])
+
+
+def downgrade():
+    op.drop_table('category_token')
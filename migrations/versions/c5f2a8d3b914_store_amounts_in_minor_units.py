@@ -0,0 +1,98 @@
+"""store amounts in minor units
+
+Revision ID: c5f2a8d3b914
+Revises: a84c1d6e3f05
+Create Date: 2026-10-18 17:24:10.481376
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f2a8d3b914'
+down_revision = 'a84c1d6e3f05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Every amount so far was in pounds
+    for table in ('expenses', 'recurring_expense'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('amount_minor', sa.BigInteger(), nullable=True))
+            batch_op.add_column(sa.Column('currency', sa.String(length=3), nullable=True))
+        op.execute(f"UPDATE {table} SET amount_minor = CAST(ROUND(amount * 100) AS BIGINT), currency = 'GBP'")
+
+    with op.batch_alter_table('expenses', schema=None) as batch_op:
+        batch_op.drop_index('ix_expenses_user_id_amount')
+        batch_op.drop_column('amount')
+        batch_op.alter_column('amount_minor', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.alter_column('currency', existing_type=sa.String(length=3), nullable=False)
+        batch_op.create_index('ix_expenses_user_id_amount_minor', ['user_id', 'amount_minor'], unique=False)
+
+    with op.batch_alter_table('recurring_expense', schema=None) as batch_op:
+        batch_op.drop_column('amount')
+        batch_op.alter_column('amount_minor', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.alter_column('currency', existing_type=sa.String(length=3), nullable=False)
+
+    with op.batch_alter_table('notification_rule', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('amount_minor', sa.BigInteger(), nullable=True))
+    op.execute('UPDATE notification_rule SET amount_minor = CAST(ROUND(amount * 100) AS BIGINT) WHERE amount IS NOT NULL')
+    with op.batch_alter_table('notification_rule', schema=None) as batch_op:
+        batch_op.drop_column('amount')
+
+    # Rollups are derived, rebuild them from the converted expenses rather than converting float totals
+    op.drop_table('expense_rollup')
+    op.create_table('expense_rollup',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('total_minor', sa.BigInteger(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('min_minor', sa.BigInteger(), nullable=False),
+    sa.Column('max_minor', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'category_id', 'year', 'month')
+    )
+    expenses = sa.table('expenses', sa.column('user_id'), sa.column('category_id'), sa.column('date', sa.DateTime()),
+                        sa.column('amount_minor', sa.BigInteger()))
+    year = sa.extract('year', expenses.c.date)
+    month = sa.extract('month', expenses.c.date)
+    op.execute(sa.table('expense_rollup', *[sa.column(name) for name in (
+        'user_id', 'category_id', 'year', 'month', 'total_minor', 'count', 'min_minor', 'max_minor')]).insert().from_select(
+        ['user_id', 'category_id', 'year', 'month', 'total_minor', 'count', 'min_minor', 'max_minor'],
+        sa.select(expenses.c.user_id, expenses.c.category_id, year, month, sa.func.sum(expenses.c.amount_minor), sa.func.count(),
+                  sa.func.min(expenses.c.amount_minor), sa.func.max(expenses.c.amount_minor))
+        .group_by(expenses.c.user_id, expenses.c.category_id, year, month),
+    ))
+
+
+def downgrade():
+    for table in ('expenses', 'recurring_expense', 'notification_rule'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('amount', sa.Float(), nullable=True))
+        op.execute(f'UPDATE {table} SET amount = amount_minor / 100.0')
+
+    with op.batch_alter_table('expenses', schema=None) as batch_op:
+        batch_op.drop_index('ix_expenses_user_id_amount_minor')
+        batch_op.drop_column('currency')
+        batch_op.drop_column('amount_minor')
+        batch_op.alter_column('amount', existing_type=sa.Float(), nullable=False)
+        batch_op.create_index('ix_expenses_user_id_amount', ['user_id', 'amount'], unique=False)
+
+    with op.batch_alter_table('recurring_expense', schema=None) as batch_op:
+        batch_op.drop_column('currency')
+        batch_op.drop_column('amount_minor')
+        batch_op.alter_column('amount', existing_type=sa.Float(), nullable=False)
+
+    with op.batch_alter_table('notification_rule', schema=None) as batch_op:
+        batch_op.drop_column('amount_minor')
+
+    with op.batch_alter_table('expense_rollup', schema=None) as batch_op:
+        batch_op.alter_column('total_minor', new_column_name='total', existing_type=sa.BigInteger(), type_=sa.Float())
+        batch_op.alter_column('min_minor', new_column_name='min_amount', existing_type=sa.BigInteger(), type_=sa.Float())
+        batch_op.alter_column('max_minor', new_column_name='max_amount', existing_type=sa.BigInteger(), type_=sa.Float())
+    op.execute('UPDATE expense_rollup SET total = total / 100.0, min_amount = min_amount / 100.0, max_amount = max_amount / 100.0')
@@ -0,0 +1,71 @@
+"""add recurring next due
+
+Revision ID: c7e4a1d9f352
+Revises: b8d4f1e6a293
+Create Date: 2026-10-19 09:26:17.408853
+
+"""
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e4a1d9f352'
+down_revision = 'b8d4f1e6a293'
+branch_labels = None
+depends_on = None
+
+# Same steps as app/recurring.py at the time of this migration
+FIXED_STEPS = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+MONTH_STEPS = {'monthly': 1, 'yearly': 12}
+
+
+def occurrence(start_date, recurrence, n):
+    if recurrence in FIXED_STEPS:
+        return start_date + FIXED_STEPS[recurrence] * n
+    return start_date + relativedelta(months=MONTH_STEPS[recurrence] * n)
+
+
+def next_due(start_date, end_date, recurrence, mark):
+    n = 0
+    if mark is not None and mark >= start_date:
+        if recurrence in FIXED_STEPS:
+            n = (mark - start_date) // FIXED_STEPS[recurrence]
+        else:
+            delta = relativedelta(mark, start_date)
+            n = (delta.years * 12 + delta.months) // MONTH_STEPS[recurrence]
+        while n > 0 and occurrence(start_date, recurrence, n - 1) > mark:
+            n -= 1
+        while occurrence(start_date, recurrence, n) <= mark:
+            n += 1
+    date = occurrence(start_date, recurrence, n)
+    return date if date <= end_date else None
+
+
+def upgrade():
+    with op.batch_alter_table('recurring_expense', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('next_due', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_recurring_expense_next_due'), ['next_due'], unique=False)
+
+    schedules = sa.table('recurring_expense', sa.column('id'), sa.column('recurrence'), sa.column('start_date', sa.DateTime()),
+                         sa.column('end_date', sa.DateTime()), sa.column('last_generated', sa.DateTime()),
+                         sa.column('next_due', sa.DateTime()))
+    connection = op.get_bind()
+    updates = [
+        {'schedule_id': row.id, 'next_due': next_due(row.start_date, row.end_date, row.recurrence, row.last_generated)}
+        for row in connection.execute(sa.select(schedules.c.id, schedules.c.recurrence, schedules.c.start_date,
+                                                schedules.c.end_date, schedules.c.last_generated))
+    ]
+    if updates:
+        connection.execute(
+            schedules.update().where(schedules.c.id == sa.bindparam('schedule_id')).values(next_due=sa.bindparam('next_due')),
+            updates,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('recurring_expense', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_recurring_expense_next_due'))
+        batch_op.drop_column('next_due')
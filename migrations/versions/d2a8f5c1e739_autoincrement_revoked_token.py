@@ -0,0 +1,28 @@
+"""autoincrement revoked token
+
+Revision ID: d2a8f5c1e739
+Revises: c7e4a1d9f352
+Create Date: 2026-10-19 10:02:44.119820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a8f5c1e739'
+down_revision = 'c7e4a1d9f352'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite only takes AUTOINCREMENT in CREATE TABLE, so the table is copied into a new one
+    with op.batch_alter_table('revoked_token', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+
+def downgrade():
+    with op.batch_alter_table('revoked_token', schema=None, recreate='always') as batch_op:
+        pass
@@ -0,0 +1,76 @@
+"""add fx rates and reporting currency
+
+Revision ID: e7b3d91c4a26
+Revises: c5f2a8d3b914
+Create Date: 2026-10-18 21:06:42.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3d91c4a26'
+down_revision = 'c5f2a8d3b914'
+branch_labels = None
+depends_on = None
+
+
+def rebuild_rollups(by_currency):
+    """Recreate expense_rollup from expenses, keyed by currency or not."""
+    currency = [sa.Column('currency', sa.String(length=3), nullable=False)] if by_currency else []
+    op.drop_table('expense_rollup')
+    op.create_table('expense_rollup',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    *currency,
+    sa.Column('total_minor', sa.BigInteger(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('min_minor', sa.BigInteger(), nullable=False),
+    sa.Column('max_minor', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'category_id', 'year', 'month', *(['currency'] if by_currency else []))
+    )
+    expenses = sa.table('expenses', sa.column('user_id'), sa.column('category_id'), sa.column('date', sa.DateTime()),
+                        sa.column('currency'), sa.column('amount_minor', sa.BigInteger()))
+    keys = [expenses.c.user_id, expenses.c.category_id, sa.extract('year', expenses.c.date), sa.extract('month', expenses.c.date)]
+    if by_currency:
+        keys.append(expenses.c.currency)
+    names = ['user_id', 'category_id', 'year', 'month', *(['currency'] if by_currency else []),
+             'total_minor', 'count', 'min_minor', 'max_minor']
+    op.execute(sa.table('expense_rollup', *[sa.column(name) for name in names]).insert().from_select(
+        names,
+        sa.select(*keys, sa.func.sum(expenses.c.amount_minor), sa.func.count(),
+                  sa.func.min(expenses.c.amount_minor), sa.func.max(expenses.c.amount_minor)).group_by(*keys),
+    ))
+
+
+def upgrade():
+    op.create_table('fx_rate',
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('rate', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('currency', 'day')
+    )
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reporting_currency', sa.String(length=3), nullable=True))
+    op.execute("UPDATE \"user\" SET reporting_currency = 'GBP'")
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('reporting_currency', existing_type=sa.String(length=3), nullable=False)
+
+    # Rollups are derived, rebuild them with one row per currency
+    rebuild_rollups(by_currency=True)
+
+
+def downgrade():
+    # Totals in different currencies get added up again, as they were before
+    rebuild_rollups(by_currency=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('reporting_currency')
+
+    op.drop_table('fx_rate')
@@ -0,0 +1,53 @@
+"""add expense search index
+
+Revision ID: f2c8a6d40e19
+Revises: e7b3d91c4a26
+Create Date: 2026-10-18 23:12:05.604218
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8a6d40e19'
+down_revision = 'e7b3d91c4a26'
+branch_labels = None
+depends_on = None
+
+# Same statements as app/search.py. A batch_alter_table on expenses recreates the table on SQLite and
+# drops these triggers, so a later migration doing that has to create them again and rebuild.
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE expense_search USING fts5("
+    "description, user_id, content='expenses', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER expense_search_insert AFTER INSERT ON expenses BEGIN "
+    "INSERT INTO expense_search(rowid, description, user_id) VALUES (new.id, new.description, new.user_id); END",
+    "CREATE TRIGGER expense_search_delete AFTER DELETE ON expenses BEGIN "
+    "INSERT INTO expense_search(expense_search, rowid, description, user_id) "
+    "VALUES ('delete', old.id, old.description, old.user_id); END",
+    "CREATE TRIGGER expense_search_update AFTER UPDATE OF description, user_id ON expenses BEGIN "
+    "INSERT INTO expense_search(expense_search, rowid, description, user_id) "
+    "VALUES ('delete', old.id, old.description, old.user_id); "
+    "INSERT INTO expense_search(rowid, description, user_id) VALUES (new.id, new.description, new.user_id); END",
+    # Index every existing description in one pass
+    "INSERT INTO expense_search(expense_search) VALUES ('rebuild')",
+]
+SQLITE_DOWNGRADE = [
+    'DROP TRIGGER expense_search_update',
+    'DROP TRIGGER expense_search_delete',
+    'DROP TRIGGER expense_search_insert',
+    'DROP TABLE expense_search',
+]
+POSTGRESQL_UPGRADE = ["CREATE INDEX ix_expenses_description_search ON expenses USING gin (to_tsvector('simple'::regconfig, description))"]
+POSTGRESQL_DOWNGRADE = ['DROP INDEX ix_expenses_description_search']
+
+
+def upgrade():
+    statements = POSTGRESQL_UPGRADE if op.get_bind().dialect.name == 'postgresql' else SQLITE_UPGRADE
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    statements = POSTGRESQL_DOWNGRADE if op.get_bind().dialect.name == 'postgresql' else SQLITE_DOWNGRADE
+    for statement in statements:
+        op.execute(statement)
@@ -0,0 +1,1140 @@
+import asyncio
+import csv
+import importlib.util
+import io
+import json
+import math
+import os
+import tempfile
+import time
+import unittest
+from app import db, create_app
+from app.models import User, Category, Expenses, Notification, NotificationRule, Budget
+from app.config import TestingConfig
+from datetime import datetime, timedelta
+from flask_jwt_extended import create_access_token
+from app.rollups import verify_rollups
+from app.exports import read_columnar
+from app.fx import load_rates
+from app.categories import get_or_create_category_id
+from app.budgets import period_bounds, today
+from sqlalchemy import event
+
+
+class StatementCounter:
+    """Counts the SQL statements the engine runs inside the with block."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self.record)
+
+class ExpensesEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        self.food = Category(name="Food")
+        self.travel = Category(name="Travel")
+        db.session.add_all([self.user, self.food, self.travel])
+        db.session.commit()
+
+        # 30 expenses over January 2024, amounts repeat so sorting by amount has ties
+        for n in range(30):
+            category = self.food if n % 2 else self.travel
+            db.session.add(Expenses(amount=float(10 + n % 7), description=f"Expense {n}", date=datetime(2024, 1, 1) + timedelta(days=n), user_id=self.user.id, category_id=category.id))
+        db.session.commit()
+
+        token = create_access_token(identity=str(self.user.id))
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, query_string, **kwargs):
+        return self.client.get("/expenses" + query_string, headers={**self.headers, **kwargs})
+
+    def walk_pages(self, query_string):
+        expenses, cursor, pages = [], None, 0
+        while True:
+            response = self.get(query_string + (f"&cursor={cursor}" if cursor else ""))
+            self.assertEqual(response.status_code, 200)
+            expenses += response.get_json()
+            pages += 1
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return expenses, pages
+
+    def test_filter_by_category_and_date_range(self):
+        """Test that category and inclusive date range filters are applied."""
+        response = self.get("?category=Food&start_date=2024-01-05&end_date=2024-01-15")
+        self.assertEqual(response.status_code, 200)
+        expenses = response.get_json()
+        self.assertEqual(len(expenses), 5)
+        for expense in expenses:
+            self.assertEqual(expense['category'], 'Food')
+            self.assertTrue("2024-01-05" <= expense['date'] <= "2024-01-15")
+
+    def test_pages_cover_every_row_once(self):
+        """Test that following the cursor visits every expense exactly once, in order."""
+        for sort_by, order in [("amount", "asc"), ("amount", "desc"), ("date", "asc"), ("date", "desc")]:
+            expenses, pages = self.walk_pages(f"?sort_by={sort_by}&order={order}&limit=7")
+            self.assertEqual(pages, 5)
+            self.assertEqual(sorted(e['expense_id'] for e in expenses), list(range(1, 31)))
+            keys = [(e[sort_by], e['expense_id']) for e in expenses]
+            self.assertEqual(keys, sorted(keys, reverse=(order == "desc")))
+
+    def test_limit_is_capped(self):
+        """Test that a limit above EXPENSES_MAX_PAGE_SIZE is clamped."""
+        self.app.config['EXPENSES_MAX_PAGE_SIZE'] = 10
+        response = self.get("?limit=1000")
+        self.assertEqual(len(response.get_json()), 10)
+        self.assertIn("X-Next-Cursor", response.headers)
+
+    def test_invalid_parameters(self):
+        """Test that bad dates, sort options, limits and cursors are rejected."""
+        cursor = self.get("?limit=5").headers["X-Next-Cursor"]
+        for query_string in ["?start_date=01-01-2024", "?sort_by=invalid_field", "?sort_by=", "?order=invalid_order",
+                             "?limit=0", "?limit=abc", "?cursor=not-a-cursor", f"?sort_by=amount&cursor={cursor}"]:
+            self.assertEqual(self.get(query_string).status_code, 400, query_string)
+
+    def test_ndjson_stream(self):
+        """Test that the NDJSON mode streams one expense per line after the cursor."""
+        cursor = self.get("?sort_by=date&order=asc&limit=10").headers["X-Next-Cursor"]
+        response = self.get(f"?sort_by=date&order=asc&format=ndjson&cursor={cursor}")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([e['expense_id'] for e in lines], list(range(11, 31)))
+
+        response = self.get("?category=Travel", Accept="application/x-ndjson")
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 15)
+
+    def test_rollups(self):
+        """Test that the monthly rollups are served per category."""
+        response = self.client.get("/expenses/rollups?year=2024&month=1", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        rollups = {r['category']: r for r in response.get_json()}
+        self.assertEqual(rollups['Food']['count'] + rollups['Travel']['count'], 30)
+        self.assertEqual(sum(r['total'] for r in rollups.values()), sum(10 + n % 7 for n in range(30)))
+        self.assertEqual(self.client.get("/expenses/rollups?month=13", headers=self.headers).status_code, 400)
+
+    def summary(self, query_string):
+        response = self.client.get("/expenses/summary" + query_string, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_summary_by_category(self):
+        """Test totals, averages and nearest-rank percentiles per category."""
+        summary = self.summary("?group_by=category")
+        self.assertEqual(summary['count'], 30)
+        self.assertEqual(summary['total'], sum(10 + n % 7 for n in range(30)))
+        for group in summary['groups']:
+            amounts = sorted(float(10 + n % 7) for n in range(30) if (n % 2 == 1) == (group['category'] == 'Food'))
+            self.assertEqual(group['count'], len(amounts))
+            self.assertEqual(group['total'], sum(amounts))
+            self.assertEqual(group['average'], round(sum(amounts) / len(amounts), 2))
+            self.assertEqual(group['p50'], amounts[math.ceil(0.5 * len(amounts)) - 1])
+            self.assertEqual(group['p90'], amounts[math.ceil(0.9 * len(amounts)) - 1])
+
+    def test_summary_by_period_with_filters(self):
+        """Test period buckets, including weeks named by their Monday, and the /expenses filters."""
+        weeks = self.summary("?group_by=week&start_date=2024-01-01&end_date=2024-01-14")['groups']
+        self.assertEqual([(g['period'], g['count']) for g in weeks], [("2024-01-01", 7), ("2024-01-08", 7)])
+
+        groups = self.summary("?group_by=category,day&category=Food&start_date=2024-01-05&end_date=2024-01-15")['groups']
+        self.assertEqual(len(groups), 5)
+        self.assertTrue(all(g['category'] == 'Food' and g['count'] == 1 for g in groups))
+        self.assertEqual(self.summary("?group_by=month")['groups'][0]['period'], "2024-01")
+        self.assertEqual(self.summary("?group_by=year")['groups'][0]['period'], "2024")
+
+    def test_summary_is_conditional(self):
+        """Test that an unchanged summary answers If-None-Match with 304."""
+        response = self.client.get("/expenses/summary?group_by=month", headers=self.headers)
+        self.assertIn("private", response.headers["Cache-Control"])
+        etag = response.headers["ETag"]
+        response = self.client.get("/expenses/summary?group_by=month", headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_summary_invalid_parameters(self):
+        """Test that unknown or conflicting group_by keys are rejected."""
+        for query_string in ["?group_by=hour", "?group_by=day,month", "?group_by=category,category", "?start_date=2024/01/01"]:
+            response = self.client.get("/expenses/summary" + query_string, headers=self.headers)
+            self.assertEqual(response.status_code, 400, query_string)
+
+    def test_requires_token(self):
+        """Test that the endpoint is not reachable without a JWT."""
+        self.assertEqual(self.client.get("/expenses").status_code, 401)
+
+class LogoutEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Two apps on one database file stand in for two gunicorn workers
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = type('SharedConfig', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.tmpdir.name, 'app.db'),
+            'TOKEN_REVOCATION_SYNC_SECONDS': 0,
+        })
+        self.apps = [create_app(config), create_app(config)]
+        with self.apps[0].app_context():
+            db.create_all()
+            user = User(user_name="testuser", email="test@example.com")
+            user.set_password("securepassword")
+            db.session.add(user)
+            db.session.commit()
+            token = create_access_token(identity=str(user.id))
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def tearDown(self):
+        with self.apps[0].app_context():
+            db.drop_all()
+        for app in self.apps:
+            with app.app_context():
+                db.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def test_logout_revokes_token_on_every_worker(self):
+        """Test that a token logged out on one app is rejected by the other."""
+        first, second = (app.test_client() for app in self.apps)
+        self.assertEqual(second.get("/expenses", headers=self.headers).status_code, 200)
+        self.assertEqual(first.post("/logout", headers=self.headers).status_code, 200)
+        self.assertEqual(first.get("/expenses", headers=self.headers).status_code, 401)
+        self.assertEqual(second.get("/expenses", headers=self.headers).status_code, 401)
+
+class ImportEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add_all([self.user, Category(name="Food")])
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, body, content_type, query_string=""):
+        return self.client.post("/expenses/import" + query_string, data=body, content_type=content_type, headers=self.headers)
+
+    def test_csv_import_reports_bad_rows(self):
+        """Test that valid CSV rows are inserted in batches and invalid ones reported by line."""
+        body = "\n".join([
+            "category,description,date,amount",
+            "Food,Lunch,2024-01-02,12.5",
+            "Food,Dinner,2024-01-02,-3",
+            "Travel,Train,2024-01-03,40",
+            "Food,Snack,not-a-date,2",
+            "Food,,2024-01-04,2",
+            "Travel,Taxi,2024-01-05,18",
+        ])
+        response = self.post(body, "text/csv", "?batch_size=2")
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual(report['imported'], 3)
+        self.assertEqual(report['failed'], 3)
+        self.assertEqual([e['line'] for e in report['errors']], [3, 5, 6])
+        self.assertFalse(report['errors_truncated'])
+        self.assertEqual(Expenses.query.filter_by(user_id=self.user.id).count(), 3)
+        self.assertEqual(Category.query.filter_by(name="Travel").count(), 1)
+        self.assertEqual(verify_rollups(), [])
+
+    def test_csv_import_without_category_column(self):
+        """Test that rows without a category are categorized from the user's earlier imports."""
+        self.post("category,description,date,amount\nFood,Tesco Express,2024-01-02,12.5\n", "text/csv")
+        report = self.post("description,date,amount\nTesco Express,2024-01-03,8\nParking,2024-01-03,3\n", "text/csv").get_json()
+        self.assertEqual((report['imported'], report['categorized'], report['failed']), (2, 1, 0))
+        names = dict(db.session.query(Expenses.description, Category.name).join(Category).filter(Expenses.date >= datetime(2024, 1, 3)))
+        self.assertEqual(names, {"Tesco Express": "Food", "Parking": "Uncategorized"})
+
+    def test_ndjson_import(self):
+        """Test that NDJSON bodies are imported line by line."""
+        lines = [json.dumps({"category": "Food", "description": f"Item {n}", "date": "2024-02-01", "amount": n + 1}) for n in range(5)]
+        lines.insert(2, "{not json")
+        response = self.post("\n".join(lines) + "\n", "application/x-ndjson")
+        report = response.get_json()
+        self.assertEqual((report['imported'], report['failed']), (5, 1))
+        self.assertEqual(report['errors'][0]['line'], 3)
+        self.assertEqual(db.session.query(db.func.sum(Expenses.amount_minor)).scalar(), 1500)
+
+    def test_unreadable_file_returns_partial_report(self):
+        """Test that a decoding error partway through reports the rows already imported and where it stopped."""
+        body = ("category,description,date,amount\n" + "Food,Lunch,2024-01-02,12.5\n" * 2000).encode() + b"Food,\xff\xfe,2024-01-02,1\n"
+        response = self.post(body, "text/csv", "?batch_size=100")
+        self.assertEqual(response.status_code, 400)
+        report = response.get_json()
+        self.assertFalse(report['complete'])
+        self.assertGreater(report['imported'], 0)
+        self.assertEqual(Expenses.query.count(), report['imported'])
+        # Line 1 is the header, so the first line not imported comes right after the imported rows
+        self.assertEqual(report['errors'][-1]['line'], report['imported'] + 2)
+        self.assertIn("Could not read the file", report['errors'][-1]['message'])
+
+    def test_error_list_is_capped(self):
+        """Test that the error report stops growing at IMPORT_MAX_ERRORS."""
+        self.app.config['IMPORT_MAX_ERRORS'] = 2
+        report = self.post("category,description,date,amount\n" + "Food,x,2024-01-01,0\n" * 5, "text/csv").get_json()
+        self.assertEqual((report['failed'], len(report['errors']), report['errors_truncated']), (5, 2, True))
+
+    def test_unsupported_content_type(self):
+        """Test that only CSV and NDJSON bodies are accepted."""
+        self.assertEqual(self.post("{}", "application/json").status_code, 415)
+        self.assertEqual(self.post("", "text/csv", "?batch_size=0").status_code, 400)
+
+class ExportEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app.config['EXPORT_CHUNK_SIZE'] = 4
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        self.admin = User(user_name="admin", email="admin@example.com", is_admin=True)
+        self.admin.set_password("securepassword")
+        food = Category(name="Food")
+        db.session.add_all([self.user, self.admin, food])
+        db.session.commit()
+        for n in range(10):
+            owner = self.user if n < 7 else self.admin
+            db.session.add(Expenses(amount=n + 0.25, description=f"Lunch, part {n}", date=datetime(2024, 3, 1, 12, 30) + timedelta(days=n), user_id=owner.id, category_id=food.id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def export(self, user, query_string):
+        headers = {"Authorization": f"Bearer {create_access_token(identity=str(user.id))}"}
+        return self.client.get("/expenses/export" + query_string, headers=headers)
+
+    def test_csv_and_ndjson_exports(self):
+        """Test that CSV and NDJSON exports hold exactly the caller's expenses."""
+        response = self.export(self.user, "?format=csv")
+        self.assertEqual(response.mimetype, "text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual([int(r['expense_id']) for r in rows], list(range(1, 8)))
+        self.assertEqual(rows[0]['description'], "Lunch, part 0")
+        self.assertEqual(rows[0]['date'], "2024-03-01")
+
+        lines = self.export(self.user, "?format=ndjson").get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['amount'] for line in lines], [n + 0.25 for n in range(7)])
+
+    def test_columnar_export_round_trips(self):
+        """Test that the columnar export reads back to the same values, one row group per chunk."""
+        groups = list(read_columnar(io.BytesIO(self.export(self.admin, "?format=columnar&all=true").get_data())))
+        self.assertEqual([len(g['expense_id']) for g in groups], [4, 4, 2])
+        self.assertEqual(sum((g['user_name'] for g in groups), []), ["testuser"] * 7 + ["admin"] * 3)
+        self.assertEqual(groups[0]['date'][1], datetime(2024, 3, 2, 12, 30))
+        self.assertEqual(groups[2]['amount_minor'], [825, 925])
+        self.assertEqual(groups[2]['currency'], ['GBP', 'GBP'])
+
+    def test_all_users_is_admin_only(self):
+        """Test that only admins may export every user's expenses."""
+        self.assertEqual(self.export(self.user, "?all=true").status_code, 403)
+        self.assertEqual(self.export(self.user, "?format=xml").status_code, 400)
+        # A valid token for a user that has been deleted since
+        headers = {"Authorization": f"Bearer {create_access_token(identity='999')}"}
+        self.assertEqual(self.client.get("/expenses/export?all=true", headers=headers).status_code, 403)
+
+    def test_export_command(self):
+        """Test that the CLI export streams to a file."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "expenses.ndjson")
+            result = self.app.test_cli_runner().invoke(args=["expenses", "export", "--format", "ndjson", "--user", "admin", "--output", path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 3)
+
+class AddExpenseEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # A real worker thread needs a database it can reach from another connection
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = type('WorkerConfig', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.tmpdir.name, 'app.db'),
+            'NOTIFICATION_WORKERS': 1,
+        })
+        self.app = create_app(config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add(self.user)
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.tmpdir.cleanup()
+
+    def post(self, **data):
+        return self.client.post("/add_expense", json=data, headers=self.headers)
+
+    def test_add_expense_and_background_notification(self):
+        """Test that the expense commits and the worker delivers the large-expense notification."""
+        response = self.post(type_expense="Furniture", description_expense="New sofa set", date_purchase="2024-08-19", amount=7500.0)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Expenses.query.count(), 1)
+
+        deadline = time.monotonic() + 5
+        while Notification.query.count() == 0 and time.monotonic() < deadline:
+            db.session.remove()
+            time.sleep(0.05)
+        self.assertIn("7500.0", Notification.query.one().message)
+
+    def test_invalid_expense(self):
+        """Test that missing fields and invalid values are rejected."""
+        self.assertEqual(self.post(type_expense="Food", description_expense="Lunch", date_purchase="2024-08-19").status_code, 400)
+        self.assertEqual(self.post(type_expense="Food", description_expense="Lunch", date_purchase="19-08-2024", amount=5).status_code, 400)
+        self.assertEqual(self.post(type_expense="Food", description_expense="Lunch", date_purchase="2024-08-19", amount=-5).status_code, 400)
+        self.assertEqual(self.post(type_expense="Food", description_expense="Lunch", date_purchase="2024-08-19", amount="a lot").status_code, 400)
+        self.assertEqual(Expenses.query.count(), 0)
+
+    def test_add_expense_without_type_is_categorized(self):
+        """Test that an expense without type_expense gets the category of similar past expenses, or the default."""
+        self.post(type_expense="Transport", description_expense="Uber trip", date_purchase="2024-08-19", amount=12)
+        response = self.post(description_expense="UBER trip home", date_purchase="2024-08-20", amount=9)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()["category"], "Transport")
+        response = self.post(description_expense="Vet visit", date_purchase="2024-08-20", amount=40)
+        self.assertEqual(response.get_json()["category"], "Uncategorized")
+        self.assertEqual(db.session.get(Expenses, response.get_json()["expense_id"]).category.name, "Uncategorized")
+
+
+class RulesEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add(self.user)
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, **data):
+        return self.client.post("/rules", json=data, headers=self.headers)
+
+    def test_add_list_and_delete_rules(self):
+        """Test the rule lifecycle through the API."""
+        response = self.post(kind="category_budget", category="Food", amount=400)
+        self.assertEqual(response.status_code, 201)
+        rule = response.get_json()
+        self.assertEqual(rule["category"], "Food")
+        self.assertEqual(self.post(kind="rolling_limit", window_days=7, amount=300).status_code, 201)
+
+        rules = self.client.get("/rules", headers=self.headers).get_json()
+        self.assertEqual([r["kind"] for r in rules], ["category_budget", "rolling_limit"])
+
+        self.assertEqual(self.client.delete(f"/rules/{rule['rule_id']}", headers=self.headers).status_code, 204)
+        self.assertEqual(self.client.delete(f"/rules/{rule['rule_id']}", headers=self.headers).status_code, 404)
+        self.assertEqual(NotificationRule.query.count(), 1)
+
+    def test_invalid_rules(self):
+        """Test that each kind's required fields are checked."""
+        self.assertEqual(self.post(kind="unknown", amount=5).status_code, 400)
+        self.assertEqual(self.post(kind="threshold").status_code, 400)
+        self.assertEqual(self.post(kind="category_budget", amount=5).status_code, 400)
+        self.assertEqual(self.post(kind="rolling_limit", amount=5, window_days=0).status_code, 400)
+        self.assertEqual(self.post(kind="anomaly", factor=-1).status_code, 400)
+        self.assertEqual(NotificationRule.query.count(), 0)
+
+
+class RegisterEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, **data):
+        return self.client.post("/register", json=data)
+
+    def test_register_then_login(self):
+        """Test that a registered user can log in."""
+        response = self.post(username="new_user", email="new@example.com", password="validPassword123")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json(), {"message": "User registered successfully"})
+        response = self.client.post("/login", json={"email": "new@example.com", "password": "validPassword123"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_duplicates(self):
+        """Test that a taken email or username gets 409."""
+        self.post(username="new_user", email="new@example.com", password="validPassword123")
+        self.assertEqual(self.post(username="other", email="new@example.com", password="validPassword123").status_code, 409)
+        self.assertEqual(self.post(username="new_user", email="other@example.com", password="validPassword123").status_code, 409)
+
+    def test_validation(self):
+        """Test that missing, malformed and oversized fields get 400."""
+        for data in [{}, {"username": "", "email": "", "password": "validPassword123"},
+                     {"username": "new_user", "email": "invalidemail", "password": "validPassword123"},
+                     {"username": "new_user", "email": "new@example.com", "password": "short"},
+                     {"username": "'; DROP TABLE users; --", "email": "new@example.com", "password": "validPassword123"},
+                     {"username": "a" * 256, "email": "a" * 256 + "@example.com", "password": "validPassword123"}]:
+            self.assertEqual(self.post(**data).status_code, 400, data)
+        self.assertEqual(User.query.count(), 0)
+
+class LoginEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, **data):
+        return self.client.post("/login", json=data)
+
+    def test_valid_login(self):
+        """Test that a login returns a token that works on protected endpoints."""
+        response = self.post(email="  test@example.com ", password="securepassword")
+        self.assertEqual(response.status_code, 200)
+        token = response.get_json()["access_token"]
+        self.assertEqual(self.client.get("/rules", headers={"Authorization": f"Bearer {token}"}).status_code, 200)
+
+    def test_invalid_login(self):
+        """Test missing fields, bad emails and wrong credentials."""
+        self.assertEqual(self.post(email="test@example.com").status_code, 400)
+        self.assertEqual(self.post(email="' OR 1=1 --", password="anything").status_code, 400)
+        self.assertEqual(self.post(email="a" * 256 + "@example.com", password="anything").status_code, 400)
+        self.assertEqual(self.post(email="test@example.com", password="wrongpassword").status_code, 401)
+        self.assertEqual(self.post(email="nobody@example.com", password="securepassword").status_code, 401)
+
+    def test_account_lock(self):
+        """Test that the fifth failure locks the account before the password is even checked."""
+        statuses = [self.post(email="test@example.com", password="wrongpassword").status_code for _ in range(5)]
+        self.assertEqual(statuses, [401, 401, 401, 401, 423])
+
+        hasher = self.app.extensions['password_hasher']
+        verify, checks = hasher.verify, []
+        hasher.verify = lambda *args: checks.append(args) or verify(*args)
+        self.assertEqual(self.post(email="test@example.com", password="securepassword").status_code, 423)
+        self.assertEqual(checks, [])
+        self.assertEqual(self.app.extensions['login_limiter'].rejected["email"], 1)
+
+        # Other accounts are not affected until the client's IP limit is reached
+        self.assertEqual(self.post(email="other@example.com", password="wrongpassword").status_code, 401)
+
+    def test_ip_limit(self):
+        """Test that a client failing on many accounts is turned away with 429."""
+        self.app.extensions['login_limiter'].ip_max_failures = 3
+        statuses = [self.post(email=f"user{n}@example.com", password="wrongpassword").status_code for n in range(4)]
+        self.assertEqual(statuses, [401, 401, 401, 429])
+
+    def test_login_stats_are_admin_only(self):
+        """Test the rejected-attempt counters endpoint."""
+        token = self.post(email="test@example.com", password="securepassword").get_json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        self.assertEqual(self.client.get("/admin/login-limits", headers=headers).status_code, 403)
+        self.user.is_admin = True
+        db.session.commit()
+        response = self.client.get("/admin/login-limits", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"rejected": {}})
+
+
+class ResponseCacheEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        self.food = Category(name="Food")
+        db.session.add_all([self.user, self.food])
+        db.session.commit()
+        db.session.add(Expenses(amount=10.0, description="Lunch", date=datetime(2024, 1, 1), user_id=self.user.id, category_id=self.food.id))
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, path, **headers):
+        return self.client.get(path, headers={**self.headers, **headers})
+
+    def sneak_in_expense(self):
+        # A raw insert bypasses every hook, so the cache can't know about it
+        db.session.execute(Expenses.__table__.insert().values(amount_minor=9900, description="Hidden", date=datetime(2024, 1, 2),
+                                                              user_id=self.user.id, category_id=self.food.id))
+        db.session.commit()
+
+    def test_polls_are_served_from_cache_until_a_write(self):
+        """Test that repeated polls reuse the cached body and any write through the app invalidates it."""
+        first = self.get("/expenses?order=desc&sort_by=date")
+        self.assertEqual(len(first.get_json()), 1)
+        self.sneak_in_expense()
+        # Same parameters in another order hit the same entry
+        self.assertEqual(len(self.get("/expenses?sort_by=date&order=desc").get_json()), 1)
+
+        response = self.client.post("/add_expense", headers=self.headers, json={
+            "type_expense": "Food", "description_expense": "Dinner", "date_purchase": "2024-01-03", "amount": 20})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.get("/expenses?sort_by=date&order=desc").get_json()), 3)
+
+    def test_modify_and_delete_invalidate(self):
+        """Test that /mod_expense changes are visible on the next poll."""
+        expense_id = self.get("/expenses").get_json()[0]["expense_id"]
+        response = self.client.post("/mod_expense", headers=self.headers, json={"expense_id": expense_id, "Amount": 12.5, "Type": "Travel"})
+        self.assertEqual(response.status_code, 200)
+        expense = self.get("/expenses").get_json()[0]
+        self.assertEqual((expense["amount"], expense["category"]), (12.5, "Travel"))
+
+        response = self.client.post("/mod_expense", headers=self.headers, json={"expense_id": expense_id, "Delete": True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get("/expenses").get_json(), [])
+        self.assertEqual(self.client.post("/mod_expense", headers=self.headers, json={"expense_id": expense_id}).status_code, 400)
+
+    def test_etag_304(self):
+        """Test that an unchanged poll with If-None-Match gets 304 and no body."""
+        for path in ["/expenses", "/notifications", "/expenses/summary?group_by=month"]:
+            response = self.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("private", response.headers["Cache-Control"])
+            etag = response.headers["ETag"]
+            response = self.get(path, **{"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304, path)
+            self.assertEqual(response.get_data(), b"")
+
+        etag = self.get("/notifications").headers["ETag"]
+        db.session.add(Notification(user_id=self.user.id, message="Budget exceeded", type="category_budget"))
+        db.session.commit()
+        response = self.get("/notifications", **{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[0]["message"], "Budget exceeded")
+
+    def test_disabled_cache(self):
+        """Test that RESPONSE_CACHE_BACKEND = None serves every request fresh."""
+        self.app.extensions['response_cache'] = None
+        self.get("/expenses")
+        self.sneak_in_expense()
+        response = self.get("/expenses")
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertNotIn("ETag", response.headers)
+
+
+class NotificationsEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.other = User(user_name="otheruser", email="other@example.com")
+        db.session.add_all([self.user, self.other])
+        db.session.commit()
+        for user in (self.user, self.other):
+            db.session.add_all([Notification(user_id=user.id, message=f"Notification {n}", type="info",
+                                             created_at=datetime(2024, 1, 1) + timedelta(hours=n)) for n in range(5)])
+        db.session.commit()
+        self.ids = [n.id for n in Notification.query.filter_by(user_id=self.user.id).order_by(Notification.id)]
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_cursor_pagination(self):
+        """Test that X-Next-Cursor walks the feed newest first and is absent on the last page."""
+        first = self.client.get("/notifications?limit=3", headers=self.headers)
+        self.assertEqual([n["message"] for n in first.get_json()], ["Notification 4", "Notification 3", "Notification 2"])
+        cursor = first.headers["X-Next-Cursor"]
+        second = self.client.get(f"/notifications?limit=3&cursor={cursor}", headers=self.headers)
+        self.assertEqual([n["message"] for n in second.get_json()], ["Notification 1", "Notification 0"])
+        self.assertNotIn("X-Next-Cursor", second.headers)
+        self.assertEqual(self.client.get("/notifications?cursor=abc", headers=self.headers).status_code, 400)
+
+    def test_mark_read(self):
+        """Test that a range is marked read for this user only and the badge and feed follow."""
+        self.assertEqual(self.client.get("/notifications/unread_count", headers=self.headers).get_json(), {"unread": 5})
+        self.client.get("/notifications?unread=true", headers=self.headers)
+        response = self.client.post("/notifications/mark_read", headers=self.headers, json={"to_id": self.ids[2]})
+        self.assertEqual(response.get_json(), {"marked_read": 3, "unread": 2})
+        unread = self.client.get("/notifications?unread=true", headers=self.headers).get_json()
+        self.assertEqual([n["message"] for n in unread], ["Notification 4", "Notification 3"])
+
+        # The other user's ids in the range are left alone
+        response = self.client.post("/notifications/mark_read", headers=self.headers, json={"from_id": 1, "to_id": 10 ** 6})
+        self.assertEqual(response.get_json(), {"marked_read": 2, "unread": 0})
+        self.assertEqual(Notification.query.filter_by(user_id=self.other.id, is_read=False).count(), 5)
+
+    def test_mark_read_validation(self):
+        """Test that a missing or inverted range is rejected."""
+        for body in [{}, {"to_id": "x"}, {"from_id": 5, "to_id": 2}]:
+            response = self.client.post("/notifications/mark_read", headers=self.headers, json=body)
+            self.assertEqual(response.status_code, 400, body)
+
+class CurrencyEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add(self.user)
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def load_rates(self):
+        # Against EUR: one pound is 1.25 euros and 1.5 dollars all year
+        load_rates([(datetime(2024, 1, 1).date(), currency, rate) for currency, rate in [('GBP', 0.8), ('USD', 1.2)]], 'EUR')
+
+    def post(self, **data):
+        data = {"type_expense": "Food", "description_expense": "Lunch", "date_purchase": "2024-03-01", **data}
+        return self.client.post("/add_expense", json=data, headers=self.headers)
+
+    def summary(self, query_string=""):
+        response = self.client.get("/expenses/summary" + query_string, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_currencies_need_rates(self):
+        """Test that only the default currency is accepted until rates are loaded."""
+        self.assertEqual(self.post(amount=10, currency="USD").status_code, 400)
+        self.assertEqual(self.post(amount=10).status_code, 201)
+        self.load_rates()
+        self.assertEqual(self.post(amount=15, currency="usd").status_code, 201)
+        self.assertEqual(self.post(amount=15, currency="CHF").status_code, 400)
+        self.assertEqual([(e.currency, e.amount_minor) for e in Expenses.query.order_by(Expenses.id)], [("GBP", 1000), ("USD", 1500)])
+
+    def test_summary_in_reporting_currency(self):
+        """Test that summaries convert into ?currency= or the user's reporting currency, set through /settings."""
+        self.load_rates()
+        self.post(amount=10)
+        self.post(amount=15, currency="USD")
+        summary = self.summary()
+        self.assertEqual((summary['currency'], summary['total'], summary['groups'][0]['p90']), ("GBP", 20.0, 10.0))
+        self.assertEqual(self.summary("?currency=USD")['total'], 30.0)
+
+        response = self.client.post("/settings", json={"reporting_currency": "usd"}, headers=self.headers)
+        self.assertEqual(response.get_json(), {"reporting_currency": "USD"})
+        self.assertEqual(self.client.get("/settings", headers=self.headers).get_json(), {"reporting_currency": "USD"})
+        self.assertEqual((self.summary()['currency'], self.summary()['total']), ("USD", 30.0))
+        # Expenses without a currency are now in dollars
+        self.post(amount=3)
+        self.assertEqual(Expenses.query.order_by(Expenses.id.desc()).first().currency, "USD")
+
+        self.assertEqual(self.client.post("/settings", json={"reporting_currency": "CHF"}, headers=self.headers).status_code, 400)
+        # A valid token for a user that has been deleted since
+        headers = {"Authorization": f"Bearer {create_access_token(identity='999')}"}
+        self.assertEqual(self.client.post("/settings", json={"reporting_currency": "USD"}, headers=headers).status_code, 401)
+        self.assertEqual(self.client.get("/expenses/summary?currency=XX", headers=self.headers).status_code, 400)
+
+    def test_export_and_import(self):
+        """Test that imported rows keep their currency and exports add the converted amount."""
+        self.load_rates()
+        body = "category,description,date,amount,currency\nFood,Lunch,2024-03-01,15,USD\nFood,Dinner,2024-03-02,12.5,\n"
+        response = self.client.post("/expenses/import", data=body, content_type="text/csv", headers=self.headers)
+        self.assertEqual(response.get_json()['imported'], 2)
+
+        rows = list(csv.DictReader(io.StringIO(self.client.get("/expenses/export", headers=self.headers).get_data(as_text=True))))
+        self.assertEqual([(r['amount'], r['currency'], r['reporting_amount'], r['reporting_currency']) for r in rows],
+                         [("15.00", "USD", "10.00", "GBP"), ("12.50", "GBP", "12.50", "GBP")])
+        lines = self.client.get("/expenses/export?format=ndjson&currency=EUR", headers=self.headers).get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['reporting_amount'] for line in lines], [12.5, 15.63])
+
+    def test_conversion_statements_do_not_grow_with_rows(self):
+        """Test that converting a year of expenses costs the same statements as converting a few."""
+        self.load_rates()
+        self.app.extensions['response_cache'] = None
+        # Load the revoked token cache outside of the counted requests
+        self.summary()
+        counts = []
+        for days in (5, 366):
+            Expenses.query.delete()
+            for n in range(days):
+                db.session.add(Expenses(currency="USD", amount=n + 1, description="Lunch", date=datetime(2024, 1, 1) + timedelta(days=n),
+                                        user_id=self.user.id, category_id=get_or_create_category_id("Food")))
+            db.session.commit()
+            # A fresh converter each time, so every day is a miss
+            self.app.extensions['fx_converter'].version = None
+            with StatementCounter(db.engine) as counter:
+                self.summary("?group_by=month")
+                self.client.get("/expenses/export", headers=self.headers).get_data()
+            counts.append(len(counter.statements))
+        self.assertEqual(counts[0], counts[1])
+
+class BudgetsEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add(self.user)
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+        self.today = today().isoformat()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_expense(self, amount, category="Food"):
+        response = self.client.post("/add_expense", headers=self.headers, json={
+            "type_expense": category, "description_expense": "Shopping", "date_purchase": self.today, "amount": amount})
+        self.assertEqual(response.status_code, 201)
+
+    def test_set_budget_and_track_spend(self):
+        """Test that a new budget counts the period so far and follows later expenses."""
+        self.add_expense(120)
+        response = self.client.post("/budgets", headers=self.headers, json={"category": "Food", "amount": 400})
+        self.assertEqual(response.status_code, 201)
+        budget = response.get_json()
+        self.assertEqual((budget["period"], budget["spent"], budget["remaining"], budget["currency"]), ("monthly", 120.0, 280.0, "GBP"))
+        self.assertEqual(budget["period_start"], period_bounds('monthly', today())[0].isoformat())
+
+        self.add_expense(200)
+        self.add_expense(50, category="Travel")
+        [budget] = self.client.get("/budgets", headers=self.headers).get_json()
+        self.assertEqual((budget["spent"], budget["remaining"], budget["percent"]), (320.0, 80.0, 80.0))
+        self.app.extensions['notification_dispatcher'].drain()
+        self.assertEqual([n.message for n in Notification.query.filter_by(type="budget")],
+                         ["Monthly budget for Food at 80%: 320.00 of 400.00 GBP spent"])
+
+        # Setting it again changes the limit in place and recounts
+        response = self.client.post("/budgets", headers=self.headers, json={"category": "Food", "amount": 300, "alert_percent": 90})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.get_json()["budget_id"], response.get_json()["remaining"]), (budget["budget_id"], -20.0))
+
+        self.assertEqual(self.client.delete(f"/budgets/{budget['budget_id']}", headers=self.headers).status_code, 204)
+        self.assertEqual(self.client.get("/budgets", headers=self.headers).get_json(), [])
+        self.assertEqual(self.client.delete(f"/budgets/{budget['budget_id']}", headers=self.headers).status_code, 404)
+
+    def test_invalid_budget(self):
+        """Test that budgets need a category, a positive amount, a known period and a sane alert_percent."""
+        for data in [{"amount": 10}, {"category": "Food"}, {"category": "Food", "amount": -1},
+                     {"category": "Food", "amount": 10, "period": "daily"}, {"category": "Food", "amount": 10, "alert_percent": 150}]:
+            self.assertEqual(self.client.post("/budgets", headers=self.headers, json=data).status_code, 400, data)
+        self.assertEqual(Budget.query.count(), 0)
+
+class SearchEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add(self.user)
+        db.session.commit()
+        for n, description in enumerate(["Uber to airport", "Uber Eats", "Rent", "Coffee shop", "Uber Uber refund"] * 4):
+            db.session.add(Expenses(amount=10 + n, description=description, date=datetime(2024, 1, 1) + timedelta(days=n),
+                                    user_id=self.user.id, category_id=get_or_create_category_id("Travel" if n < 10 else "Food")))
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def search(self, query_string, status=200):
+        response = self.client.get("/expenses/search" + query_string, headers=self.headers)
+        self.assertEqual(response.status_code, status, response.get_json())
+        return response
+
+    def test_ranked_search_with_filters(self):
+        """Test that results are ranked and combine with category and date filters."""
+        expenses = self.search("?q=uber").get_json()
+        self.assertEqual(len(expenses), 12)
+        self.assertEqual({e['description'] for e in expenses[:4]}, {"Uber Uber refund"})
+        expenses = self.search("?q=uber&category=Food&start_date=2024-01-15").get_json()
+        self.assertEqual(sorted(e['date'] for e in expenses), ["2024-01-15", "2024-01-16", "2024-01-17", "2024-01-20"])
+        self.assertEqual(self.search('?q="eats uber"').get_json(), [])
+        self.assertEqual(len(self.search('?q=ub* eat*').get_json()), 4)
+
+    def test_pages_by_date(self):
+        """Test that sorting by date pages through every match with the cursor, and rank has no cursor."""
+        response = self.search("?q=uber&limit=5")
+        self.assertNotIn("X-Next-Cursor", response.headers)
+        seen, cursor = [], None
+        while True:
+            response = self.search("?q=uber&sort_by=date&order=asc&limit=5" + (f"&cursor={cursor}" if cursor else ""))
+            seen += [e['date'] for e in response.get_json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_invalid_parameters(self):
+        """Test that a missing query, bad sort options and cursors are rejected."""
+        cursor = self.search("?q=uber&sort_by=date&limit=5").headers["X-Next-Cursor"]
+        for query_string in ["", "?q=", "?q=*", "?q=uber&sort_by=description", "?q=uber&limit=0", f"?q=uber&cursor={cursor}",
+                             "?q=uber&cursor=not-a-cursor"]:
+            self.search(query_string, status=400)
+
+@unittest.skipUnless(importlib.util.find_spec("aiosqlite") and importlib.util.find_spec("greenlet"), "needs aiosqlite and greenlet")
+class AsyncReadPathTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from app.asgi import create_asgi_app
+        # The async engine opens its own connections, so the database has to be a file
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = type('AsyncConfig', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.tmpdir.name, 'app.db'),
+        })
+        self.app = create_app(config)
+        self.asgi = create_asgi_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        food, travel = Category(name="Food"), Category(name="Travel")
+        db.session.add_all([self.user, food, travel])
+        db.session.commit()
+        for n in range(6):
+            db.session.add(Expenses(amount=10.0 * (n + 1), description=f"Expense {n}", date=datetime(2024, 1 + n % 2, 1 + n),
+                                    user_id=self.user.id, category_id=(food, travel)[n % 2].id))
+        db.session.add(Notification(user_id=self.user.id, message="Budget exceeded", type="category_budget"))
+        db.session.commit()
+        self.headers = {"Authorization": f"Bearer {create_access_token(identity=str(self.user.id))}"}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.asgi.executor.shutdown()
+        self.tmpdir.cleanup()
+
+    def call(self, path, method="GET", body=b"", headers=None):
+        """Run one request through the ASGI app, returning (status, headers, body)."""
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http", "method": method, "path": path, "query_string": query.encode(), "http_version": "1.1",
+            "headers": [(name.lower().encode(), value.encode()) for name, value in {**self.headers, **(headers or {})}.items()],
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        async def run():
+            try:
+                await self.asgi(scope, receive, send)
+            finally:
+                await self.asgi.engine.dispose()
+        asyncio.run(run())
+        start = messages[0]
+        return start["status"], {name.decode(): value.decode() for name, value in start["headers"]}, \
+            b"".join(message.get("body", b"") for message in messages[1:])
+
+    def test_same_answers_as_flask(self):
+        """Test that the read endpoints answer exactly like the Flask views."""
+        self.app.extensions['response_cache'] = None
+        for path in ["/expenses?limit=2", "/expenses?category=Food&sort_by=amount&order=asc", "/expenses?category=Rent",
+                     "/expenses/summary?group_by=category,month", "/expenses/summary?category=Travel&group_by=week",
+                     "/notifications?unread=true"]:
+            expected = self.client.get(path, headers=self.headers)
+            status, headers, body = self.call(path)
+            self.assertEqual(status, 200, path)
+            self.assertEqual(json.loads(body), expected.get_json(), path)
+            self.assertEqual(headers.get("x-next-cursor"), expected.headers.get("X-Next-Cursor"), path)
+
+    def test_errors(self):
+        """Test that bad parameters, missing and revoked tokens get the Flask answers."""
+        self.assertEqual(self.call("/expenses?sort_by=description")[0], 400)
+        self.assertEqual(self.call("/expenses/summary?group_by=month,year")[0], 400)
+        status, _, body = self.call("/expenses", headers={"Authorization": ""})
+        self.assertEqual(status, 401)
+        self.assertIn("msg", json.loads(body))
+        self.assertEqual(self.client.post("/logout", headers=self.headers).status_code, 200)
+        self.assertEqual(self.call("/notifications")[0], 401)
+
+    def test_shares_the_response_cache(self):
+        """Test that an ETag from the Flask path is honoured by the async path and writes through ASGI invalidate it."""
+        etag = self.client.get("/expenses", headers=self.headers).headers["ETag"]
+        self.assertEqual(self.call("/expenses", headers={"If-None-Match": etag})[0], 304)
+
+        body = json.dumps({"type_expense": "Food", "description_expense": "Dinner", "date_purchase": "2024-03-01", "amount": 42}).encode()
+        status, _, _ = self.call("/add_expense", method="POST", body=body, headers={"Content-Type": "application/json"})
+        self.assertEqual(status, 201)
+        status, _, body = self.call("/expenses", headers={"If-None-Match": etag})
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)[0]["description"], "Dinner")
+
+    def test_ndjson_stream(self):
+        """Test that ?format=ndjson streams every row after the cursor."""
+        status, headers, body = self.call("/expenses?format=ndjson&sort_by=amount&order=asc")
+        self.assertEqual((status, headers["content-type"]), (200, "application/x-ndjson"))
+        self.assertEqual([json.loads(line)["amount"] for line in body.decode().splitlines()], [10.0, 20.0, 30.0, 40.0, 50.0, 60.0])
+
+class StatementBudgetTestCase(unittest.TestCase):
+    # Statements per request, whatever the number of rows; raise one only with a reason
+    BUDGETS = {
+        "/expenses?limit=500": 2,  # cache version + the page
+        "/expenses?format=ndjson": 2,
+        "/expenses?category=Food&sort_by=amount": 3,  # + the category registry version
+        "/expenses/summary?group_by=category,month": 4,  # + the reporting currency and the days needing conversion
+        "/expenses/export?format=csv": 1,
+        "/expenses/export?format=columnar": 1,
+        "/notifications": 2,
+        "/notifications/unread_count": 1,
+        "/budgets": 2,  # the budget rows, whose spend is already counted, + the category registry version
+    }
+
+    def setUp(self):
+        config = type('BudgetConfig', (TestingConfig,), {'TOKEN_REVOCATION_BACKEND': 'memory'})
+        self.app = create_app(config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.users = []
+        for n in range(2):
+            user = User(user_name=f"user{n}", email=f"user{n}@example.com")
+            user.set_password("securepassword")
+            self.users.append(user)
+        self.categories = [Category(name=name) for name in ("Food", "Travel", "Rent")]
+        db.session.add_all(self.users + self.categories)
+        db.session.commit()
+        self.user_ids = [user.id for user in self.users]
+        self.category_ids = [category.id for category in self.categories]
+        # A worker loads the category registry once, requests then only check its version
+        self.app.extensions['category_registry'].id_for("Food")
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_rows(self, user_id, count):
+        db.session.execute(Expenses.__table__.insert(), [
+            {'amount_minor': 100 * (n + 1), 'description': f"Expense {n}", 'date': datetime(2024, 1, 1) + timedelta(hours=n),
+             'user_id': user_id, 'category_id': self.category_ids[n % 3]}
+            for n in range(count)
+        ])
+        db.session.execute(Notification.__table__.insert(), [
+            {'user_id': user_id, 'message': f"Notification {n}", 'type': "info", 'created_at': datetime(2024, 1, 1), 'is_read': False}
+            for n in range(count)
+        ])
+        # Already in the current period, so reading them rolls nothing over
+        db.session.execute(Budget.__table__.insert(), [
+            {'user_id': user_id, 'category_id': category_id, 'period': 'monthly', 'amount_minor': 10000, 'currency': 'GBP',
+             'alert_percent': 80, 'period_start': period_bounds('monthly', today())[0], 'spent_minor': 0, 'alerted_percent': 0}
+            for category_id in self.category_ids
+        ])
+        db.session.commit()
+
+    def count(self, user_id, path, **headers):
+        headers["Authorization"] = f"Bearer {create_access_token(identity=str(user_id))}"
+        db.session.remove()
+        with StatementCounter(db.engine) as counter:
+            response = self.client.get(path, headers=headers)
+            response.get_data()  # Streamed bodies run their queries while being read
+        self.assertEqual(response.status_code, 200, path)
+        return len(counter.statements)
+
+    def test_statements_do_not_grow_with_rows(self):
+        """Test that each endpoint stays within its statement budget for 5 and 300 rows."""
+        small, large = self.user_ids
+        self.add_rows(small, 5)
+        self.add_rows(large, 300)
+        for path, budget in self.BUDGETS.items():
+            self.assertEqual(self.count(small, path), budget, path)
+            self.assertEqual(self.count(large, path), budget, path)
+
+    def test_cache_hits_and_304s_cost_one_statement(self):
+        """Test that a repeated poll only reads the user's cache version."""
+        self.add_rows(self.user_ids[0], 50)
+        self.count(self.user_ids[0], "/expenses")
+        self.assertEqual(self.count(self.user_ids[0], "/expenses"), 1)
+
+if __name__ == "__main__":
+    unittest.main()
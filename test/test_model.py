@@ -1,9 +1,33 @@
+import io
+import os
+import tempfile
+import threading
+import time
 import unittest
 from app import db, bcrypt, create_app
-from app.models import User, Category, Expenses, RecurringExpense, Notification
+from app.models import User, Category, Expenses, RecurringExpense, Notification, RevokedToken, ExpenseRollup, NotificationOutbox, NotificationRule, JobRun, ScheduledJob, Budget, CacheVersion
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
-from app.config import TestingConfig
-from datetime import datetime, timedelta
+from app.config import Config, TestingConfig, ProductionConfig
+from app.recurring import generate_recurring_expenses
+from app.blacklist import MemoryRevocationStore, SQLRevocationStore
+from app.rollups import verify_rollups, rollup_summary
+from app.imports import import_expenses
+from app.passwords import PasswordHasher
+from app.ratelimit import MemoryAttemptStore, SQLAttemptStore, LoginLimiter
+from app.scheduler import SchedulerRunner, job_runs
+from app.cache import MemoryResponseCache, SQLiteResponseCache, current_version
+from app.categories import get_or_create_category_id
+from app.notifications import notifications_query, unread_count, mark_read, prune_read_notifications, queue_notification
+from app.money import to_minor, from_minor, format_minor, average_minor
+from app.fx import parse_rates, load_rates, check_currency, convert_minor
+from app.summary import expense_summary
+from app.rules import evaluate_new_expenses
+from app.search import parse_search, fts5_query, search_query, rebuild_search_index
+from app.budgets import period_bounds, period_spend, current_budgets, update_budgets, today
+from app.categorizer import features, CategoryIndex, assign_categories, evaluate, read_labeled, verify_category_index, rebuild_category_index
+from app.utils import expenses_query, handle_new_expense, verify_user_credentials, create_notification, SORT_ORDERS
+from datetime import date, datetime, timedelta
 
 class UserModelTestCase(unittest.TestCase):
 
@@ -203,6 +227,51 @@ class ExpensesModelTestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             expense = Expenses(amount=-20.0, description="Groceries", date=datetime.utcnow(), user_id=user.id, category_id=category.id)
 
+    def test_amount_is_stored_in_minor_units(self):
+        """Test that amounts are kept as exact integer minor units and sum without drift."""
+        user = User(user_name="testuser", email="test@example.com")
+        category = Category(name="Food")
+        db.session.add_all([user, category])
+        db.session.commit()
+
+        db.session.add_all([
+            Expenses(amount=0.1, description="Sweet", date=datetime(2024, 1, 1), user_id=user.id, category_id=category.id)
+            for _ in range(10)
+        ])
+        db.session.add(Expenses(amount="19.99", description="Book", date=datetime(2024, 1, 2), user_id=user.id, category_id=category.id))
+        db.session.commit()
+        book = Expenses.query.filter_by(description="Book").one()
+        self.assertEqual((book.amount_minor, book.currency, book.amount), (1999, "GBP", 19.99))
+        self.assertEqual(db.session.query(db.func.sum(Expenses.amount_minor)).scalar(), 2099)
+        self.assertEqual(sum([0.1] * 10), 0.9999999999999999)  # What summing the old float column gave
+
+        with self.assertRaises(ValueError):
+            book.amount = "twelve"
+        with self.assertRaises(ValueError):
+            book.amount = 0.004  # Rounds to nothing
+
+class MoneyTestCase(unittest.TestCase):
+
+    def test_to_minor(self):
+        """Test that amounts convert exactly, rounding half up below the currency's minor unit."""
+        self.assertEqual(to_minor(12), 1200)
+        self.assertEqual(to_minor(0.1), 10)
+        self.assertEqual(to_minor(1.005), 101)  # 1.00499999... as a binary fraction, 1.005 as written
+        self.assertEqual(to_minor(" 7.5 "), 750)
+        self.assertEqual(to_minor("1500", "JPY"), 1500)
+        self.assertEqual(to_minor("1.2345", "KWD"), 1235)
+        for value in ["abc", None, float("nan"), True, [1]]:
+            with self.assertRaises(ValueError):
+                to_minor(value)
+
+    def test_from_minor_and_format_minor(self):
+        """Test that minor units come back out as the exact decimal amount."""
+        self.assertEqual([repr(from_minor(n)) for n in (1999, 10, 1, 123456789012)], ["19.99", "0.1", "0.01", "1234567890.12"])
+        self.assertEqual(from_minor(1500, "JPY"), 1500)
+        self.assertEqual([format_minor(n) for n in (1999, 10, 5, 0, -250)], ["19.99", "0.10", "0.05", "0.00", "-2.50"])
+        self.assertEqual((format_minor(1500, "JPY"), format_minor(1235, "KWD")), ("1500", "1.235"))
+        self.assertEqual((average_minor(1000, 3), average_minor(1001, 2), average_minor(5, 2)), (333, 501, 3))
+
 class RecurringExpenseModelTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -324,5 +393,1482 @@ class NotificationModelTestCase(unittest.TestCase):
         fetched_notification_unread = Notification.query.filter_by(message="New expense added").first()
         self.assertFalse(fetched_notification_unread.is_read)
 
+class RecurringGenerationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        self.category = Category(name="Subscriptions")
+        db.session.add_all([self.user, self.category])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_schedule(self, recurrence, start_date, end_date, description="Netflix"):
+        schedule = RecurringExpense(amount=50.0, type_expense="Subscription", description_expense=description, recurrence=recurrence, start_date=start_date, end_date=end_date, user_id=self.user.id, category_id=self.category.id)
+        db.session.add(schedule)
+        db.session.commit()
+        return schedule
+
+    def test_catch_up_after_downtime(self):
+        """Test that every missed occurrence up to now is generated in one run."""
+        self.add_schedule("weekly", datetime(2024, 1, 1), datetime(2025, 1, 1))
+        created = generate_recurring_expenses(now=datetime(2024, 1, 29))
+        self.assertEqual(created, 5)
+        dates = [e.date for e in Expenses.query.order_by(Expenses.date).all()]
+        self.assertEqual(dates, [datetime(2024, 1, 1) + timedelta(weeks=n) for n in range(5)])
+
+    def test_rerun_does_not_duplicate(self):
+        """Test that the high-water mark makes repeated runs idempotent."""
+        schedule = self.add_schedule("daily", datetime(2024, 1, 1), datetime(2024, 12, 31))
+        generate_recurring_expenses(now=datetime(2024, 1, 10))
+        self.assertEqual(generate_recurring_expenses(now=datetime(2024, 1, 10)), 0)
+        self.assertEqual(generate_recurring_expenses(now=datetime(2024, 1, 12)), 2)
+        self.assertEqual(Expenses.query.count(), 12)
+        db.session.refresh(schedule)
+        self.assertEqual(schedule.last_generated, datetime(2024, 1, 12))
+
+    def test_end_date_is_respected(self):
+        """Test that no occurrence is generated after the schedule's end date."""
+        self.add_schedule("monthly", datetime(2024, 1, 15), datetime(2024, 3, 20))
+        self.assertEqual(generate_recurring_expenses(now=datetime(2024, 12, 1)), 3)
+        self.assertEqual(generate_recurring_expenses(now=datetime(2025, 12, 1)), 0)
+
+    def test_only_due_schedules_are_read(self):
+        """Test that next_due moves past each run and is cleared once the schedule is finished."""
+        finished = self.add_schedule("monthly", datetime(2024, 3, 15), datetime(2024, 3, 20))
+        weekly = self.add_schedule("weekly", datetime(2024, 3, 1), datetime(2024, 12, 31))
+        self.assertEqual(finished.next_due, datetime(2024, 3, 15))
+        generate_recurring_expenses(now=datetime(2024, 3, 16))
+        db.session.refresh(finished)
+        db.session.refresh(weekly)
+        self.assertIsNone(finished.next_due)
+        self.assertEqual(weekly.next_due, datetime(2024, 3, 22))
+
+        statements = []
+        listener = lambda *args: statements.append((args[2], args[3]))
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            self.assertEqual(generate_recurring_expenses(now=datetime(2024, 3, 20)), 0)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        # Nothing is due, so the run is one read that searches the next_due index
+        self.assertEqual(len(statements), 1)
+        with db.engine.connect() as connection:
+            plan = [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statements[0][0], statements[0][1])]
+        self.assertTrue(any(step.startswith("SEARCH") and "ix_recurring_expense_next_due" in step for step in plan), plan)
+
+    def test_month_end_does_not_drift(self):
+        """Test that monthly occurrences stay anchored to the start date."""
+        self.add_schedule("monthly", datetime(2024, 1, 31), datetime(2024, 12, 31))
+        generate_recurring_expenses(now=datetime(2024, 2, 29))
+        generate_recurring_expenses(now=datetime(2024, 4, 30))
+        dates = [e.date for e in Expenses.query.order_by(Expenses.date).all()]
+        self.assertEqual(dates, [datetime(2024, 1, 31), datetime(2024, 2, 29), datetime(2024, 3, 31), datetime(2024, 4, 30)])
+
+    def test_schedules_processed_in_batches(self):
+        """Test that every schedule is covered when there are more schedules than the batch size."""
+        for n in range(5):
+            self.add_schedule("yearly", datetime(2020, 6, 1), datetime(2030, 1, 1), description=f"Insurance {n}")
+        self.assertEqual(generate_recurring_expenses(now=datetime(2024, 1, 1), batch_size=2), 20)
+        self.assertEqual(Expenses.query.filter_by(description="Insurance 4").count(), 4)
+
+class ExpenseQueryPlanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add(Category(name="Food"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def explain(self, query):
+        compiled = query.compile(db.engine)
+        params = compiled.construct_params()
+        with db.engine.connect() as connection:
+            rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled),
+                                              tuple(params[name] for name in compiled.positiontup)).all()
+        return [row[-1] for row in rows]
+
+    def test_filter_and_sort_paths_use_an_index(self):
+        """Test that no supported filter/sort combination falls back to a full scan of expenses."""
+        dates = [(None, None), (datetime(2024, 1, 1), None), (datetime(2024, 1, 1), datetime(2024, 1, 31))]
+        for category in [None, "Food"]:
+            for start_date, end_date in dates:
+                for sort_by, after in [("date", (datetime(2024, 1, 15), 10)), ("amount", (25.0, 10))]:
+                    for order in SORT_ORDERS:
+                        # Deep pages (a cursor) must be able to seek just like the first page
+                        for cursor in [None, after]:
+                            query = expenses_query(1, category=category, start_date=start_date, end_date=end_date, sort_by=sort_by, order=order, after=cursor)
+                            plan = self.explain(query)
+                            for step in plan:
+                                if "expenses" in step:
+                                    self.assertTrue(step.startswith("SEARCH") and "INDEX" in step,
+                                                    f"{category}, {start_date}, {end_date}, {sort_by}, {order}, {cursor}: {plan}")
+
+    def test_invalid_sort_parameters(self):
+        """Test that unsupported sort fields and orders raise a ValueError."""
+        with self.assertRaises(ValueError):
+            expenses_query(1, sort_by="description")
+        with self.assertRaises(ValueError):
+            expenses_query(1, order="sideways")
+
+class RevocationStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_memory_store_evicts_expired_tokens(self):
+        """Test that a revoked jti stops being tracked once its exp has passed."""
+        store = MemoryRevocationStore()
+        store.revoke("live", time.time() + 60)
+        store.revoke("dead", time.time() - 1)
+        self.assertTrue(store.is_revoked("live"))
+        self.assertFalse(store.is_revoked("dead"))
+        self.assertNotIn("dead", store.revoked)
+
+    def test_sql_store_is_shared(self):
+        """Test that a second store sees revocations written by the first."""
+        first, second = SQLRevocationStore(), SQLRevocationStore(sync_interval=60)
+        self.assertFalse(second.is_revoked("abc"))
+        first.revoke("abc", time.time() + 60)
+        # Within the sync interval the mirror is not refreshed
+        self.assertFalse(second.is_revoked("abc"))
+        second.sync()
+        self.assertTrue(second.is_revoked("abc"))
+        self.assertEqual(RevokedToken.query.count(), 1)
+
+    def test_sql_store_syncs_after_prune(self):
+        """Test that a revocation written after a prune still reaches a store that synced the pruned rows."""
+        first, second = SQLRevocationStore(), SQLRevocationStore(sync_interval=60)
+        for jti in ["a", "b", "c"]:
+            first.revoke(jti, time.time() + 60)
+        second.sync()
+        RevokedToken.query.update({RevokedToken.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        first.prune()
+        first.revoke("fresh", time.time() + 60)
+        second.sync()
+        self.assertTrue(second.is_revoked("fresh"))
+
+    def test_sql_store_prunes_expired_rows(self):
+        """Test that prune deletes rows whose token has expired."""
+        store = SQLRevocationStore()
+        store.revoke("old", time.time() - 10)
+        store.revoke("new", time.time() + 60)
+        store.prune()
+        self.assertEqual([t.jti for t in RevokedToken.query.all()], ["new"])
+        self.assertNotIn("old", store.revoked)
+
+class ExpenseRollupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        self.food = Category(name="Food")
+        self.travel = Category(name="Travel")
+        db.session.add_all([self.user, self.food, self.travel])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_expense(self, amount, date, category=None):
+        expense = Expenses(amount=amount, description="Groceries", date=date, user_id=self.user.id, category_id=(category or self.food).id)
+        db.session.add(expense)
+        db.session.commit()
+        return expense
+
+    def rollup(self, category, year, month, currency='GBP'):
+        return db.session.get(ExpenseRollup, (self.user.id, category.id, year, month, currency))
+
+    def test_rollup_follows_add_modify_delete(self):
+        """Test that sum, count, min and max follow every write to expenses."""
+        first = self.add_expense(20.0, datetime(2024, 1, 5))
+        second = self.add_expense(50.0, datetime(2024, 1, 20))
+        self.add_expense(5.0, datetime(2024, 2, 1))
+        rollup = self.rollup(self.food, 2024, 1)
+        self.assertEqual((rollup.total_minor, rollup.count, rollup.min_minor, rollup.max_minor), (7000, 2, 2000, 5000))
+
+        # Moving the max out of January must re-read January's max
+        second.date = datetime(2024, 2, 10)
+        db.session.commit()
+        db.session.refresh(rollup)
+        self.assertEqual((rollup.total_minor, rollup.count, rollup.min_minor, rollup.max_minor), (2000, 1, 2000, 2000))
+        february = self.rollup(self.food, 2024, 2)
+        self.assertEqual((february.total_minor, february.count, february.min_minor, february.max_minor), (5500, 2, 500, 5000))
+
+        first.category_id = self.travel.id
+        db.session.commit()
+        self.assertIsNone(self.rollup(self.food, 2024, 1))
+        self.assertEqual(self.rollup(self.travel, 2024, 1).total_minor, 2000)
+
+        db.session.delete(second)
+        db.session.commit()
+        db.session.refresh(february)
+        self.assertEqual((february.total_minor, february.count, february.min_minor, february.max_minor), (500, 1, 500, 500))
+        self.assertEqual(verify_rollups(), [])
+
+    def test_rollup_rolls_back_with_expense(self):
+        """Test that the rollup is part of the expense's transaction."""
+        self.add_expense(20.0, datetime(2024, 1, 5))
+        db.session.add(Expenses(amount=30.0, description="Lunch", date=datetime(2024, 1, 6), user_id=self.user.id, category_id=self.food.id))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.rollup(self.food, 2024, 1).total_minor, 2000)
+
+    def test_recurring_generation_updates_rollups(self):
+        """Test that bulk-inserted recurring expenses are counted."""
+        db.session.add(RecurringExpense(amount=10.0, type_expense="Subscription", description_expense="Gym", recurrence="weekly", start_date=datetime(2024, 3, 1), end_date=datetime(2024, 12, 31), user_id=self.user.id, category_id=self.food.id))
+        db.session.commit()
+        generate_recurring_expenses(now=datetime(2024, 3, 31))
+        self.assertEqual(self.rollup(self.food, 2024, 3).count, 5)
+        self.assertEqual(verify_rollups(), [])
+
+    def test_rollups_are_kept_per_currency(self):
+        """Test that amounts in different currencies land in different rollups and follow a currency change."""
+        self.add_expense(20.0, datetime(2024, 1, 5))
+        expense = Expenses(currency="USD", amount=30.0, description="Taxi", date=datetime(2024, 1, 6), user_id=self.user.id, category_id=self.food.id)
+        db.session.add(expense)
+        db.session.commit()
+        self.assertEqual((self.rollup(self.food, 2024, 1).total_minor, self.rollup(self.food, 2024, 1, 'USD').total_minor), (2000, 3000))
+
+        expense.currency = "GBP"
+        db.session.commit()
+        self.assertEqual(self.rollup(self.food, 2024, 1).total_minor, 5000)
+        self.assertIsNone(self.rollup(self.food, 2024, 1, 'USD'))
+        self.assertEqual(verify_rollups(), [])
+
+    def test_rebuild_and_verify(self):
+        """Test that verify spots drift and rebuild repairs it."""
+        self.add_expense(20.0, datetime(2024, 1, 5))
+        self.add_expense(30.0, datetime(2024, 1, 7))
+        # Bulk deletes bypass the ORM, leaving the rollup stale
+        Expenses.query.filter(Expenses.amount_minor == 3000).delete()
+        db.session.commit()
+        self.assertEqual(verify_rollups(), [(self.user.id, self.food.id, 2024, 1, 'GBP')])
+
+        result = self.app.test_cli_runner().invoke(args=["rollups", "rebuild"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(verify_rollups(), [])
+        self.assertEqual(rollup_summary(self.user.id), [
+            {'category': 'Food', 'year': 2024, 'month': 1, 'currency': 'GBP', 'total': 20.0, 'count': 1, 'min': 20.0, 'max': 20.0,
+             'average': 20.0},
+        ])
+
+class NotificationOutboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.dispatcher = self.app.extensions['notification_dispatcher']
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        self.category = Category(name="Electronics")
+        db.session.add_all([self.user, self.category])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_expense(self, amount):
+        expense = Expenses(amount=amount, description="Laptop", date=datetime(2024, 5, 1), user_id=self.user.id, category_id=self.category.id)
+        db.session.add(expense)
+        handle_new_expense(expense)
+        return expense
+
+    def test_large_expense_goes_through_outbox(self):
+        """Test that a large expense queues its notification in the same transaction and drain delivers it."""
+        self.add_expense(5000.0)
+        self.add_expense(10.0)
+        db.session.commit()
+        self.assertEqual(Notification.query.count(), 0)
+        self.assertEqual(NotificationOutbox.query.count(), 1)
+        # The commit woke the dispatcher
+        self.assertFalse(self.dispatcher.queue.empty())
+
+        self.assertEqual(self.dispatcher.drain(), 1)
+        notification = Notification.query.one()
+        self.assertEqual(notification.message, "Large expense recorded: 5000.00 GBP (Electronics) on 2024-05-01")
+        self.assertFalse(notification.is_read)
+        self.assertEqual(NotificationOutbox.query.count(), 0)
+
+    def test_rolled_back_expense_sends_nothing(self):
+        """Test that the outbox row disappears with a rolled back expense."""
+        self.add_expense(5000.0)
+        db.session.rollback()
+        self.assertEqual(NotificationOutbox.query.count(), 0)
+        self.assertEqual(self.dispatcher.drain(), 0)
+
+    def test_drain_in_batches(self):
+        """Test that a backlog larger than the batch size is fully delivered."""
+        self.dispatcher.batch_size = 3
+        for n in range(7):
+            self.add_expense(1000.0 + n)
+        db.session.commit()
+        self.assertEqual(self.dispatcher.drain(), 7)
+        self.assertEqual(Notification.query.count(), 7)
+
+    def test_concurrent_drains_count_each_row_once(self):
+        """Test that a second worker draining the same outbox mid-batch neither duplicates rows nor the unread count."""
+        # Two apps on one file stand in for two worker processes
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = type('WorkerConfig', (TestingConfig,), {
+                'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmpdir, 'app.db'),
+            })
+            first, second = create_app(config), create_app(config)
+            with first.app_context():
+                db.create_all()
+                user = User(user_name="testuser", email="test@example.com", password_hash="x")
+                db.session.add(user)
+                db.session.commit()
+                for n in range(3):
+                    queue_notification(user.id, f"Notification {n}", 'info')
+                db.session.commit()
+
+                def drain_second():
+                    with second.app_context():
+                        second.extensions['notification_dispatcher'].drain()
+                        db.session.remove()
+
+                # Right after the first worker's first statement, the second one drains too
+                other = threading.Thread(target=drain_second)
+                def start_other(*args):
+                    if other.ident is None:
+                        other.start()
+                        other.join(0.5)
+                event.listen(db.engine, 'after_cursor_execute', start_other)
+                try:
+                    first.extensions['notification_dispatcher'].drain()
+                finally:
+                    event.remove(db.engine, 'after_cursor_execute', start_other)
+                other.join()
+
+                self.assertEqual(Notification.query.count(), 3)
+                self.assertEqual(unread_count(user.id), 3)
+                db.session.remove()
+                db.engine.dispose()
+            with second.app_context():
+                db.engine.dispose()
+
+class NotificationRuleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        self.category = Category(name="Food")
+        db.session.add_all([self.user, self.category])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_rule(self, **values):
+        db.session.add(NotificationRule(user_id=self.user.id, **values))
+        db.session.commit()
+
+    def add_expense(self, amount, date=datetime(2024, 5, 10)):
+        expense = Expenses(amount=amount, description="Groceries", date=date, user_id=self.user.id, category_id=self.category.id)
+        db.session.add(expense)
+        handle_new_expense(expense)
+        db.session.commit()
+
+    def queued(self, notif_type):
+        return [row.message for row in NotificationOutbox.query.filter_by(type=notif_type).order_by(NotificationOutbox.id)]
+
+    def test_threshold_rule_overrides_default(self):
+        """Test that a user's threshold rule replaces the configured default, and that the cache sees new rules."""
+        self.add_expense(500.0)
+        self.assertEqual(self.queued('large_expense'), [])
+        self.add_rule(kind='threshold', amount=100.0)
+        self.add_expense(500.0)
+        self.assertEqual(self.queued('large_expense'), ["Large expense recorded: 500.00 GBP (Food) on 2024-05-10"])
+
+    def test_category_budget_fires_once_when_crossed(self):
+        """Test that a monthly category budget notifies on the expense that crosses it, not after."""
+        self.add_rule(kind='category_budget', amount=100.0, category_id=self.category.id)
+        self.add_expense(60.0)
+        self.add_expense(60.0)
+        self.add_expense(60.0)
+        self.add_expense(60.0, date=datetime(2024, 6, 1))
+        self.assertEqual(self.queued('category_budget'), ["Monthly budget for Food exceeded: 120.00 of 100.00 GBP in 2024-05"])
+
+    def test_rolling_limit(self):
+        """Test that a 7-day limit only counts expenses inside the window."""
+        self.add_rule(kind='rolling_limit', amount=100.0, window_days=7)
+        self.add_expense(80.0, date=datetime(2024, 5, 1))
+        self.add_expense(80.0, date=datetime(2024, 5, 10))
+        self.assertEqual(self.queued('rolling_limit'), [])
+        self.add_expense(30.0, date=datetime(2024, 5, 12))
+        self.assertEqual(self.queued('rolling_limit'), ["Spending limit exceeded: 110.00 GBP in the last 7 days (limit 100.00 GBP)"])
+
+    def test_rolling_limits_are_one_query_per_batch(self):
+        """Test that a batch spanning many users sums every user's windows in a single query."""
+        users = [self.user] + [User(user_name=f"user{n}", email=f"user{n}@example.com", password_hash="x") for n in range(4)]
+        db.session.add_all(users[1:])
+        db.session.commit()
+        for n, user in enumerate(users):
+            db.session.add(NotificationRule(user_id=user.id, kind='rolling_limit', amount=50.0 if n == 2 else 100.0, window_days=7))
+            if n % 2:
+                db.session.add(NotificationRule(user_id=user.id, kind='rolling_limit', amount=120.0, window_days=30))
+        expenses = [
+            Expenses(amount=amount, description="Groceries", date=date, user_id=user.id, category_id=self.category.id)
+            for user in users for amount, date in [(80.0, datetime(2024, 5, 1)), (60.0, datetime(2024, 5, 10))]
+        ]
+        db.session.add_all(expenses)
+        db.session.commit()
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            evaluate_new_expenses([
+                {'user_id': e.user_id, 'category_id': e.category_id, 'date': e.date, 'currency': e.currency, 'amount_minor': e.amount_minor}
+                for e in expenses if e.date.day == 10
+            ])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(len([statement for statement in statements if "sum(CASE" in statement]), 1)
+        # Only the 30-day windows reach back to May 1
+        self.assertEqual(sorted((row.user_id, row.message) for row in NotificationOutbox.query.filter_by(type='rolling_limit')), [
+            (users[1].id, "Spending limit exceeded: 140.00 GBP in the last 30 days (limit 120.00 GBP)"),
+            (users[2].id, "Spending limit exceeded: 60.00 GBP in the last 7 days (limit 50.00 GBP)"),
+            (users[3].id, "Spending limit exceeded: 140.00 GBP in the last 30 days (limit 120.00 GBP)"),
+        ])
+
+    def test_anomaly_needs_history(self):
+        """Test that an expense far above the user's mean is flagged once there is enough history."""
+        self.add_rule(kind='anomaly', factor=3.0)
+        self.add_expense(400.0)
+        self.assertEqual(self.queued('anomaly'), [])
+        for n in range(10):
+            self.add_expense(20.0 + n)
+        self.add_expense(400.0)
+        self.assertEqual(len(self.queued('anomaly')), 1)
+        self.add_expense(30.0)
+        self.assertEqual(len(self.queued('anomaly')), 1)
+
+    def test_import_is_evaluated_per_batch(self):
+        """Test that bulk imports go through the same rules, with a fixed number of queries per batch."""
+        self.add_rule(kind='category_budget', amount=1000.0, category_id=self.category.id)
+        records = [(n, {'category': 'Food', 'description': 'Item', 'date': '2024-05-01', 'amount': 100}) for n in range(25)]
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            report = import_expenses(self.user.id, records, batch_size=25)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(report['imported'], 25)
+        self.assertEqual(self.queued('category_budget'), ["Monthly budget for Food exceeded: 2500.00 of 1000.00 GBP in 2024-05"])
+        self.assertLess(len(statements), 15)
+
+    def test_recurring_generation_uses_rules(self):
+        """Test that generated recurring expenses are checked against the owner's rules."""
+        self.add_rule(kind='threshold', amount=50.0)
+        db.session.add(RecurringExpense(amount=75.0, type_expense="Gym", description_expense="Membership", recurrence="monthly",
+                                        start_date=datetime(2024, 1, 1), end_date=datetime(2024, 12, 31),
+                                        user_id=self.user.id, category_id=self.category.id))
+        db.session.commit()
+        created = generate_recurring_expenses(now=datetime(2024, 3, 15))
+        self.assertEqual(len(self.queued('large_expense')), created)
+
+class PasswordHasherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.hasher = self.app.extensions['password_hasher']
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_configured_cost(self):
+        """Test that hashes use BCRYPT_LOG_ROUNDS and still read as plain bcrypt."""
+        self.assertTrue(self.user.password_hash.startswith("$2b$04$"))
+        self.assertFalse(self.hasher.needs_rehash(self.user.password_hash))
+        self.assertTrue(bcrypt.check_password_hash(self.user.password_hash, "securepassword"))
+
+    def test_verify_credentials(self):
+        """Test that the right password logs in and a wrong one or unknown email does not."""
+        self.assertEqual(verify_user_credentials("test@example.com", "securepassword"), self.user)
+        self.assertIsNone(verify_user_credentials("test@example.com", "wrongpassword"))
+        self.assertIsNone(verify_user_credentials("nobody@example.com", "securepassword"))
+
+    def test_rehash_when_cost_changes(self):
+        """Test that a successful login moves the stored hash to the current cost."""
+        self.hasher.rounds = 5
+        self.assertIsNone(verify_user_credentials("test@example.com", "wrongpassword"))
+        self.assertTrue(db.session.get(User, self.user.id).password_hash.startswith("$2b$04$"))
+        verify_user_credentials("test@example.com", "securepassword")
+        self.assertTrue(db.session.get(User, self.user.id).password_hash.startswith("$2b$05$"))
+
+    def test_legacy_werkzeug_hash_is_upgraded(self):
+        """Test that werkzeug hashes still verify and are replaced with bcrypt."""
+        from werkzeug.security import generate_password_hash
+        self.user.password_hash = generate_password_hash("securepassword")
+        db.session.commit()
+        self.assertTrue(self.hasher.needs_rehash(self.user.password_hash))
+        self.assertEqual(verify_user_credentials("test@example.com", "securepassword"), self.user)
+        self.assertTrue(db.session.get(User, self.user.id).password_hash.startswith("$2b$04$"))
+
+    def test_process_pool(self):
+        """Test that hashing and checking work the same in worker processes."""
+        hasher = PasswordHasher(rounds=4, workers=1)
+        try:
+            password_hash = hasher.hash("securepassword")
+            self.assertTrue(hasher.verify("securepassword", password_hash))
+            self.assertFalse(hasher.verify("wrongpassword", password_hash))
+        finally:
+            hasher.shutdown()
+
+class AttemptStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def check_sliding_window(self, store):
+        # window is 100 seconds: three hits in [0, 100), two in [100, 200)
+        for now in (10, 20, 90):
+            store.hit("email:a@example.com", now=now)
+        self.assertEqual(store.count("email:a@example.com", now=95), 3)
+        store.hit("email:a@example.com", now=110)
+        store.hit("email:a@example.com", now=120)
+        # At 150 half of the previous window still counts
+        self.assertAlmostEqual(store.count("email:a@example.com", now=150), 2 + 3 * 0.5)
+        self.assertAlmostEqual(store.count("email:a@example.com", now=250), 2 * 0.5)
+        self.assertEqual(store.count("email:a@example.com", now=300), 0)
+        self.assertEqual(store.count("email:b@example.com", now=150), 0)
+
+        store.reset("email:a@example.com")
+        self.assertEqual(store.count("email:a@example.com", now=150), 0)
+
+    def test_memory_store(self):
+        """Test the in-process sliding window and its eviction."""
+        store = MemoryAttemptStore(window=100)
+        self.check_sliding_window(store)
+        store.hit("ip:10.0.0.1", now=110)
+        store.prune(now=350)
+        self.assertEqual(store.counters, {})
+
+    def test_sql_store(self):
+        """Test that the table-backed store gives the same counts and prunes old rows."""
+        store = SQLAttemptStore(window=100)
+        self.check_sliding_window(store)
+        store.hit("ip:10.0.0.1", now=110)
+        store.prune(now=350)
+        self.assertEqual(store.count("ip:10.0.0.1", now=150), 0)
+
+    def test_limiter_counts_rejections(self):
+        """Test that the limiter locks an email after max_failures and counts what it turns away."""
+        limiter = LoginLimiter(MemoryAttemptStore(window=100), max_failures=3, ip_max_failures=10)
+        self.assertEqual([limiter.failed("A@example.com", "10.0.0.1") for _ in range(3)], [False, False, True])
+        self.assertEqual(limiter.blocked("a@example.com", "10.0.0.2"), "email")
+        self.assertIsNone(limiter.blocked("b@example.com", "10.0.0.1"))
+        limiter.succeeded("a@example.com")
+        self.assertIsNone(limiter.blocked("a@example.com", "10.0.0.1"))
+        self.assertEqual(limiter.rejected, {"email": 1})
+
+class DatabaseProfileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # WAL needs a real file, an in-memory database always reports journal_mode=memory
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = type('ProfileConfig', (ProductionConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.tmpdir.name, 'app.db'),
+            'NOTIFICATION_WORKERS': 0,
+        })
+        self.app = create_app(config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.tmpdir.cleanup()
+
+    def test_pragmas_on_every_connection(self):
+        """Test that each pooled connection gets the production pragmas."""
+        connections = [db.engine.connect() for _ in range(3)]
+        try:
+            for connection in connections:
+                pragma = lambda name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+                self.assertEqual(pragma("journal_mode"), "wal")
+                self.assertEqual(pragma("synchronous"), 1)  # NORMAL
+                self.assertEqual(pragma("busy_timeout"), 30000)
+                self.assertEqual(pragma("cache_size"), -65536)
+        finally:
+            for connection in connections:
+                connection.close()
+        self.assertEqual(db.engine.pool.size(), 10)
+
+class SchedulerRunnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.calls = []
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def runner(self, **jobs):
+        return SchedulerRunner(self.app, lease_seconds=60, jobs=jobs or {'count': (self.count_job, 3600)})
+
+    def count_job(self):
+        self.calls.append(1)
+        return 7
+
+    def test_app_starts_without_scheduler_thread(self):
+        """Test that create_app only starts the loop when SCHEDULER_THREAD is set, which the default config doesn't."""
+        self.assertIsNone(self.app.extensions['scheduler'].thread)
+        default = create_app(type('DefaultConfig', (Config,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'NOTIFICATION_WORKERS': 0, 'PASSWORD_HASH_WORKERS': 0,
+        }))
+        self.assertIsNone(default.extensions['scheduler'].thread)
+
+    def test_single_leader(self):
+        """Test that only one runner holds the lease until it expires or is released."""
+        first, second = self.runner(), self.runner()
+        now = datetime.utcnow()
+        self.assertTrue(first.acquire(now))
+        self.assertFalse(second.acquire(now))
+        self.assertTrue(first.acquire(now + timedelta(seconds=30)))
+        # first stopped renewing
+        self.assertTrue(second.acquire(now + timedelta(seconds=120)))
+        self.assertFalse(first.acquire(now + timedelta(seconds=121)))
+        second.release()
+        self.assertTrue(first.acquire())
+
+    def test_jobs_run_once_and_are_recorded(self):
+        """Test that due jobs run once across runners and each run lands in job_run."""
+        first, second = self.runner(), self.runner()
+        self.assertEqual(len(first.run_pending()), 1)
+        self.assertEqual(second.run_pending(), [])
+        self.assertEqual(first.run_pending(), [])
+        self.assertEqual(len(self.calls), 1)
+
+        run = JobRun.query.one()
+        self.assertEqual((run.job_name, run.status, run.rows, run.owner), ('count', 'succeeded', 7, first.owner))
+        self.assertIsNotNone(run.duration)
+        job = db.session.get(ScheduledJob, 'count')
+        self.assertEqual(job.next_run_at, run.started_at + timedelta(hours=1))
+
+        # Next run time survives a restart, so a new leader waits too
+        first.release()
+        self.assertEqual(second.run_pending(), [])
+        job.next_run_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(len(second.run_pending()), 1)
+        self.assertEqual(len(job_runs('count')), 2)
+
+    def test_failed_job(self):
+        """Test that a failing job is recorded and rescheduled instead of stopping the runner."""
+        def broken():
+            raise RuntimeError("boom")
+        runner = self.runner(broken=(broken, 60), count=(self.count_job, 60))
+        runs = runner.run_pending()
+        self.assertEqual(sorted(run.status for run in runs), ['failed', 'succeeded'])
+        failed = JobRun.query.filter_by(job_name='broken').one()
+        self.assertEqual(failed.error, "boom")
+        self.assertGreater(db.session.get(ScheduledJob, 'broken').next_run_at, datetime.utcnow())
+
+    def test_job_that_outlives_its_lease(self):
+        """Test that failed renewals are logged and retried, and a job that lost the lease is recorded as failed."""
+        runner = SchedulerRunner(self.app, lease_seconds=0.3, jobs={'slow': (lambda: slow(), 60)})
+        def locked(now=None):
+            raise RuntimeError("database is locked")
+        def slow():
+            runner.acquire = locked
+            time.sleep(0.6)
+            return 1
+        with self.assertLogs(self.app.logger, 'ERROR') as logs:
+            [run] = runner.run_pending()
+        self.assertTrue(any("Renewing the scheduler lease failed" in line for line in logs.output))
+        self.assertTrue(any("lost its lease" in line for line in logs.output))
+        self.assertEqual((run.status, run.error, run.rows), ('failed', "Lost the scheduler lease while running", 1))
+        # Not rescheduled by a runner that may no longer be the leader
+        self.assertIsNone(db.session.get(ScheduledJob, 'slow').last_run_at)
+
+    def test_recurring_job_reports_rows(self):
+        """Test that the recurring expenses job records how many expenses it wrote."""
+        user = User(user_name="testuser", email="test@example.com")
+        user.set_password("securepassword")
+        category = Category(name="Subscriptions")
+        db.session.add_all([user, category])
+        db.session.commit()
+        db.session.add(RecurringExpense(amount=9.99, type_expense="Subscription", description_expense="Music", recurrence="monthly",
+                                        start_date=datetime.utcnow() - timedelta(days=70), end_date=datetime.utcnow() + timedelta(days=365),
+                                        user_id=user.id, category_id=category.id))
+        db.session.commit()
+        runner = SchedulerRunner(self.app)
+        runs = {run.job_name: run for run in runner.run_pending()}
+        self.assertEqual(set(runs), {'recurring_expenses', 'prune_revoked_tokens', 'prune_login_attempts', 'prune_read_notifications'})
+        self.assertEqual(runs['recurring_expenses'].rows, Expenses.query.count())
+        self.assertGreaterEqual(runs['recurring_expenses'].rows, 3)
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        self.category = Category(name="Food")
+        db.session.add_all([self.user, self.category])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def check_lru_and_ttl(self, cache):
+        cache.set("a", b"1")
+        cache.set("b", b"2")
+        self.assertEqual(cache.get("a"), b"1")
+        cache.set("c", b"3")
+        if hasattr(cache, "prune"):
+            cache.prune()
+        # "b" was the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1")
+        self.assertEqual(cache.get("c"), b"3")
+        cache.ttl = -1
+        cache.set("d", b"4")
+        self.assertIsNone(cache.get("d"))
+
+    def test_memory_backend(self):
+        """Test LRU eviction and expiry of the in-process cache."""
+        self.check_lru_and_ttl(MemoryResponseCache(max_entries=2, ttl=60))
+
+    def test_sqlite_backend(self):
+        """Test the same behaviour from the file cache, as seen by two workers."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "cache.db")
+            cache = SQLiteResponseCache(path, max_entries=2, ttl=60)
+            SQLiteResponseCache(path).set("shared", (b"body", "application/json", {}))
+            self.assertEqual(cache.get("shared"), (b"body", "application/json", {}))
+            cache.connection().execute("DELETE FROM response_cache")
+            time.sleep(0.01)  # used_at needs to move for the LRU order
+            self.check_lru_and_ttl(cache)
+
+    def test_writes_bump_the_owner_version(self):
+        """Test that adding, modifying and deleting expenses and adding notifications bump only their owner."""
+        other = User(user_name="other", email="other@example.com")
+        other.set_password("securepassword")
+        db.session.add(other)
+        db.session.commit()
+        self.assertEqual(current_version(self.user.id), 0)
+
+        expense = Expenses(amount=10.0, description="Lunch", date=datetime(2024, 5, 1), user_id=self.user.id, category_id=self.category.id)
+        db.session.add(expense)
+        db.session.commit()
+        self.assertEqual(current_version(self.user.id), 1)
+        expense.amount = 12.0
+        db.session.commit()
+        self.assertEqual(current_version(self.user.id), 2)
+        db.session.delete(expense)
+        db.session.commit()
+        self.assertEqual(current_version(self.user.id), 3)
+
+        db.session.add(Notification(user_id=self.user.id, message="Hi", type="info"))
+        db.session.commit()
+        self.assertEqual(current_version(self.user.id), 4)
+        self.assertEqual(current_version(other.id), 0)
+
+    def test_bulk_writes_bump_versions(self):
+        """Test that imports, recurring generation and outbox delivery bump versions too."""
+        import_expenses(self.user.id, [(1, {'category': 'Food', 'description': 'Item', 'date': '2024-05-01', 'amount': 5000})])
+        self.assertEqual(current_version(self.user.id), 1)
+        self.app.extensions['notification_dispatcher'].drain()
+        self.assertEqual(current_version(self.user.id), 2)
+
+        db.session.add(RecurringExpense(amount=5.0, type_expense="Coffee", description_expense="Coffee", recurrence="daily",
+                                        start_date=datetime(2024, 1, 1), end_date=datetime(2024, 1, 3),
+                                        user_id=self.user.id, category_id=self.category.id))
+        db.session.commit()
+        generate_recurring_expenses(now=datetime(2024, 2, 1))
+        self.assertEqual(current_version(self.user.id), 3)
+
+class CategoryRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Two apps on one file stand in for two workers
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = type('WorkerConfig', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.tmpdir.name, 'app.db'),
+        })
+        self.app = create_app(config)
+        self.other_app = create_app(config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Category(name="Food"), Category(name="Travel")])
+        db.session.commit()
+        self.registry = self.app.extensions['category_registry']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        with self.other_app.app_context():
+            db.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def test_lookups_load_once(self):
+        """Test that unchanged categories are read once and then served from memory."""
+        food_id = self.registry.id_for("Food")
+        self.assertEqual(self.registry.names_for([food_id]), {food_id: "Food"})
+        self.assertIsNone(self.registry.id_for("Rent"))
+        for _ in range(3):
+            db.session.commit()
+            self.assertEqual(self.registry.id_for("Food"), food_id)
+        self.assertEqual(self.registry.loads, 1)
+
+    def test_own_uncommitted_category(self):
+        """Test that a new category is visible to its own transaction and forgotten on rollback."""
+        self.registry.id_for("Food")
+        rent_id = get_or_create_category_id("Rent")
+        self.assertEqual(get_or_create_category_id("Rent"), rent_id)
+        self.assertEqual(self.registry.names_for([rent_id]), {rent_id: "Rent"})
+        db.session.rollback()
+        self.assertIsNone(self.registry.id_for("Rent"))
+
+        rent_id = get_or_create_category_id("Rent")
+        db.session.commit()
+        self.assertEqual(self.registry.id_for("Rent"), rent_id)
+
+    def test_changes_from_another_worker(self):
+        """Test that a create, rename or delete committed by another worker is seen on the next transaction."""
+        food_id = self.registry.id_for("Food")
+        db.session.commit()
+        with self.other_app.app_context():
+            other = self.other_app.extensions['category_registry']
+            self.assertEqual(other.id_for("Food"), food_id)
+            db.session.get(Category, food_id).name = "Groceries"
+            db.session.delete(Category.query.filter_by(name="Travel").one())
+            rent_id = get_or_create_category_id("Rent")
+            db.session.commit()
+            db.session.remove()
+        self.assertIsNone(self.registry.id_for("Food"))
+        self.assertIsNone(self.registry.id_for("Travel"))
+        self.assertEqual(self.registry.id_for("Groceries"), food_id)
+        self.assertEqual(self.registry.id_for("Rent"), rent_id)
+
+    def test_expense_writes_do_not_invalidate(self):
+        """Test that adding expenses to a category is not a category change."""
+        user = User(user_name="testuser", email="test@example.com")
+        db.session.add(user)
+        db.session.commit()
+        food = Category.query.filter_by(name="Food").one()
+        self.registry.id_for("Food")
+        db.session.add(Expenses(amount=5.0, description="Lunch", date=datetime(2024, 1, 1), user=user, category=food))
+        db.session.commit()
+        self.registry.id_for("Food")
+        self.assertEqual(self.registry.loads, 1)
+
+    def test_unknown_category_filter_matches_nothing(self):
+        """Test that filtering on a category that doesn't exist returns no rows."""
+        user = User(user_name="testuser", email="test@example.com")
+        db.session.add(user)
+        db.session.add(Expenses(amount=5.0, description="Lunch", date=datetime(2024, 1, 1), user=user,
+                                category=Category.query.filter_by(name="Food").one()))
+        db.session.commit()
+        self.assertEqual(len(db.session.execute(expenses_query(user.id, category="Food")).all()), 1)
+        self.assertEqual(db.session.execute(expenses_query(user.id, category="Rent")).all(), [])
+
+class NotificationFeedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.user.set_password("securepassword")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_notifications(self, count, **fields):
+        notifications = [Notification(user_id=self.user.id, message=f"Notification {n}", type="info",
+                                      created_at=datetime(2024, 1, 1) + timedelta(hours=n), **fields) for n in range(count)]
+        db.session.add_all(notifications)
+        db.session.commit()
+        return [notification.id for notification in notifications]
+
+    def test_counter_follows_orm_writes(self):
+        """Test that adding, reading, unreading and deleting notifications keep the unread counter right."""
+        ids = self.add_notifications(4)
+        self.add_notifications(1, is_read=True)
+        self.assertEqual(unread_count(self.user.id), 4)
+        db.session.get(Notification, ids[0]).is_read = True
+        db.session.commit()
+        self.assertEqual(unread_count(self.user.id), 3)
+        db.session.get(Notification, ids[0]).is_read = False
+        db.session.delete(db.session.get(Notification, ids[1]))
+        db.session.commit()
+        self.assertEqual(unread_count(self.user.id), 3)
+
+    def test_counter_follows_outbox_delivery(self):
+        """Test that notifications delivered from the outbox are counted."""
+        create_notification(self.user.id, "Budget exceeded", "category_budget")
+        db.session.commit()
+        self.assertEqual(unread_count(self.user.id), 0)
+        self.app.extensions['notification_dispatcher'].drain()
+        self.assertEqual(unread_count(self.user.id), 1)
+
+    def test_mark_read_by_id_range(self):
+        """Test that marking a range read is one UPDATE and only counts rows that were unread."""
+        ids = self.add_notifications(10)
+        db.session.get(Notification, ids[2]).is_read = True
+        db.session.commit()
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(mark_read(self.user.id, ids[0], ids[5]), 5)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(sum(statement.startswith("UPDATE notification") for statement in statements), 1)
+        self.assertEqual(unread_count(self.user.id), 4)
+        self.assertEqual(mark_read(self.user.id, ids[0], ids[5]), 0)
+        self.assertEqual(unread_count(self.user.id), 4)
+
+    def test_cursor_pages(self):
+        """Test that following (created_at, id) cursors visits every notification once, newest first."""
+        self.add_notifications(7)
+        seen, after = [], None
+        while True:
+            page = db.session.execute(notifications_query(self.user.id, limit=3, after=after)).all()
+            seen += [row.message for row in page]
+            if len(page) < 3:
+                break
+            after = (page[-1].created_at, page[-1].id)
+        self.assertEqual(seen, [f"Notification {n}" for n in reversed(range(7))])
+
+    def test_feed_queries_use_an_index(self):
+        """Test that both listings search a (user_id, ..., created_at) index and need no sort step."""
+        for unread in [False, True]:
+            compiled = notifications_query(1, unread=unread, after=(datetime(2024, 1, 1), 10)).compile(db.engine)
+            params = compiled.construct_params()
+            with db.engine.connect() as connection:
+                plan = [row[-1] for row in connection.exec_driver_sql(
+                    "EXPLAIN QUERY PLAN " + str(compiled), tuple(params[name] for name in compiled.positiontup))]
+            self.assertTrue(any(step.startswith("SEARCH") and "ix_notification_user_id" in step for step in plan), plan)
+            self.assertFalse(any("TEMP B-TREE" in step for step in plan), plan)
+
+    def test_prune_read_notifications(self):
+        """Test that only old read notifications are deleted, in batches."""
+        self.add_notifications(5, is_read=True)
+        self.add_notifications(2)
+        self.assertEqual(prune_read_notifications(retention_days=30, batch_size=2, now=datetime(2024, 6, 1)), 5)
+        self.assertEqual(Notification.query.count(), 2)
+        self.assertEqual(unread_count(self.user.id), 2)
+
+class FxConverterTestCase(unittest.TestCase):
+
+    # Against EUR; 2024-01-06 and 07 are a weekend without rates
+    RATES = b"""Date,USD,JPY,GBP,
+2024-01-05,1.1,160,0.8,
+2024-01-08,1.2,N/A,0.9,
+"""
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.food = Category(name="Food")
+        db.session.add_all([self.user, self.food])
+        db.session.commit()
+        load_rates(parse_rates(io.BytesIO(self.RATES)), 'EUR')
+        self.converter = self.app.extensions['fx_converter']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_expense(self, currency, amount, day):
+        db.session.add(Expenses(currency=currency, amount=amount, description="Lunch", date=datetime(2024, 1, day, 12), user_id=self.user.id, category_id=self.food.id))
+        db.session.commit()
+
+    def test_parse_rates(self):
+        """Test that long and ECB-style wide files give the same rates and bad lines are reported."""
+        wide = list(parse_rates(io.BytesIO(self.RATES)))
+        self.assertEqual(len(wide), 5)
+        self.assertIn((date(2024, 1, 5), 'JPY', 160.0), wide)
+        long = list(parse_rates(io.BytesIO(b"date,currency,rate\n" + b"".join(
+            f"{day.isoformat()},{currency.lower()},{rate}\n".encode() for day, currency, rate in wide))))
+        self.assertEqual(long, wide)
+        with self.assertRaisesRegex(ValueError, "Line 3"):
+            list(parse_rates(io.BytesIO(b"date,currency,rate\n2024-01-05,USD,1.1\n2024-01-08,USD,-1\n")))
+
+    def test_factors(self):
+        """Test cross rates, weekends, days before the first rate and minor unit scales."""
+        factors = self.converter.factors({(date(2024, 1, 6), 'USD', 'GBP'), (date(2024, 1, 1), 'USD', 'GBP'),
+                                          (date(2024, 1, 9), 'EUR', 'GBP'), (date(2024, 1, 9), 'JPY', 'GBP'),
+                                          (date(2024, 1, 9), 'GBP', 'GBP')})
+        self.assertAlmostEqual(factors[(date(2024, 1, 6), 'USD', 'GBP')], 0.8 / 1.1)
+        self.assertAlmostEqual(factors[(date(2024, 1, 1), 'USD', 'GBP')], 0.8 / 1.1)
+        self.assertAlmostEqual(factors[(date(2024, 1, 9), 'EUR', 'GBP')], 0.9)
+        # 1 yen has no minor unit, 160 yen are 90 pence on the 9th
+        self.assertEqual(convert_minor(160, factors[(date(2024, 1, 9), 'JPY', 'GBP')]), 90)
+        self.assertEqual(factors[(date(2024, 1, 9), 'GBP', 'GBP')], 1.0)
+
+    def test_one_query_per_batch_and_lru(self):
+        """Test that a year of days is resolved with one query and then served from the LRU until rates change."""
+        keys = {(date(2024, 1, 1) + timedelta(days=n), currency, 'GBP') for n in range(366) for currency in ('USD', 'JPY')}
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.converter.factors(keys)
+            self.assertEqual(len(statements), 3)  # registry version, currencies, rates
+            self.converter.factors(keys)
+            self.assertEqual(len(statements), 3)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual((self.converter.hits, self.converter.misses), (732, 732))
+
+        # The least recently used factors make room for new ones
+        self.converter.max_entries = 100
+        self.converter.factors({(day, 'EUR', 'GBP') for day, source, target in keys})
+        self.assertEqual(len(self.converter.entries), 100)
+
+        # New rates move the registry version, the next transaction drops every factor; cached summaries go too
+        self.add_expense('USD', 5, 6)
+        # A user without a version row yet, as after the migration that added them, moves too
+        db.session.execute(db.delete(CacheVersion).where(CacheVersion.user_id == self.user.id))
+        db.session.commit()
+        load_rates([(date(2024, 1, 6), 'USD', 1.6)], 'EUR')
+        self.assertEqual(current_version(self.user.id), 1)
+        self.assertAlmostEqual(self.converter.factors({(date(2024, 1, 6), 'USD', 'GBP')})[(date(2024, 1, 6), 'USD', 'GBP')], 0.5)
+
+    def test_check_currency(self):
+        """Test that only currencies with rates are accepted."""
+        check_currency('USD')
+        check_currency('EUR')
+        for currency in ('CHF', 'usd', 'POUND'):
+            with self.assertRaises(ValueError):
+                check_currency(currency)
+
+    def test_summary_converts_like_python(self):
+        """Test that the summary's SQL conversion gives the same minor units as convert_minor on each row."""
+        self.add_expense('GBP', 10, 5)
+        self.add_expense('USD', 11, 6)
+        self.add_expense('JPY', 1000, 8)
+        self.add_expense('USD', '3.33', 8)
+        for currency in ('GBP', 'USD', 'JPY'):
+            expenses = Expenses.query.all()
+            factors = self.converter.factors({(e.date.date(), e.currency, currency) for e in expenses})
+            expected = sum(convert_minor(e.amount_minor, factors[(e.date.date(), e.currency, currency)]) for e in expenses)
+            summary = expense_summary(self.user.id, ['category', 'day'], currency)
+            self.assertEqual(summary['currency'], currency)
+            self.assertEqual(summary['total'], from_minor(expected, currency))
+            self.assertEqual(summary['count'], 4)
+        # 10 pounds, 11 dollars at 0.8/1.1 and 1000 yen at 0.8/160
+        self.assertEqual(expense_summary(self.user.id, ['category'], 'GBP', end_date=datetime(2024, 1, 7))['total'], 18.0)
+
+    def test_rules_compare_converted_amounts(self):
+        """Test that rule thresholds, in the default currency, are checked against converted amounts."""
+        rows = [{'user_id': self.user.id, 'category_id': self.food.id, 'date': datetime(2024, 1, 5), 'currency': 'JPY', 'amount_minor': amount}
+                for amount in (100000, 200000)]
+        notifications = evaluate_new_expenses(rows)
+        self.assertEqual([n['message'] for n in notifications], ["Large expense recorded: 1000.00 GBP (Food) on 2024-01-05"])
+
+class ExpenseSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.other = User(user_name="otheruser", email="other@example.com")
+        self.category = Category(name="Travel")
+        db.session.add_all([self.user, self.other, self.category])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_expense(self, description, user=None, day=1):
+        expense = Expenses(amount=10, description=description, date=datetime(2024, 1, day),
+                           user_id=(user or self.user).id, category_id=self.category.id)
+        db.session.add(expense)
+        db.session.commit()
+        return expense
+
+    def search(self, q, **kwargs):
+        return [row.description for row in db.session.execute(search_query(self.user.id, q, 'sqlite', **kwargs))]
+
+    def test_parse_search(self):
+        """Test that words, prefixes and phrases become FTS5 queries that cannot be malformed."""
+        self.assertEqual(parse_search('Uber ub* "coffee shop"'), [(['Uber'], False), (['ub'], True), (['coffee', 'shop'], False)])
+        self.assertEqual(fts5_query(parse_search("o'neil AND -x*"), 7), 'user_id : "7" AND description : ("o neil" "AND" "x"*)')
+        for q in ['', '   ', '"" * -', None]:
+            with self.assertRaises(ValueError):
+                parse_search(q)
+
+    def test_prefix_phrase_and_accents(self):
+        """Test prefix and phrase matching, ignoring case and accents."""
+        for description in ["Uber to airport", "Uber Eats", "uberX ride", "Coffee shop", "Shop coffee", "Café crème"]:
+            self.add_expense(description)
+        self.assertEqual(sorted(self.search("uber")), ["Uber Eats", "Uber to airport"])
+        self.assertEqual(sorted(self.search("UB*")), ["Uber Eats", "Uber to airport", "uberX ride"])
+        self.assertEqual(self.search('"coffee shop"'), ["Coffee shop"])
+        self.assertEqual(sorted(self.search("shop coffee")), ["Coffee shop", "Shop coffee"])
+        self.assertEqual(self.search("cafe"), ["Café crème"])
+
+    def test_ranking(self):
+        """Test that better matches come first when sorting by rank."""
+        self.add_expense("Uber trip to the airport from the hotel")
+        self.add_expense("Uber")
+        self.add_expense("Uber Uber refund")
+        self.assertEqual(self.search("uber"), ["Uber Uber refund", "Uber", "Uber trip to the airport from the hotel"])
+
+    def test_index_follows_every_write_path(self):
+        """Test that ORM updates and deletes, imports and recurring expenses all reach the index."""
+        expense = self.add_expense("Taxi")
+        self.add_expense("Taxi", user=self.other)
+        self.assertEqual(self.search("taxi"), ["Taxi"])
+
+        expense.description = "Train"
+        db.session.commit()
+        self.assertEqual(self.search("taxi"), [])
+        self.assertEqual(self.search("train"), ["Train"])
+        db.session.delete(expense)
+        db.session.commit()
+        self.assertEqual(self.search("train"), [])
+
+        import_expenses(self.user.id, [(1, {'category': 'Travel', 'description': 'Ferry crossing', 'date': '2024-02-01', 'amount': 30})])
+        db.session.add(RecurringExpense(amount=50.0, type_expense="Travel", description_expense="Ferry pass", recurrence="monthly",
+                                        start_date=datetime(2024, 1, 1), end_date=datetime(2024, 3, 1),
+                                        user_id=self.user.id, category_id=self.category.id))
+        db.session.commit()
+        generate_recurring_expenses(now=datetime(2024, 2, 15))
+        self.assertEqual(sorted(self.search("ferry")), ["Ferry crossing", "Ferry pass", "Ferry pass"])
+
+        # A database written to with the triggers missing is brought back by a rebuild
+        db.session.execute(db.text("INSERT INTO expense_search(expense_search) VALUES ('delete-all')"))
+        db.session.commit()
+        self.assertEqual(self.search("ferry"), [])
+        rebuild_search_index()
+        self.assertEqual(len(self.search("ferry")), 3)
+
+    def test_filters_and_paging(self):
+        """Test that search combines with the /expenses filters and pages by date."""
+        for day in range(1, 11):
+            self.add_expense(f"Bus ticket {day}", day=day)
+        self.add_expense("Bus", user=self.other)
+        self.assertEqual(len(self.search("bus")), 10)
+        self.assertEqual(sorted(self.search("bus", start_date=datetime(2024, 1, 9))), ["Bus ticket 10", "Bus ticket 9"])
+        self.assertEqual(self.search("bus", category="Food"), [])
+        page = self.search("bus", sort_by='date', order='asc', after=(datetime(2024, 1, 8), 8))
+        self.assertEqual(page, ["Bus ticket 9", "Bus ticket 10"])
+        with self.assertRaises(ValueError):
+            self.search("bus", after=(datetime(2024, 1, 8), 8))
+
+class CategorizerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.other = User(user_name="otheruser", email="other@example.com")
+        self.food = Category(name="Food")
+        self.travel = Category(name="Travel")
+        db.session.add_all([self.user, self.other, self.food, self.travel])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_expense(self, description, category, user=None):
+        expense = Expenses(amount=10, description=description, date=datetime(2024, 1, 1),
+                           user_id=(user or self.user).id, category_id=category.id)
+        db.session.add(expense)
+        db.session.commit()
+        return expense
+
+    def assign(self, *descriptions, user=None):
+        rows = [{'description': description, 'category_id': None} for description in descriptions]
+        assign_categories((user or self.user).id, rows)
+        return [row['category_id'] for row in rows]
+
+    def test_features(self):
+        """Test that words and the merchant are features, ignoring case, digits and punctuation."""
+        self.assertEqual(features("UBER trip 12/03"), features("Uber Trip #991"))
+        self.assertEqual(len(features("Uber trip")), 3)
+        self.assertNotEqual(features("Uber Eats"), features("Uber trip"))
+        self.assertEqual(features("12.50 #4"), {})
+
+    def test_index_predicts_most_likely_category(self):
+        """Test that the merchant outweighs a shared word, and unknown descriptions get None."""
+        index = CategoryIndex()
+        for description, category in [("Uber trip", "Travel"), ("Uber trip", "Travel"), ("Uber Eats order", "Food"),
+                                      ("Pizza order", "Food")]:
+            index.add(description, category)
+        self.assertEqual(index.predict("uber trip 7"), "Travel")
+        self.assertEqual(index.predict("Uber Eats"), "Food")
+        self.assertIsNone(index.predict("Dentist"))
+
+    def test_index_follows_every_write_path(self):
+        """Test that ORM adds, updates and deletes, imports and recurring expenses all keep the counts exact."""
+        expense = self.add_expense("Tesco Express", self.food)
+        self.add_expense("Tesco Express", self.travel, user=self.other)
+        self.assertEqual(self.assign("Tesco Extra"), [self.food.id])
+        expense.category_id = self.travel.id
+        expense.description = "Tesco petrol"
+        db.session.commit()
+        self.assertEqual(verify_category_index(), [])
+        db.session.delete(expense)
+        db.session.commit()
+
+        import_expenses(self.user.id, [(1, {'category': 'Travel', 'description': 'Ferry crossing', 'date': '2024-02-01', 'amount': 30})])
+        db.session.add(RecurringExpense(amount=50.0, type_expense="Travel", description_expense="Ferry pass", recurrence="monthly",
+                                        start_date=datetime(2024, 1, 1), end_date=datetime(2024, 3, 1),
+                                        user_id=self.user.id, category_id=self.travel.id))
+        db.session.commit()
+        generate_recurring_expenses(now=datetime(2024, 2, 15))
+        self.assertEqual(verify_category_index(), [])
+        self.assertEqual(self.assign("Ferry"), [self.travel.id])
+        rebuild_category_index()
+        self.assertEqual(verify_category_index(), [])
+
+    def test_assign_uses_batch_labels_and_default(self):
+        """Test that labeled rows teach later ones in the batch and unknown rows get DEFAULT_CATEGORY."""
+        rows = [{'description': 'Gym membership', 'category_id': self.food.id},
+                {'description': 'gym membership March', 'category_id': None},
+                {'description': 'Something new', 'category_id': None}]
+        self.assertEqual(assign_categories(self.user.id, rows), 1)
+        default_id = get_or_create_category_id(self.app.config['DEFAULT_CATEGORY'])
+        self.assertEqual([row['category_id'] for row in rows], [self.food.id, self.food.id, default_id])
+        # Learning from defaulted expenses never predicts the default
+        self.add_expense("Something new", db.session.get(Category, default_id))
+        self.assertEqual(self.assign("Something new"), [default_id])
+        self.assertEqual(self.assign("Gym", user=self.other), [default_id])
+
+    def test_import_categorizes_rows_without_a_category(self):
+        """Test that imported rows without a category are placed from the user's history."""
+        self.add_expense("Pret A Manger", self.food)
+        self.add_expense("Trainline tickets", self.travel)
+        report = import_expenses(self.user.id, [
+            (1, {'description': 'Pret A Manger Soho', 'date': '2024-02-01', 'amount': 5}),
+            (2, {'description': 'Trainline', 'date': '2024-02-02', 'amount': 40, 'category': ''}),
+        ])
+        self.assertEqual((report['imported'], report['categorized']), (2, 2))
+        categories = dict(db.session.query(Expenses.description, Expenses.category_id).filter(Expenses.date >= datetime(2024, 2, 1)))
+        self.assertEqual(categories, {'Pret A Manger Soho': self.food.id, 'Trainline': self.travel.id})
+        self.assertEqual(verify_category_index(), [])
+
+    def test_evaluate_labeled_fixture(self):
+        """Test the categorizer offline against the labeled fixture set."""
+        path = os.path.join(os.path.dirname(__file__), 'fixtures', 'labeled_expenses.csv')
+        with open(path, 'rb') as stream:
+            result = evaluate(read_labeled(stream))
+        self.assertEqual(result['rows'], 300)
+        self.assertGreater(result['precision'], 0.9)
+        self.assertGreater(result['accuracy'], 0.8)
+
+class BudgetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(user_name="testuser", email="test@example.com")
+        self.food = Category(name="Food")
+        self.travel = Category(name="Travel")
+        db.session.add_all([self.user, self.food, self.travel])
+        db.session.commit()
+        self.start = period_bounds('monthly', today())[0]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_budget(self, amount, period='monthly', category=None):
+        budget = Budget(user_id=self.user.id, category_id=(category or self.food).id, period=period, amount=amount)
+        db.session.add(budget)
+        db.session.commit()
+        # Counted on first access
+        current_budgets(self.user.id)
+        db.session.commit()
+        return budget.id
+
+    def add_expense(self, amount, day=None, category=None):
+        expense = Expenses(amount=amount, description="Groceries", date=datetime.combine(day or self.start, datetime.min.time()),
+                           user_id=self.user.id, category_id=(category or self.food).id)
+        db.session.add(expense)
+        db.session.commit()
+        return expense
+
+    def stored(self, budget_id):
+        return db.session.execute(db.select(Budget.__table__).where(Budget.id == budget_id)).mappings().one()
+
+    def spent(self, budget_id):
+        return self.stored(budget_id)['spent_minor']
+
+    def recount(self, budget_id):
+        budget = self.stored(budget_id)
+        return period_spend(db.session.connection(), budget, *period_bounds(budget['period'], budget['period_start']))
+
+    def test_period_bounds(self):
+        """Test weekly periods start on Monday, and month and year ends."""
+        self.assertEqual(period_bounds('weekly', date(2024, 3, 7)), (date(2024, 3, 4), date(2024, 3, 11)))
+        self.assertEqual(period_bounds('monthly', date(2024, 12, 31)), (date(2024, 12, 1), date(2025, 1, 1)))
+        self.assertEqual(period_bounds('yearly', date(2024, 2, 29)), (date(2024, 1, 1), date(2025, 1, 1)))
+
+    def test_counters_follow_every_write_path(self):
+        """Test that ORM writes, imports and recurring expenses keep the period-to-date spend equal to a recount."""
+        budget_id = self.add_budget(1000)
+        expense = self.add_expense(10)
+        self.add_expense(99, category=self.travel)
+        self.add_expense(50, day=self.start - timedelta(days=1))
+        self.assertEqual(self.spent(budget_id), 1000)
+
+        expense.amount = 25
+        db.session.commit()
+        self.assertEqual(self.spent(budget_id), 2500)
+        expense.category_id = self.travel.id
+        db.session.commit()
+        self.assertEqual(self.spent(budget_id), 0)
+        expense.category_id = self.food.id
+        db.session.commit()
+        db.session.delete(expense)
+        db.session.commit()
+        self.assertEqual(self.spent(budget_id), 0)
+
+        import_expenses(self.user.id, [(1, {'category': 'Food', 'description': 'Market', 'date': self.start.isoformat(), 'amount': 12})])
+        db.session.add(RecurringExpense(amount=5.0, type_expense="Food", description_expense="Veg box", recurrence="daily",
+                                        start_date=datetime.combine(self.start, datetime.min.time()),
+                                        end_date=datetime.combine(self.start, datetime.min.time()) + timedelta(days=1),
+                                        user_id=self.user.id, category_id=self.food.id))
+        db.session.commit()
+        generate_recurring_expenses(now=datetime.combine(self.start, datetime.min.time()) + timedelta(days=1))
+        self.assertEqual(self.spent(budget_id), 1200 + 2 * 500)
+        self.assertEqual(self.spent(budget_id), self.recount(budget_id))
+
+    def test_lazy_rollover(self):
+        """Test that a budget left in an ended period is recounted for the current one on first access only."""
+        budget_id = self.add_budget(1000)
+        self.add_expense(30)
+        last_month = period_bounds('monthly', self.start - timedelta(days=1))[0]
+        db.session.execute(db.update(Budget).where(Budget.id == budget_id).values(period_start=last_month, spent_minor=7, alerted_percent=100))
+        db.session.commit()
+
+        [budget] = current_budgets(self.user.id)
+        db.session.commit()
+        self.assertEqual((budget['period_start'], budget['spent_minor'], budget['alerted_percent']), (self.start, 3000, 0))
+        [budget] = current_budgets(self.user.id, day=self.start)
+        self.assertEqual(budget['spent_minor'], 3000)
+
+        # Next month's first write moves it along too, counting the new period from scratch
+        next_month = period_bounds('monthly', self.start)[1]
+        update_budgets(db.session.connection(), [{'user_id': self.user.id, 'category_id': self.food.id,
+                                                  'date': datetime(2024, 1, 1), 'currency': 'GBP', 'amount_minor': 1}], day=next_month)
+        self.assertEqual((self.stored(budget_id)['period_start'], self.spent(budget_id)), (next_month, 0))
+
+    def test_thresholds_notify_once_per_period(self):
+        """Test that reaching alert_percent and then the limit each queue one notification."""
+        self.add_budget(100)
+        self.add_expense(50)
+        self.assertEqual(NotificationOutbox.query.filter_by(type='budget').count(), 0)
+        self.add_expense(30)
+        self.add_expense(5)
+        self.assertEqual([n.message for n in NotificationOutbox.query.filter_by(type='budget')],
+                         ["Monthly budget for Food at 80%: 80.00 of 100.00 GBP spent"])
+        expense = self.add_expense(20)
+        db.session.delete(expense)
+        db.session.commit()
+        self.add_expense(20)
+        messages = [n.message for n in NotificationOutbox.query.filter_by(type='budget').order_by(NotificationOutbox.id)]
+        self.assertEqual(messages[1:], ["Monthly budget for Food used up: 105.00 of 100.00 GBP spent"])
+
 if __name__ == "__main__":
     unittest.main()